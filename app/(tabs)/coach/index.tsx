@@ -43,7 +43,7 @@ export default function CoachScreen() {
   // If provider isn't mounted for some reason, show nothing (or a fallback)
   if (!store) return null;
 
-  const { messages, isLoading, sendMessage, getSuggestions, loadMessages } = store;
+  const { messages, isLoading, sendMessage, persistMessage, getSuggestions, loadMessages, ensureThread } = store;
 
   useEffect(() => {
     loadMessages();
@@ -61,11 +61,17 @@ export default function CoachScreen() {
       const userMessage = inputText.trim();
       setInputText("");
       
+      // With a thread the backend keeps the conversation and stores both messages of the turn,
+      // unless it answers stored: false; without one (offline / signed out) the app sends its
+      // own recent history and stores the messages itself
+      const threadId = await ensureThread();
+      const persist = !threadId;
+
       // Add user message to chat
-      sendMessage(userMessage, "user");
+      sendMessage(userMessage, "user", { persist });
       
       // Prepare chat history for AI context
-      const chatHistory = messages.slice(-10).map(msg => ({
+      const chatHistory = threadId ? undefined : messages.slice(-10).map(msg => ({
         message: msg.sender === "user" ? msg.content : "",
         response: msg.sender === "coach" ? msg.content : "",
         timestamp: msg.timestamp
@@ -73,18 +79,24 @@ export default function CoachScreen() {
       
       // Get AI response
       try {
-        const aiResponse = await queryCoach(userMessage, chatHistory);
+        const aiResponse = await queryCoach(userMessage, chatHistory, threadId ?? undefined);
         if (aiResponse) {
+          // The backend could not store the turn: keep it in the thread from here, in order
+          const storeHere = persist || aiResponse.stored === false;
+          if (!persist && storeHere) await persistMessage(userMessage, "user");
           // Add AI response to chat
-          sendMessage(aiResponse.response, "coach");
+          sendMessage(aiResponse.response, "coach", { persist: storeHere });
+        } else if (!persist) {
+          await persistMessage(userMessage, "user");
         }
       } catch (error) {
         console.error("Failed to get AI response:", error);
+        if (!persist) await persistMessage(userMessage, "user");
         // Fallback to regular coach response
-        sendMessage("I'm having trouble processing your request right now. Let me help you with some general guidance.", "coach");
+        sendMessage("I'm having trouble processing your request right now. Let me help you with some general guidance.", "coach", { persist });
       }
     }
-  }, [inputText, isLoading, aiLoading, sendMessage, queryCoach, messages]);
+  }, [inputText, isLoading, aiLoading, sendMessage, persistMessage, queryCoach, messages, ensureThread]);
 
   const handleSuggestionPress = useCallback((suggestion: string) => {
     setInputText(suggestion);
@@ -6,6 +6,7 @@ import { supabase } from "@/lib/supabase";
 import colors from "@/constants/colors";
 import AsyncStorage from "@react-native-async-storage/async-storage";
 import { useDigmStore } from "@/hooks/useDigmStore";
+import { invalidateCoachContext } from "@/hooks/useAICoach";
 import * as WebBrowser from "expo-web-browser";
 import * as Linking from "expo-linking";
 
@@ -76,6 +77,7 @@ export default function SettingsScreen() {
         .update({ first_name: firstName.trim(), last_name: lastName.trim() })
         .eq("id", user.id);
       if (pErr) throw pErr;
+      invalidateCoachContext();
 
       // email/password via auth
       if (email && email !== (user.email ?? "")) {
@@ -7,6 +7,7 @@ import { supabase } from "@/lib/supabase";
 import colors from "@/constants/colors";
 import { useDigmStore } from "@/hooks/useDigmStore";
 import { goLogin } from "@/lib/nav";
+import { invalidateCoachContext } from "@/hooks/useAICoach";
 
 function pickDueDateFromTimeframe(tf: string) {
   const d = new Date();
@@ -152,6 +153,7 @@ export default function OnboardingFinish() {
               { onConflict: "id" }
             );
           if (profErr) throw profErr;
+          invalidateCoachContext();
 
           // --- 4) Create first goal (if not already created) --------------------
           const title = answers["one_thing"] || "Your #1 Goal";
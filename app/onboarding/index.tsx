@@ -14,6 +14,7 @@ import { supabase } from "@/lib/supabase";
 import { ensureProfile } from "@/lib/supa-user";
 import CreateAccountStep, { SignupValues } from "./CreateAccountStep";
 import { BackHandler, Keyboard } from "react-native";
+import { invalidateCoachContext } from "@/hooks/useAICoach";
 
 type Answers = Record<string, any>;
 
@@ -104,6 +105,7 @@ export default function OnboardingScreen() {
       const { data: u } = await supabase.auth.getUser();
       if (!u?.user || isAnon(u.user)) return true; // skip DB write for anon
       await supabase.from("onboarding_answers").upsert({ user_id: u.user.id, data: newData }, { onConflict: "user_id" });
+      invalidateCoachContext();
       return true;
     } catch (e) {
       console.log("[onboarding] save skipped", e);
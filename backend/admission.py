@@ -0,0 +1,199 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+from cache import TTLCache
+
+
+class AdmissionRejected(Exception):
+    """Raised instead of admitting a call; ``retry_after`` is a hint in seconds"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Rejected ({reason}), retry in {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After value: whole seconds, at least 1"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """``burst`` tokens, refilled continuously at ``rate`` per second"""
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def take(self) -> float:
+        """Take a token; returns 0 on success, else seconds until one is available"""
+        now = self.clock()
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Permit:
+    """One admitted call; release it exactly once when the call is over (extra releases are ignored)"""
+
+    def __init__(self, controller: "AdmissionController", user_id: str, admitted_at: float):
+        self.controller = controller
+        self.user_id = user_id
+        self.admitted_at = admitted_at
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    async def __aenter__(self) -> "Permit":
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """Bounds concurrent calls to an expensive upstream, with a FIFO wait queue and per-user limits.
+
+    At most ``max_concurrent`` calls hold a slot; up to ``max_queue`` more wait
+    for one, each for at most ``queue_timeout`` seconds. Past that, callers are
+    rejected at once with a Retry-After hint instead of piling onto the upstream.
+    Each user also has a token bucket (``user_rate`` calls per second, bursts of
+    ``user_burst``) and at most ``user_concurrency`` calls admitted or waiting,
+    so one client retrying in a loop cannot take the capacity everyone shares.
+    ``user_rate`` or ``user_concurrency`` of 0 disables that limit.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 16,
+        max_queue: int = 64,
+        queue_timeout: float = 10.0,
+        user_rate: float = 20 / 60,
+        user_burst: int = 5,
+        user_concurrency: int = 2,
+        max_users: int = 100_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if max_concurrent <= 0:
+            raise ValueError("max_concurrent must be positive")
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.user_concurrency = user_concurrency
+        self.clock = clock
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # An idle bucket is full again after burst / rate seconds, so expiring it then loses nothing
+        self._buckets = TTLCache(maxsize=max_users, ttl=user_burst / user_rate if user_rate else 1.0, clock=clock)
+        self._in_flight: Dict[str, int] = {}
+        # Smoothed seconds a slot is held, for Retry-After estimates when the queue is full
+        self._hold_seconds: Optional[float] = None
+        self.counters = {"admitted": 0, "queued": 0}
+        self.rejections = {"user_rate": 0, "user_concurrency": 0, "queue_full": 0, "queue_timeout": 0}
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, user_id: str) -> Permit:
+        """Wait for a slot for user_id; raises AdmissionRejected when a limit is hit"""
+        if self.user_concurrency and self._in_flight.get(user_id, 0) >= self.user_concurrency:
+            self._reject("user_concurrency", self._queue_wait_estimate())
+        if self.user_rate:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(self.user_rate, self.user_burst, self.clock)
+            self._buckets.set(user_id, bucket)
+            wait = bucket.take()
+            if wait:
+                self._reject("user_rate", wait)
+
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+        else:
+            if len(self._waiters) >= self.max_queue:
+                self._reject("queue_full", self._queue_wait_estimate())
+            await self._wait_for_slot(user_id)
+
+        self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+        self.counters["admitted"] += 1
+        return Permit(self, user_id, self.clock())
+
+    async def _wait_for_slot(self, user_id: str):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.counters["queued"] += 1
+        # Count the waiter against the user's concurrency while it queues
+        self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # A slot was handed over just as we gave up; pass it on
+                self._release_slot()
+            else:
+                future.cancel()
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("queue_timeout", self._queue_wait_estimate())
+            raise
+        finally:
+            self._forget(user_id)
+
+    def _release(self, permit: Permit):
+        held = self.clock() - permit.admitted_at
+        self._hold_seconds = held if self._hold_seconds is None else 0.8 * self._hold_seconds + 0.2 * held
+        self._forget(permit.user_id)
+        self._release_slot()
+
+    def _release_slot(self):
+        # Hand the slot straight to the oldest waiter so newcomers cannot jump the queue
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _forget(self, user_id: str):
+        count = self._in_flight.get(user_id, 0) - 1
+        if count > 0:
+            self._in_flight[user_id] = count
+        else:
+            self._in_flight.pop(user_id, None)
+
+    def _queue_wait_estimate(self) -> float:
+        """Rough seconds until a new caller would get a slot: the queue ahead of it, drained max_concurrent at a time"""
+        hold = self._hold_seconds if self._hold_seconds is not None else 1.0
+        return hold * (len(self._waiters) // self.max_concurrent + 1)
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejections[reason] += 1
+        raise AdmissionRejected(reason, retry_after)
+
+    def stats(self) -> Dict:
+        return {
+            "active": self.active,
+            "limit": self.max_concurrent,
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            **self.counters,
+            "rejected": dict(self.rejections),
+        }
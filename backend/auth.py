@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+import jwt
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Algorithms Supabase uses for access tokens: the legacy shared secret (HS256)
+# and the asymmetric signing keys published on the project's JWKS endpoint.
+SYMMETRIC_ALGORITHMS = {"HS256"}
+ASYMMETRIC_ALGORITHMS = {"RS256", "ES256"}
+
+VERIFY_MODES = ("local", "remote")
+
+
+class AuthError(Exception):
+    """Raised when an access token cannot be verified"""
+
+
+class TokenVerifier:
+    """Verify Supabase access tokens without a round-trip to Supabase Auth.
+
+    Tokens are checked locally (signature, expiry, audience, issuer) using the
+    project JWT secret or the project's JWKS, which is refreshed in the
+    background (over ``http_client`` when given, so it shares the Auth
+    connection pool). Verified tokens are remembered in a bounded TTL cache until
+    they expire. With ``mode="remote"`` every cache miss is delegated to
+    ``remote_verify`` instead (i.e. Supabase Auth's ``/auth/v1/user``).
+    """
+
+    def __init__(
+        self,
+        supabase_url: str,
+        jwt_secret: Optional[str] = None,
+        mode: str = "local",
+        remote_verify: Optional[Callable[[str], Awaitable[str]]] = None,
+        audience: str = "authenticated",
+        issuer: Optional[str] = None,
+        jwks_refresh_interval: float = 600.0,
+        cache_size: int = 10000,
+        cache_ttl: float = 300.0,
+        leeway: float = 10.0,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ):
+        if mode not in VERIFY_MODES:
+            raise ValueError(f"Unknown auth verify mode '{mode}', expected one of {VERIFY_MODES}")
+        if mode == "remote" and remote_verify is None:
+            raise ValueError("remote_verify is required when mode is 'remote'")
+
+        base_url = supabase_url.rstrip("/")
+        self.mode = mode
+        self.jwt_secret = jwt_secret or None
+        self.remote_verify = remote_verify
+        self.audience = audience
+        self.issuer = issuer or f"{base_url}/auth/v1"
+        self.jwks_url = f"{base_url}/auth/v1/.well-known/jwks.json"
+        self.jwks_refresh_interval = jwks_refresh_interval
+        self.leeway = leeway
+        self.http_client = http_client
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._jwks_fetched_at: Optional[float] = None
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Load the JWKS and keep it fresh in the background"""
+        if self.mode != "local" or self._refresh_task is not None:
+            return
+        await self.refresh_jwks()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def verify(self, token: str) -> str:
+        """Return the user id (``sub``) of a valid token or raise AuthError"""
+        if not token:
+            raise AuthError("Missing token")
+
+        cache_key = hashlib.sha256(token.encode()).hexdigest()
+        user_id = self.cache.get(cache_key)
+        if user_id is not None:
+            return user_id
+
+        if self.mode == "remote":
+            try:
+                user_id = await self.remote_verify(token)
+            except Exception as e:
+                raise AuthError(f"Remote verification failed: {e}") from e
+            if not user_id:
+                raise AuthError("Remote verification returned no user")
+            self.cache.set(cache_key, user_id)
+            return user_id
+
+        claims = await self._decode(token)
+        user_id = claims["sub"]
+        remaining = claims["exp"] - time.time()
+        self.cache.set(cache_key, user_id, ttl=min(self.cache.ttl, remaining))
+        return user_id
+
+    def load_jwks(self, jwks: Dict):
+        """Replace the signing keys with the keys of a JWKS document"""
+        keys = {}
+        if jwks.get("keys"):
+            for jwk in jwt.PyJWKSet.from_dict(jwks).keys:
+                if jwk.key_id:
+                    keys[jwk.key_id] = jwk
+        self._keys = keys
+        self._jwks_fetched_at = time.monotonic()
+
+    async def refresh_jwks(self):
+        """Fetch the JWKS from Supabase; failures keep the previous key set"""
+        async with self._refresh_lock:
+            try:
+                if self.http_client is not None:
+                    response = await self.http_client.get(self.jwks_url)
+                else:
+                    async with httpx.AsyncClient(timeout=5.0) as client:
+                        response = await client.get(self.jwks_url)
+                response.raise_for_status()
+                self.load_jwks(response.json())
+                logger.info(f"🔑 Loaded {len(self._keys)} signing keys from JWKS")
+            except Exception as e:
+                # Projects that only use the legacy JWT secret publish an empty key set
+                logger.warning(f"⚠️ Could not refresh JWKS: {e}")
+                self._jwks_fetched_at = time.monotonic()
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.jwks_refresh_interval)
+            await self.refresh_jwks()
+
+    async def _decode(self, token: str) -> Dict:
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            raise AuthError(f"Malformed token: {e}") from e
+
+        algorithm = header.get("alg")
+        if algorithm in SYMMETRIC_ALGORITHMS:
+            if not self.jwt_secret:
+                raise AuthError("HS256 token received but SUPABASE_JWT_SECRET is not configured")
+            key = self.jwt_secret
+        elif algorithm in ASYMMETRIC_ALGORITHMS:
+            key = await self._signing_key(header.get("kid"))
+        else:
+            raise AuthError(f"Unsupported token algorithm: {algorithm}")
+
+        try:
+            return jwt.decode(
+                token,
+                key=key,
+                algorithms=[algorithm],
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.leeway,
+                options={"require": ["exp", "sub"]},
+            )
+        except jwt.PyJWTError as e:
+            raise AuthError(f"Invalid token: {e}") from e
+
+    async def _signing_key(self, kid: Optional[str]):
+        jwk = self._keys.get(kid)
+        if jwk is None:
+            # Unknown kid usually means the keys were rotated; refresh at most
+            # once per minute so garbage tokens cannot hammer the JWKS endpoint.
+            if self._jwks_fetched_at is None or time.monotonic() - self._jwks_fetched_at > 60:
+                await self.refresh_jwks()
+                jwk = self._keys.get(kid)
+        if jwk is None:
+            raise AuthError(f"No signing key found for kid '{kid}'")
+        return jwk.key
@@ -0,0 +1,327 @@
+"""
+Local stand-ins for Supabase (PostgREST + Auth) and OpenAI, used by bench.load.
+
+Both are small FastAPI apps served by uvicorn on localhost. They answer just
+enough of each API for the coach and embedding paths, hold seeded synthetic
+users in memory, and inject latency, jitter and errors so the backend can be
+measured against a slow or flaky upstream. Every call is counted per route.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import jwt
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+MOODS = ("great", "good", "okay", "tired", "stressed", "sad")
+WORDS = (
+    "run marathon read pages write book launch app sleep early train gym meditate cook budget save "
+    "call family learn spanish ship feature focus deep work journal reflect walk stretch plan week"
+).split()
+
+
+@dataclass(frozen=True)
+class FakeUpstreamConfig:
+    """Behaviour of one fake upstream"""
+    latency_ms: float = 20.0        # added to every response
+    jitter_ms: float = 5.0          # uniform +/- around latency_ms
+    error_rate: float = 0.0         # share of requests answered with error_status
+    error_status: int = 503
+    token_interval_ms: float = 5.0  # OpenAI: delay between streamed tokens
+    completion_tokens: int = 60     # OpenAI: tokens per completion
+    dimensions: int = 1536          # OpenAI: embedding size
+
+
+class FakeUpstream:
+    """Latency/error injection and per-route call counting shared by the fakes"""
+
+    def __init__(self, name: str, config: FakeUpstreamConfig, seed: int = 0):
+        self.name = name
+        self.config = config
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.rng = random.Random(seed)
+        self.app = FastAPI()
+
+    async def delay(self, route: str, config: Optional[FakeUpstreamConfig] = None) -> Optional[Response]:
+        """Count the call, sleep for the configured latency; an error response if one was drawn"""
+        config = config or self.config
+        self.calls[route] += 1
+        jitter = self.rng.uniform(-config.jitter_ms, config.jitter_ms)
+        await asyncio.sleep(max(0.0, config.latency_ms + jitter) / 1000)
+        if self.rng.random() < config.error_rate:
+            self.errors[route] += 1
+            return JSONResponse({"message": f"injected {config.error_status}"}, status_code=config.error_status)
+        return None
+
+    def reset_counts(self):
+        self.calls.clear()
+        self.errors.clear()
+
+
+def synthetic_users(count: int, goals: int, tasks: int, journals: int, seed: int = 0) -> Dict[str, Dict]:
+    """Seeded users with profile, onboarding answers, goals, tasks and journal entries"""
+    rng = random.Random(seed)
+
+    def text(words):
+        return " ".join(rng.choice(WORDS) for _ in range(words))
+
+    users = {}
+    for _ in range(count):
+        user_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        user_goals = [{
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'user_id': user_id,
+            'title': text(4).capitalize(),
+            'description': text(15),
+            'due_date': f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            'progress': rng.randint(0, 100),
+            'timeframe': rng.choice(["week", "month", "year"]),
+        } for _ in range(goals)]
+        users[user_id] = {
+            'profile': {'id': user_id, 'first_name': f"User{len(users)}", 'vision': text(20), 'level': rng.randint(1, 10), 'xp': rng.randint(0, 5000)},
+            'onboarding': [{"What do you want to achieve?": text(12), "What stops you?": text(10)}],
+            'goals': user_goals,
+            'tasks': [{
+                'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                'user_id': user_id,
+                'title': text(5).capitalize(),
+                'description': text(10),
+                'status': rng.choice(["todo", "in_progress", "done"]),
+                'is_high_impact': rng.random() < 0.3,
+                'goal_id': rng.choice(user_goals)['id'] if user_goals else None,
+            } for _ in range(tasks)],
+            'journal_entries': [{
+                'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                'user_id': user_id,
+                'content': ". ".join(text(rng.randint(8, 20)).capitalize() for _ in range(rng.randint(2, 30))) + ".",
+                'mood': rng.choice(MOODS),
+                'created_at': f"2025-04-{rng.randint(1, 30):02d}T{rng.randint(0, 23):02d}:00:00+00:00",
+            } for _ in range(journals)],
+        }
+    return users
+
+
+def _filters(request: Request) -> Dict[str, List[str]]:
+    """PostgREST filters from the query string: {"user_id": ["a"], "id": ["a", "b"]} for eq. and in."""
+    filters = {}
+    for column, value in request.query_params.multi_items():
+        if value.startswith("eq."):
+            filters[column] = [value[3:]]
+        elif value.startswith("in.("):
+            filters[column] = [v.strip('"') for v in value[4:-1].split(",") if v]
+    return filters
+
+
+class FakeSupabase(FakeUpstream):
+    """PostgREST tables and RPCs the backend uses, plus the Auth JWKS and /user endpoints"""
+
+    def __init__(self, users: Dict[str, Dict], config: FakeUpstreamConfig = FakeUpstreamConfig(), seed: int = 0):
+        super().__init__("supabase", config, seed)
+        self.users = users
+        self.embeddings: Dict[tuple, Dict] = {}
+        app = self.app
+
+        @app.get("/auth/v1/.well-known/jwks.json")
+        async def jwks():
+            return await self.delay("auth/jwks") or {"keys": []}
+
+        @app.get("/auth/v1/user")
+        async def auth_user(request: Request):
+            token = request.headers.get("authorization", "").removeprefix("Bearer ")
+            return await self.delay("auth/user") or {"id": jwt.decode(token, options={"verify_signature": False})["sub"]}
+
+        @app.post("/rest/v1/rpc/{function}")
+        async def rpc(function: str, request: Request):
+            error = await self.delay(f"rpc/{function}")
+            if error:
+                return error
+            params = json.loads(await request.body() or b"{}")
+            user = self.users.get(params.get('user_id_param') or params.get('user_id_filter'), {})
+            if function == "get_user_snapshot":
+                include_profile = params.get('include_profile', True)
+                return {
+                    'profile': user.get('profile') if include_profile else None,
+                    'onboarding': user.get('onboarding', []) if include_profile else [],
+                    'goals': user.get('goals', []),
+                    'tasks': [{**task, 'is_completed': task['status'] == 'done'} for task in user.get('tasks', [])],
+                    'journals': sorted(user.get('journal_entries', []), key=lambda j: j['created_at'], reverse=True)[:50],
+                }
+            if function.startswith("match_documents"):
+                return self._matches(user, params.get('match_count', 10))
+            return []
+
+        @app.get("/rest/v1/{table}")
+        async def select(table: str, request: Request):
+            error = await self.delay(f"select/{table}")
+            if error:
+                return error
+            rows = self._rows(table, _filters(request))
+            if "vnd.pgrst.object" in request.headers.get("accept", ""):
+                return rows[0] if rows else JSONResponse({"message": "no rows"}, status_code=406)
+            return rows
+
+        @app.post("/rest/v1/{table}")
+        async def upsert(table: str, request: Request):
+            error = await self.delay(f"upsert/{table}")
+            if error:
+                return error
+            rows = json.loads(await request.body() or b"[]")
+            rows = rows if isinstance(rows, list) else [rows]
+            if table == "user_embeddings":
+                for row in rows:
+                    key = (row['user_id'], row['content_type'], str(row['content_id']), row.get('chunk_index', 0))
+                    stored = self.embeddings.get(key, {'id': str(uuid.uuid4())})
+                    # Vectors are not kept, only what the sync diffs against
+                    stored.update({k: v for k, v in row.items() if k != 'embedding'})
+                    self.embeddings[key] = stored
+            return JSONResponse([], status_code=201)
+
+        @app.delete("/rest/v1/{table}")
+        async def delete(table: str, request: Request):
+            error = await self.delay(f"delete/{table}")
+            if error:
+                return error
+            ids = set(_filters(request).get('id', []))
+            for key in [key for key, row in self.embeddings.items() if row['id'] in ids]:
+                del self.embeddings[key]
+            return []
+
+    def _rows(self, table: str, filters: Dict[str, List[str]]) -> List[Dict]:
+        if table == "user_embeddings":
+            rows = list(self.embeddings.values())
+        elif table == "profiles":
+            rows = [user['profile'] for user in self.users.values()]
+        else:
+            rows = [row for user in self.users.values() for row in user.get(table, [])]
+        return [row for row in rows if all(str(row.get(column)) in values for column, values in filters.items())]
+
+    def _matches(self, user: Dict, count: int) -> List[Dict]:
+        """match_documents rows as if the user's items were embedded, best first"""
+        items = (
+            [('goal', goal['id'], goal['title']) for goal in user.get('goals', [])]
+            + [('task', task['id'], task['title']) for task in user.get('tasks', [])]
+            + [('journal', entry['id'], entry['content'][:400]) for entry in user.get('journal_entries', [])]
+        )
+        picked = self.rng.sample(items, min(count, len(items)))
+        return [{
+            'id': str(uuid.uuid4()),
+            'content_type': content_type,
+            'content_id': content_id,
+            'content_text': text,
+            'metadata': {},
+            'similarity': round(0.9 - 0.03 * rank, 3),
+        } for rank, (content_type, content_id, text) in enumerate(picked)]
+
+
+class FakeOpenAI(FakeUpstream):
+    """/v1/embeddings and /v1/chat/completions (plain and streamed) with fake content.
+
+    ``models`` overrides the behaviour per chat model, e.g. a slow or failing
+    strong model next to a healthy fast one; ``model_calls`` counts each.
+    """
+
+    def __init__(self, config: FakeUpstreamConfig = FakeUpstreamConfig(latency_ms=300.0, jitter_ms=50.0), seed: int = 0,
+                 models: Optional[Dict[str, FakeUpstreamConfig]] = None):
+        super().__init__("openai", config, seed)
+        self.models = models or {}
+        self.model_calls: Counter = Counter()
+        app = self.app
+
+        @app.post("/v1/embeddings")
+        async def embeddings(request: Request):
+            error = await self.delay("embeddings")
+            if error:
+                return error
+            body = json.loads(await request.body())
+            inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+            return {
+                'object': 'list',
+                'model': body.get('model'),
+                'data': [{'object': 'embedding', 'index': i, 'embedding': self._vector(text)} for i, text in enumerate(inputs)],
+                'usage': {'prompt_tokens': sum(len(t) // 4 + 1 for t in inputs), 'total_tokens': sum(len(t) // 4 + 1 for t in inputs)},
+            }
+
+        @app.post("/v1/chat/completions")
+        async def completions(request: Request):
+            body = json.loads(await request.body())
+            config = self.models.get(body.get('model'), self.config)
+            self.model_calls[body.get('model')] += 1
+            error = await self.delay("chat/completions", config)
+            if error:
+                return error
+            prompt_tokens = sum(len(str(m.get('content', ''))) // 4 + 4 for m in body.get('messages', []))
+            tokens = [self.rng.choice(WORDS) + " " for _ in range(config.completion_tokens)]
+            usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens), 'total_tokens': prompt_tokens + len(tokens)}
+            base = {'id': f"chatcmpl-{uuid.uuid4().hex[:12]}", 'created': int(time.time()), 'model': body.get('model')}
+            if not body.get('stream'):
+                await asyncio.sleep(len(tokens) * config.token_interval_ms / 1000)
+                return {
+                    **base,
+                    'object': 'chat.completion',
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': "".join(tokens)}, 'finish_reason': 'stop'}],
+                    'usage': usage,
+                }
+
+            async def stream():
+                for token in tokens:
+                    await asyncio.sleep(config.token_interval_ms / 1000)
+                    chunk = {**base, 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+    def reset_counts(self):
+        super().reset_counts()
+        self.model_calls.clear()
+
+    def _vector(self, text: str) -> List[float]:
+        # Deterministic per text, so the embedding cache behaves as it would with the real API
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+        rng = random.Random(seed)
+        return [round(rng.uniform(-1, 1), 4) for _ in range(self.config.dimensions)]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread:
+    """Serve an ASGI app with uvicorn on a background thread"""
+
+    def __init__(self, app, port: Optional[int] = None):
+        self.port = port or free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="off"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "ServerThread":
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError(f"Fake server on port {self.port} did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
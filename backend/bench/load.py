@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Load test the backend end to end against local Supabase/OpenAI stand-ins.
+
+    cd backend
+    python -m bench.load
+    python -m bench.load --scenarios query,stream --concurrency 1,8,32 --requests 200
+    python -m bench.load --openai-latency 800 --openai-error-rate 0.05
+    python -m bench.load --model-latency gpt-4=1500 --model-latency gpt-4o-mini=250
+    python -m bench.load --json bench-HEAD.json --compare bench-main.json
+
+The app runs unmodified in a uvicorn subprocess; only its SUPABASE_URL and
+OPENAI_BASE_URL point at the fakes in bench/fakes.py, which serve seeded
+synthetic users with configurable latency, streaming speed and error rates.
+Each scenario sends a fixed number of requests at each concurrency level and
+reports latency percentiles, throughput and upstream calls per request.
+
+Runs are deterministic for a given seed and options, and --json records them
+with the commit they ran on, so two commits can be compared with --compare
+(run both on the same machine).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field, replace
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import jwt
+import numpy as np
+
+from bench.fakes import FakeOpenAI, FakeSupabase, FakeUpstreamConfig, ServerThread, free_port, synthetic_users
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+JWT_SECRET = "bench-jwt-secret-at-least-32-bytes-long"
+SCENARIOS = ("query", "stream", "embeddings")
+MESSAGES = (
+    "I keep putting off my most important goal, what should I do today?",
+    "How is my marathon training going?",
+    "I felt stressed all week and skipped my tasks.",
+    "Which task should I focus on first?",
+)
+
+
+@dataclass
+class Result:
+    scenario: str
+    concurrency: int
+    requests: int
+    errors: int
+    seconds: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    rps: float
+    first_token_p50_ms: Optional[float] = None
+    fallbacks: int = 0          # coach answers replaced by the fallback message
+    injected_errors: int = 0    # error responses the fakes handed out
+    upstream_calls: Dict[str, float] = field(default_factory=dict)  # per request
+    backend_upstream: Dict[str, float] = field(default_factory=dict)  # the app's own transport counters
+
+    @classmethod
+    def build(cls, scenario, concurrency, latencies, errors, seconds, first_tokens, calls, injected, backend):
+        done = len(latencies) + errors
+        percentile = lambda p: round(float(np.percentile(latencies, p)), 1) if latencies else float("nan")
+        return cls(
+            scenario=scenario,
+            concurrency=concurrency,
+            requests=done,
+            errors=errors,
+            seconds=round(seconds, 3),
+            p50_ms=percentile(50),
+            p95_ms=percentile(95),
+            p99_ms=percentile(99),
+            rps=round(done / seconds, 1) if seconds else 0.0,
+            first_token_p50_ms=round(float(np.percentile(first_tokens, 50)), 1) if first_tokens else None,
+            fallbacks=int(backend.pop("coach_errors", 0)),
+            injected_errors=injected,
+            upstream_calls={route: round(count / max(done, 1), 2) for route, count in sorted(calls.items())},
+            backend_upstream={key: value for key, value in sorted(backend.items()) if value},
+        )
+
+
+def scrape(text: str) -> Dict[str, float]:
+    """Coach fallbacks and per-upstream transport events from the app's /metrics"""
+    values: Dict[str, float] = {}
+    for line in text.splitlines():
+        if line.startswith("digm_coach_errors_total"):
+            values["coach_errors"] = values.get("coach_errors", 0.0) + float(line.rsplit(" ", 1)[1])
+        elif line.startswith("digm_upstream_events_total{"):
+            labels = dict(part.replace('"', '').split("=", 1) for part in line[line.index("{") + 1:line.index("}")].split(","))
+            key = f"{labels['upstream']}:{labels['event']}"
+            if not key.endswith(":requests"):
+                values[key] = float(line.rsplit(" ", 1)[1])
+    return values
+
+
+def token_for(user_id: str, supabase_url: str) -> str:
+    now = int(time.time())
+    return jwt.encode(
+        {"sub": user_id, "aud": "authenticated", "role": "authenticated", "iss": f"{supabase_url}/auth/v1", "iat": now, "exp": now + 3600},
+        JWT_SECRET,
+        algorithm="HS256",
+    )
+
+
+class Backend:
+    """The FastAPI app in a uvicorn subprocess, wired to the fakes through its environment"""
+
+    def __init__(self, supabase_url: str, openai_url: str, env: Dict[str, str]):
+        self.port = free_port()
+        self.workdir = tempfile.TemporaryDirectory()
+        self.env = {
+            **os.environ,
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"{openai_url}/v1",
+            "SUPABASE_URL": supabase_url,
+            "SUPABASE_ANON_KEY": "bench",
+            "SUPABASE_SERVICE_ROLE_KEY": "bench",
+            "SUPABASE_JWT_SECRET": JWT_SECRET,
+            "AUTH_VERIFY_MODE": "local",
+            "EMBEDDING_CACHE_PATH": "",
+            "EMBEDDING_JOBS_DB": os.path.join(self.workdir.name, "jobs.sqlite3"),
+            "VECTOR_STORE_PATH": os.path.join(self.workdir.name, "vector_store"),
+            # Measure the full pipeline: a repeated (user, message) would be answered from the result cache
+            "COACH_RESULT_CACHE_TTL": "0",
+            **env,
+        }
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "Backend":
+        # The app logs every request at INFO; keep that out of the report
+        self.log_path = os.path.join(self.workdir.name, "backend.log")
+        self.log = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"],
+            cwd=BACKEND_DIR,
+            env=self.env,
+            stdout=self.log,
+            stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Backend exited with code {self.process.returncode}:\n{Path(self.log_path).read_text()[-4000:]}")
+            try:
+                if httpx.get(f"{self.url}/health", timeout=1).status_code == 200:
+                    return self
+            except httpx.TransportError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError("Backend did not become healthy in 30s")
+
+    def __exit__(self, *exc):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.log.close()
+        self.workdir.cleanup()
+
+
+async def coach_query(client, user_id, headers, n):
+    response = await client.post("/api/coach/query", json={"message": MESSAGES[n % len(MESSAGES)]}, headers=headers)
+    response.raise_for_status()
+    return None
+
+
+async def coach_stream(client, user_id, headers, n):
+    started = time.perf_counter()
+    first_token = None
+    async with client.stream("POST", "/api/coach/stream", json={"message": MESSAGES[n % len(MESSAGES)]}, headers=headers) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if first_token is None and line == "event: token":
+                first_token = (time.perf_counter() - started) * 1000
+            if line == "event: error":
+                raise RuntimeError("coach stream returned an error event")
+    return first_token
+
+
+async def embeddings_job(client, user_id, headers, n):
+    """Queue a full re-embed and wait for the job, so latency covers the whole sync"""
+    response = await client.post("/api/embeddings/generate", json={"user_id": user_id, "force": True}, headers=headers)
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    while True:
+        job = (await client.get(f"/api/embeddings/jobs/{job_id}", headers=headers)).json()
+        if job["status"] == "failed":
+            raise RuntimeError(job.get("error"))
+        if job["status"] == "succeeded":
+            return None
+        await asyncio.sleep(0.02)
+
+
+DRIVERS = {"query": coach_query, "stream": coach_stream, "embeddings": embeddings_job}
+
+
+async def run_level(base_url, scenario, concurrency, requests, users, tokens, warmup, reset_counts):
+    driver = DRIVERS[scenario]
+    user_ids = list(users)
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        async def call(n):
+            # Consecutive requests go to different users, so no two in flight share a user
+            user_id = user_ids[n % len(user_ids)]
+            return await driver(client, user_id, {"Authorization": f"Bearer {tokens[user_id]}"}, n)
+
+        for n in range(warmup):
+            await call(n)
+        reset_counts()
+        before = scrape((await client.get("/metrics")).text)
+
+        latencies, first_tokens, errors = [], [], 0
+        next_request = 0
+
+        async def worker():
+            nonlocal next_request, errors
+            while next_request < requests:
+                n = next_request
+                next_request += 1
+                started = time.perf_counter()
+                try:
+                    first_token = await call(n)
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+                if first_token is not None:
+                    first_tokens.append(first_token)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        seconds = time.perf_counter() - started
+        after = scrape((await client.get("/metrics")).text)
+        backend = {key: value - before.get(key, 0.0) for key, value in after.items()}
+        return latencies, errors, seconds, first_tokens, backend
+
+
+def print_results(results: List[Result], baseline: Optional[Dict] = None):
+    previous = {(r["scenario"], r["concurrency"]): r for r in (baseline or {}).get("results", [])}
+    print(f"\n{'scenario':<11} {'conc':>4} {'reqs':>5} {'err':>4} {'fallbk':>6} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ttft p50':>9}  upstream calls / request")
+    for r in results:
+        ttft = f"{r.first_token_p50_ms:>9.1f}" if r.first_token_p50_ms is not None else f"{'-':>9}"
+        calls = ", ".join(f"{route}={count:g}" for route, count in r.upstream_calls.items())
+        print(f"{r.scenario:<11} {r.concurrency:>4} {r.requests:>5} {r.errors:>4} {r.fallbacks:>6} {r.rps:>7.1f} {r.p50_ms:>8.1f} {r.p95_ms:>8.1f} {r.p99_ms:>8.1f} {ttft}  {calls}")
+        if r.injected_errors or r.backend_upstream:
+            events = ", ".join(f"{key}={value:g}" for key, value in r.backend_upstream.items())
+            print(f"{'':<11} {'':>4} {'':>5} {'':>4} {'':>6} injected errors {r.injected_errors}; app transport: {events or 'clean'}")
+        old = previous.get((r.scenario, r.concurrency))
+        if old:
+            delta = lambda key: f"{(getattr(r, key) - old[key]) / old[key]:+.0%}" if old[key] else "n/a"
+            print(f"{'':<11} {'':>4} {'':>5} {'':>4} {'':>6} {delta('rps'):>7} {delta('p50_ms'):>8} {delta('p95_ms'):>8} {delta('p99_ms'):>8}   vs {baseline.get('commit', '?')}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="query,stream,embeddings", help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="measured requests per scenario and level")
+    parser.add_argument("--warmup", type=int, default=4, help="unmeasured requests before each level")
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--goals", type=int, default=5)
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--journals", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--supabase-latency", type=float, default=15.0, help="ms per PostgREST/Auth call")
+    parser.add_argument("--supabase-error-rate", type=float, default=0.0)
+    parser.add_argument("--openai-latency", type=float, default=300.0, help="ms before an OpenAI response starts")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=MS",
+                        help="chat completion latency of one model (e.g. the fast routing tier), repeatable")
+    parser.add_argument("--token-interval", type=float, default=5.0, help="ms between streamed completion tokens")
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra backend environment, repeatable")
+    parser.add_argument("--json", help="write results (and options, commit) to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to diff against")
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios {sorted(unknown)}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    users = synthetic_users(args.users, args.goals, args.tasks, args.journals, seed=args.seed)
+    supabase = FakeSupabase(users, FakeUpstreamConfig(
+        latency_ms=args.supabase_latency, jitter_ms=args.supabase_latency / 4, error_rate=args.supabase_error_rate
+    ), seed=args.seed)
+    openai_config = FakeUpstreamConfig(
+        latency_ms=args.openai_latency, jitter_ms=args.openai_latency / 6, error_rate=args.openai_error_rate,
+        token_interval_ms=args.token_interval, completion_tokens=args.completion_tokens
+    )
+    models = {
+        model: replace(openai_config, latency_ms=float(ms), jitter_ms=float(ms) / 6)
+        for model, ms in (item.split("=", 1) for item in args.model_latency)
+    }
+    openai = FakeOpenAI(openai_config, seed=args.seed, models=models)
+    extra_env = dict(item.split("=", 1) for item in args.env)
+
+    results = []
+    with ServerThread(supabase.app) as supabase_server, ServerThread(openai.app) as openai_server:
+        with Backend(supabase_server.url, openai_server.url, extra_env) as backend:
+            tokens = {user_id: token_for(user_id, supabase_server.url) for user_id in users}
+            print(f"{len(users)} users x ({args.goals} goals, {args.tasks} tasks, {args.journals} journals); "
+                  f"supabase {args.supabase_latency:g}ms, openai {args.openai_latency:g}ms, commit {git_commit()}")
+            for scenario in scenarios:
+                for concurrency in levels:
+                    def reset_counts():
+                        supabase.reset_counts()
+                        openai.reset_counts()
+
+                    latencies, errors, seconds, first_tokens, backend_counts = asyncio.run(
+                        run_level(backend.url, scenario, concurrency, args.requests, users, tokens, args.warmup, reset_counts)
+                    )
+                    calls = {f"supabase:{k}": v for k, v in supabase.calls.items()}
+                    calls.update({f"openai:{k}": v for k, v in openai.calls.items()})
+                    calls.update({f"openai:model/{k}": v for k, v in openai.model_calls.items()})
+                    injected = sum(supabase.errors.values()) + sum(openai.errors.values())
+                    results.append(Result.build(
+                        scenario, concurrency, latencies, errors, seconds, first_tokens, calls, injected, backend_counts
+                    ))
+                    print_results(results[-1:])
+
+    print_results(results, baseline)
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "commit": git_commit(),
+            "options": vars(args),
+            "results": [asdict(r) for r in results],
+        }, indent=2))
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Recall / latency / memory of the local vector store's quantization modes.
+
+    cd backend
+    python -m bench.quantization
+    python -m bench.quantization --vectors path/to/embeddings.npy
+
+Without --vectors the corpus is synthetic: unit vectors scattered around a
+few hundred topic centres, which is closer to real embedding neighbourhoods
+than uniform noise. Queries are perturbed corpus vectors. Recall@k is measured
+against exact float32 search over the same matrix.
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+import numpy as np
+
+from vector_store import QUANTIZATIONS, LocalVectorStore
+
+
+def synthetic_corpus(n, dimensions, topics, rng):
+    centres = rng.standard_normal((topics, dimensions), dtype=np.float32)
+    vectors = centres[rng.integers(0, topics, n)] + 0.6 * rng.standard_normal((n, dimensions), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+async def run(corpus, queries, k):
+    rows = [{'content_type': 'journal', 'content_id': str(i), 'content_text': '', 'metadata': {}} for i in range(len(corpus))]
+    exact = None
+    print(f"{len(corpus)} vectors x {corpus.shape[1]}d, {len(queries)} queries, top-{k}\n")
+    print(f"{'mode':<8} {'rerank':>6} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'resident':>10} {'vs float32':>10}")
+    for mode in QUANTIZATIONS:
+        with tempfile.TemporaryDirectory() as path:
+            store = LocalVectorStore(None, path, quantization=mode)
+            store._write_files("bench", rows, corpus)
+            await store._vectors("bench")
+
+            found, samples = [], []
+            for q in queries:
+                started = time.perf_counter()
+                matches = await store.search("bench", q, -1.0, k)
+                samples.append((time.perf_counter() - started) * 1000)
+                found.append({m['content_id'] for m in matches})
+            if exact is None:
+                exact = found
+            recall = np.mean([len(f & e) / k for f, e in zip(found, exact)])
+            resident = store.stats()['bytes']
+            baseline = corpus.nbytes
+            print(
+                f"{mode:<8} {store.rerank_factor:>6} {recall:>9.3f} {np.percentile(samples, 50):>8.3f} "
+                f"{np.percentile(samples, 95):>8.3f} {resident / 1e6:>8.2f}MB {resident / baseline:>10.1%}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", help=".npy file of real embeddings (rows x dimensions)")
+    parser.add_argument("--size", type=int, default=5000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=18)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.vectors:
+        corpus = np.load(args.vectors).astype(np.float32)
+        corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    else:
+        corpus = synthetic_corpus(args.size, args.dimensions, args.topics, rng)
+    picks = corpus[rng.integers(0, len(corpus), args.queries)]
+    queries = picks + 0.5 * rng.standard_normal(picks.shape, dtype=np.float32) / np.sqrt(corpus.shape[1])
+    asyncio.run(run(corpus, queries, args.top_k))
+
+
+if __name__ == "__main__":
+    main()
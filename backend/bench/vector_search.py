@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark the in-process vector store against pgvector's match_documents.
+
+    cd backend
+    python -m bench.vector_search                      # local store only
+    python -m bench.vector_search --user USER_UUID     # also time match_documents
+
+Timing match_documents needs SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY (the
+function runs with the caller's row-level security) and a user who already
+has embeddings.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from vector_store import LocalVectorStore, PgVectorBackend
+
+DIMENSIONS = 1536
+
+
+def percentile(samples, p):
+    return float(np.percentile(samples, p)) if samples else float("nan")
+
+
+def report(name, samples_ms):
+    print(f"  {name:<28} p50 {percentile(samples_ms, 50):8.3f} ms   p95 {percentile(samples_ms, 95):8.3f} ms")
+
+
+async def bench_local(sizes, queries, top_k, batch):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as path:
+        store = LocalVectorStore(supabase_client=None, path=path, max_users=len(sizes))
+        for n in sizes:
+            user_id = f"bench-{n}"
+            rows = [{'content_type': 'journal', 'content_id': str(i), 'content_text': '', 'metadata': {}} for i in range(n)]
+            store._write_files(user_id, rows, rng.standard_normal((n, DIMENSIONS), dtype=np.float32))
+            query_vectors = rng.standard_normal((queries, DIMENSIONS), dtype=np.float32)
+
+            started = time.perf_counter()
+            await store._vectors(user_id)  # cold: memory-map from disk
+            cold_ms = (time.perf_counter() - started) * 1000
+
+            single = []
+            for q in query_vectors:
+                started = time.perf_counter()
+                await store.search(user_id, q, -1.0, top_k)
+                single.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            for start in range(0, queries, batch):
+                await store.search_many(user_id, query_vectors[start:start + batch], -1.0, top_k)
+            batched_ms = (time.perf_counter() - started) * 1000
+
+            print(f"local store, {n} vectors x {DIMENSIONS}d ({n * DIMENSIONS * 4 / 1e6:.1f} MB mapped), cold load {cold_ms:.2f} ms")
+            report("single query", single)
+            print(f"  {'batched (' + str(batch) + ' per call)':<28} {batched_ms / queries:8.3f} ms/query")
+
+
+async def bench_pgvector(user_id, queries, top_k):
+    from supabase import AsyncClient
+
+    supabase = AsyncClient(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_ROLE_KEY"])
+    backend = PgVectorBackend(supabase)
+    store = LocalVectorStore(supabase, path=tempfile.mkdtemp(), max_users=1)
+    rng = np.random.default_rng(1)
+    query_vectors = rng.standard_normal((queries, DIMENSIONS), dtype=np.float32)
+
+    started = time.perf_counter()
+    vectors = await store._vectors(user_id)
+    print(f"user {user_id}: {len(vectors.rows)} vectors, local fetch + write {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    for name, search in (("match_documents (pgvector)", backend.search), ("local store", store.search)):
+        samples = []
+        for q in query_vectors:
+            started = time.perf_counter()
+            await search(user_id, q.tolist(), -1.0, top_k)
+            samples.append((time.perf_counter() - started) * 1000)
+        report(name, samples)
+
+    # Same top-k from both backends?
+    overlap = []
+    for q in query_vectors[:20]:
+        remote = {row['content_id'] for row in await backend.search(user_id, q.tolist(), -1.0, top_k)}
+        local = {row['content_id'] for row in await store.search(user_id, q, -1.0, top_k)}
+        overlap.append(len(remote & local) / max(len(local), 1))
+    print(f"  top-{top_k} agreement with pgvector: {statistics.mean(overlap):.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 5000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=18)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--user", help="also time match_documents for this user")
+    args = parser.parse_args()
+
+    asyncio.run(bench_local(args.sizes, args.queries, args.top_k, args.batch))
+    if args.user:
+        asyncio.run(bench_pgvector(args.user, args.queries, args.top_k))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import re
+from typing import Iterator, List, Tuple
+
+# Long journal entries are embedded as overlapping chunks of about this size, so
+# each vector covers one train of thought and the prompt can quote the part that matched
+CHUNK_MAX_TOKENS = 120
+CHUNK_OVERLAP_TOKENS = 24
+
+# Sentence ends: terminal punctuation (plus closing quotes/brackets) followed by
+# whitespace, or a line break
+_SENTENCE_END = re.compile(r"(?:(?<=[.!?…])|(?<=[.!?…][\"'”’)\]]))\s+|\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def iter_sentences(text: str) -> Iterator[str]:
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        sentence = text[start:match.start()].strip()
+        if sentence:
+            yield sentence
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        yield tail
+
+
+def _slice_word(word: str, max_tokens: int) -> Iterator[str]:
+    """Cut a single word that alone exceeds max_tokens (unspaced scripts, pasted URLs) into fixed-width pieces"""
+    width = max(1, (max_tokens - 1) * 4)
+    for start in range(0, len(word), width):
+        yield word[start:start + width]
+
+
+def _split_long(sentence: str, max_tokens: int) -> Iterator[str]:
+    """Word-wrap a sentence that alone exceeds max_tokens, slicing words that are too long themselves"""
+    words: List[str] = []
+    for word in sentence.split():
+        if estimate_tokens(word) > max_tokens:
+            if words:
+                yield " ".join(words)
+                words = []
+            yield from _slice_word(word, max_tokens)
+            continue
+        if words and estimate_tokens(" ".join(words + [word])) > max_tokens:
+            yield " ".join(words)
+            words = []
+        words.append(word)
+    if words:
+        yield " ".join(words)
+
+
+def iter_chunks(
+    text: str,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> Iterator[Tuple[int, str]]:
+    """Yield (chunk_index, chunk_text) for text, lazily.
+
+    Chunks are built from whole sentences up to max_tokens; each chunk after
+    the first repeats the trailing sentences of the previous one (up to
+    overlap_tokens) so a thought split across the boundary is still found.
+    Text that fits in one chunk comes back unchanged as chunk 0, so indexes
+    are stable for a given text.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        if text.strip():
+            yield 0, text
+        return
+
+    index = 0
+    window: List[str] = []
+    for sentence in iter_sentences(text):
+        for piece in _split_long(sentence, max_tokens):
+            if window and estimate_tokens(" ".join(window + [piece])) > max_tokens:
+                yield index, " ".join(window)
+                index += 1
+                # Carry the tail of the chunk over as overlap
+                overlap: List[str] = []
+                for previous in reversed(window):
+                    if estimate_tokens(" ".join([previous] + overlap)) > overlap_tokens:
+                        break
+                    overlap.insert(0, previous)
+                window = overlap
+                if window and estimate_tokens(" ".join(window + [piece])) > max_tokens:
+                    window = []
+            window.append(piece)
+    # The last piece is always new, so the final window is never a pure repeat
+    if window:
+        yield index, " ".join(window)
@@ -0,0 +1,161 @@
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# (previous summary or None, turns to fold in) -> new summary
+Summarizer = Callable[[Optional[str], List[Dict]], Awaitable[str]]
+
+
+class ConversationNotFound(Exception):
+    """The conversation does not exist or belongs to another user"""
+
+
+@dataclass
+class Conversation:
+    id: str
+    user_id: str
+    summary: Optional[str] = None
+    turns: List[Dict] = field(default_factory=list)   # not yet summarized, oldest first, chat_history format
+
+
+def group_turns(messages: List[Dict]) -> List[List[Dict]]:
+    """coach_messages rows (oldest first) grouped per exchange: a user row and the assistant rows after it"""
+    groups: List[List[Dict]] = []
+    for row in messages:
+        if row.get('role') == 'user' or not groups:
+            groups.append([])
+        groups[-1].append(row)
+    return groups
+
+
+def to_turn(rows: List[Dict]) -> Dict:
+    """One exchange in chat_history format: {message, response, timestamp}"""
+    return {
+        'message': "\n".join(r.get('content') or '' for r in rows if r.get('role') == 'user'),
+        'response': "\n".join(r.get('content') or '' for r in rows if r.get('role') != 'user'),
+        'timestamp': rows[0].get('created_at'),
+    }
+
+
+class ConversationStore:
+    """Coach conversations kept server-side in coach_threads / coach_messages.
+
+    Clients send only a conversation id and the new message. Each turn is
+    appended as a user and an assistant row; once more than ``max_turns``
+    turns are unsummarized, all but the newest ``keep_turns`` are folded into
+    the thread's rolling summary (in the background, after the response), so
+    the history a prompt carries stays bounded however long the conversation runs.
+    """
+
+    def __init__(self, supabase, summarize: Summarizer, keep_turns: int = 6, max_turns: int = 12, page_size: int = 200):
+        if not 0 < keep_turns < max_turns:
+            raise ValueError("keep_turns must be positive and below max_turns")
+        self.supabase = supabase
+        self.summarize = summarize
+        self.keep_turns = keep_turns
+        self.max_turns = max_turns
+        self.page_size = page_size
+        self.counters = {'loaded': 0, 'appended': 0, 'compacted': 0, 'summarized_turns': 0, 'backlogged': 0}
+
+    async def create(self, user_id: str) -> str:
+        result = await self.supabase.table('coach_threads').insert({'user_id': user_id}).execute()
+        return result.data[0]['id']
+
+    async def _thread(self, conversation_id: str, user_id: Optional[str] = None) -> Dict:
+        query = self.supabase.table('coach_threads') \
+            .select('id, user_id, summary, summarized_until, summarized_turns') \
+            .eq('id', conversation_id)
+        if user_id is not None:
+            query = query.eq('user_id', user_id)
+        result = await query.limit(1).execute()
+        if not result.data:
+            raise ConversationNotFound(conversation_id)
+        return result.data[0]
+
+    def _messages_after(self, thread: Dict):
+        query = self.supabase.table('coach_messages') \
+            .select('id, role, content, created_at') \
+            .eq('thread_id', thread['id'])
+        if thread.get('summarized_until'):
+            query = query.gt('created_at', thread['summarized_until'])
+        return query
+
+    async def _unsummarized(self, thread: Dict, limit: int) -> List[Dict]:
+        """The newest `limit` messages after the summarized ones, oldest first"""
+        result = await self._messages_after(thread).order('created_at', desc=True).order('id', desc=True).limit(limit).execute()
+        return list(reversed(result.data or []))
+
+    async def _all_unsummarized(self, thread: Dict) -> List[Dict]:
+        """Every message after the summarized ones, oldest first, read page by page"""
+        rows: List[Dict] = []
+        while True:
+            result = await self._messages_after(thread).order('created_at').order('id') \
+                .range(len(rows), len(rows) + self.page_size - 1).execute()
+            page = result.data or []
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+
+    async def load(self, user_id: str, conversation_id: str) -> Conversation:
+        """Summary plus unsummarized turns; raises ConversationNotFound for another user's id"""
+        thread = await self._thread(conversation_id, user_id)
+        # Compaction normally keeps this under max_turns; the cap covers a summarizer that fell behind.
+        # Older turns are not lost: the next compaction pages through all of them.
+        limit = 4 * self.max_turns
+        messages = await self._unsummarized(thread, limit)
+        if len(messages) >= limit:
+            self.counters['backlogged'] += 1
+            logger.warning(f"Conversation {conversation_id} has over {limit} unsummarized messages; prompting with the newest")
+        self.counters['loaded'] += 1
+        return Conversation(conversation_id, user_id, thread.get('summary'), [to_turn(g) for g in group_turns(messages)])
+
+    async def append_turn(self, conversation: Conversation, message: str, response: str,
+                          asked_at: datetime, answered_at: Optional[datetime] = None):
+        """Store one exchange; explicit timestamps keep the pair ordered within one insert"""
+        answered_at = answered_at or datetime.now(timezone.utc)
+        rows = [
+            {'thread_id': conversation.id, 'user_id': conversation.user_id, 'role': 'user',
+             'content': message, 'created_at': asked_at.isoformat()},
+            {'thread_id': conversation.id, 'user_id': conversation.user_id, 'role': 'assistant',
+             'content': response, 'created_at': max(answered_at, asked_at).isoformat()},
+        ]
+        await self.supabase.table('coach_messages').insert(rows).execute()
+        conversation.turns.append({'message': message, 'response': response, 'timestamp': rows[0]['created_at']})
+        self.counters['appended'] += 1
+
+    def needs_compaction(self, conversation: Conversation) -> bool:
+        return len(conversation.turns) > self.max_turns
+
+    async def compact(self, conversation_id: str) -> int:
+        """Fold all but the newest keep_turns unsummarized turns into the summary; returns turns folded.
+
+        A backlog is folded max_turns turns per summarizer call, and each call's
+        progress is saved before the next, so a failure part-way loses nothing.
+        """
+        thread = await self._thread(conversation_id)
+        groups = group_turns(await self._all_unsummarized(thread))
+        if len(groups) <= self.max_turns:
+            return 0
+
+        pending = groups[:-self.keep_turns]
+        summary, summarized = thread.get('summary'), thread.get('summarized_turns') or 0
+        for start in range(0, len(pending), self.max_turns):
+            batch = pending[start:start + self.max_turns]
+            summary = await self.summarize(summary, [to_turn(g) for g in batch])
+            summarized += len(batch)
+            # Everything up to the last row of the last folded exchange is now in the summary
+            await self.supabase.table('coach_threads').update({
+                'summary': summary,
+                'summarized_until': batch[-1][-1]['created_at'],
+                'summarized_turns': summarized,
+            }).eq('id', conversation_id).execute()
+            self.counters['summarized_turns'] += len(batch)
+        self.counters['compacted'] += 1
+        logger.info(f"Folded {len(pending)} turns of conversation {conversation_id} into its summary")
+        return len(pending)
+
+    def stats(self) -> Dict:
+        return dict(self.counters)
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFC, collapsed whitespace, stripped"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    """Content address of an embedding: the model plus the normalized text"""
+    return hashlib.sha256(f"{model}\n{normalize_text(text)}".encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier, content-addressed cache of embedding vectors.
+
+    A bounded in-memory LRU sits in front of an optional SQLite file holding
+    float32 vectors. Both tiers evict least-recently-used entries once full.
+    Memory hits are served inline; disk lookups and writes run in a worker
+    thread so they never block the event loop. The tiers have separate locks,
+    so a slow SQLite call never holds up a memory hit.
+    """
+
+    def __init__(self, path: Optional[str] = None, memory_size: int = 5000, disk_size: int = 200_000):
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " vector BLOB NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+            self._db.commit()
+            # Kept up to date by _disk_put so eviction never has to count the table
+            (self._disk_rows,) = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+    async def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Cached vectors for texts (None where missing), promoting disk hits to memory"""
+        keys = [cache_key(model, text) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(keys)
+        pending = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    results[i] = vector.tolist()
+                else:
+                    pending.setdefault(key, []).append(i)
+
+        if pending and self._db is not None:
+            found = await asyncio.to_thread(self._disk_get, list(pending))
+            for key, vector in found.items():
+                self._remember(key, vector)
+                for i in pending.pop(key):
+                    self.counters['disk_hits'] += 1
+                    results[i] = vector.tolist()
+
+        self.counters['misses'] += sum(len(indexes) for indexes in pending.values())
+        return results
+
+    async def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Store vectors for texts in both tiers"""
+        entries = {cache_key(model, text): np.asarray(vector, dtype=np.float32) for text, vector in zip(texts, vectors)}
+        for key, vector in entries.items():
+            self._remember(key, vector)
+        if self._db is not None and entries:
+            await asyncio.to_thread(self._disk_put, entries)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['misses']
+        hits = self.counters['memory_hits'] + self.counters['disk_hits']
+        return {
+            **self.counters,
+            'memory_entries': len(self._memory),
+            'hit_rate': (hits / lookups) if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._disk_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+                self.counters['memory_evictions'] += 1
+
+    def _disk_select(self, columns: str, keys: List[str]) -> List[tuple]:
+        rows = []
+        # SQLite caps bound parameters, so look keys up in chunks
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows += self._db.execute(
+                f"SELECT {columns} FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+        return rows
+
+    def _disk_get(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._disk_lock:
+            for key, blob in self._disk_select("key, vector", keys):
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._db.commit()
+        return found
+
+    def _disk_put(self, entries: Dict[str, np.ndarray]):
+        now = time.time()
+        with self._disk_lock:
+            existing = len(self._disk_select("key", list(entries)))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, vector.tobytes(), now) for key, vector in entries.items()]
+            )
+            self._disk_rows += len(entries) - existing
+            overflow = self._disk_rows - self.disk_size
+            if overflow > 0:
+                deleted = self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                    (overflow,)
+                ).rowcount
+                self._disk_rows -= deleted
+                self.counters['disk_evictions'] += deleted
+            self._db.commit()
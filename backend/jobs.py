@@ -0,0 +1,355 @@
+import asyncio
+import json
+import logging
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+FINISHED_STATUSES = (SUCCEEDED, FAILED)
+# Finished jobs are pruned at most this often (seconds)
+PRUNE_INTERVAL = 3600
+# A running job's progress is written to the store at most this often (seconds)
+PROGRESS_INTERVAL = 1.0
+
+
+@dataclass
+class Job:
+    """A unit of background work for one user and its progress"""
+    user_id: str
+    params: Dict = field(default_factory=dict)
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    status: str = QUEUED
+    done: int = 0
+    total: int = 0
+    attempts: int = 0
+    error: Optional[str] = None
+    result: Optional[Dict] = None
+    owner: Optional[str] = None   # the JobQueue that claimed it last
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+
+class JobStore(ABC):
+    """Where job state lives; swap the SQLite store for a shared one to run several instances"""
+
+    @abstractmethod
+    def save(self, job: Job):
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    def active_for_user(self, user_id: str) -> Optional[Job]:
+        """The queued or running job of a user, if any"""
+
+    @abstractmethod
+    def pending(self) -> List[Job]:
+        """Jobs that were queued or running when the process stopped"""
+
+    @abstractmethod
+    def claim(self, job_id: str, owner: Optional[str] = None) -> Optional[Job]:
+        """Atomically move a queued job to running for ``owner``; None if it is gone or another worker took it"""
+
+    @abstractmethod
+    def prune(self, before: float) -> int:
+        """Delete succeeded and failed jobs last updated before ``before``; returns how many"""
+
+
+class MemoryJobStore(JobStore):
+    """Process-local job store (tests and single-process development)"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+
+    def save(self, job: Job):
+        job.updated_at = time.time()
+        self._jobs[job.id] = job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def active_for_user(self, user_id: str) -> Optional[Job]:
+        for job in self._jobs.values():
+            if job.user_id == user_id and job.status in ACTIVE_STATUSES:
+                return job
+        return None
+
+    def pending(self) -> List[Job]:
+        return [job for job in self._jobs.values() if job.status in ACTIVE_STATUSES]
+
+    def claim(self, job_id: str, owner: Optional[str] = None) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None or job.status != QUEUED:
+            return None
+        job.status = RUNNING
+        job.owner = owner
+        self.save(job)
+        return job
+
+    def prune(self, before: float) -> int:
+        expired = [job.id for job in self._jobs.values() if job.status in FINISHED_STATUSES and job.updated_at < before]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+
+class SQLiteJobStore(JobStore):
+    """Job store in a local SQLite file, so queued work survives restarts"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " user_id TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON jobs(user_id, status)")
+        self._db.commit()
+
+    def save(self, job: Job):
+        job.updated_at = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (id, user_id, status, data) VALUES (?, ?, ?, ?)",
+                (job.id, job.user_id, job.status, json.dumps(asdict(job)))
+            )
+            self._db.commit()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(**json.loads(row[0])) if row else None
+
+    def active_for_user(self, user_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM jobs WHERE user_id = ? AND status IN (?, ?) LIMIT 1",
+                (user_id, *ACTIVE_STATUSES)
+            ).fetchone()
+        return Job(**json.loads(row[0])) if row else None
+
+    def pending(self) -> List[Job]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT data FROM jobs WHERE status IN (?, ?)", ACTIVE_STATUSES
+            ).fetchall()
+        return [Job(**json.loads(row[0])) for row in rows]
+
+    def claim(self, job_id: str, owner: Optional[str] = None) -> Optional[Job]:
+        with self._lock:
+            # The conditional UPDATE is atomic across processes sharing the file, so only one of them wins
+            claimed = self._db.execute(
+                "UPDATE jobs SET status = ? WHERE id = ? AND status = ?", (RUNNING, job_id, QUEUED)
+            ).rowcount
+            self._db.commit()
+            row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone() if claimed else None
+        if row is None:
+            return None
+        job = Job(**json.loads(row[0]))
+        job.status = RUNNING
+        job.owner = owner
+        self.save(job)
+        return job
+
+    def prune(self, before: float) -> int:
+        with self._lock:
+            deleted = self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND json_extract(data, '$.updated_at') < ?",
+                (*FINISHED_STATUSES, before)
+            ).rowcount
+            self._db.commit()
+        return deleted
+
+    def close(self):
+        self._db.close()
+
+
+# A handler receives the job and a progress callback (done, total) and returns a result dict
+JobHandler = Callable[[Job, Callable[[int, int], None]], Awaitable[Optional[Dict]]]
+
+
+class JobQueue:
+    """Bounded in-process worker pool over a pluggable JobStore.
+
+    At most one job per user is active at a time: enqueueing while a job is
+    queued or running returns that job. Failures whose type is in
+    ``retry_on`` are retried with jittered exponential backoff. Workers claim
+    a job before running it, so processes sharing a store never run the same
+    job twice. Finished jobs are kept for ``retention`` seconds.
+
+    Store calls run in a worker thread, so a blocking store (SQLite) never
+    stalls the event loop, and progress is written at most every
+    ``progress_interval`` seconds (``get`` serves the live job meanwhile).
+    At start, running jobs are only re-queued if this ``owner`` claimed them
+    or nobody has updated them for ``stale_after`` seconds; processes sharing
+    a store must therefore use distinct owners that stay the same across
+    restarts (the host name by default).
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        store: Optional[JobStore] = None,
+        workers: int = 2,
+        max_attempts: int = 3,
+        backoff: float = 1.0,
+        retry_on: Tuple[Type[BaseException], ...] = (),
+        retention: float = 86400.0,
+        owner: Optional[str] = None,
+        progress_interval: float = PROGRESS_INTERVAL,
+        stale_after: float = 3600.0,
+    ):
+        self.handler = handler
+        self.store = store or MemoryJobStore()
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.retry_on = retry_on
+        self.retention = retention
+        self.owner = owner or socket.gethostname()
+        self.progress_interval = progress_interval
+        self.stale_after = stale_after
+        self._running: Dict[str, Job] = {}
+        self._pruned_at = 0.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        await self._prune()
+        # Resume work that was interrupted by a restart. Another owner's running job is left
+        # alone while it is being updated; claim() keeps queued jobs from running twice.
+        stale_before = time.time() - self.stale_after
+        for job in await asyncio.to_thread(self.store.pending):
+            if job.status == RUNNING:
+                if job.owner not in (None, self.owner) and job.updated_at >= stale_before:
+                    continue
+                job.status = QUEUED
+                await self._save(job)
+            self._queue.put_nowait(job.id)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, user_id: str, **params) -> Job:
+        """Queue a job for user_id, or return the one already queued/running"""
+        async with self._lock:
+            active = await asyncio.to_thread(self.store.active_for_user, user_id)
+            if active is not None:
+                return self._running.get(active.id, active)
+            job = Job(user_id=user_id, params=params)
+            await self._save(job)
+        self._queue.put_nowait(job.id)
+        logger.info(f"📥 Queued job {job.id} for user {user_id}")
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        """The job as this process is running it (with unsaved progress), else as stored"""
+        if job_id in self._running:
+            return self._running[job_id]
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _worker(self, index: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = await asyncio.to_thread(self.store.claim, job_id, self.owner)
+                if job is not None:
+                    self._running[job.id] = job
+                    try:
+                        await self._run(job)
+                    finally:
+                        del self._running[job.id]
+                if time.time() - self._pruned_at >= PRUNE_INTERVAL:
+                    await self._prune()
+            except Exception as e:
+                logger.error(f"Job worker {index} crashed on {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _save(self, job: Job):
+        await asyncio.to_thread(self.store.save, job)
+
+    async def _prune(self):
+        self._pruned_at = time.time()
+        try:
+            pruned = await asyncio.to_thread(self.store.prune, self._pruned_at - self.retention)
+        except Exception as e:
+            logger.warning(f"Pruning finished jobs failed: {e}")
+            return
+        if pruned:
+            logger.info(f"🧹 Pruned {pruned} finished job(s) older than {self.retention:.0f}s")
+
+    async def _run(self, job: Job):
+        writing: Optional[asyncio.Future] = None
+        written_at = time.monotonic()
+
+        def progress(done: int, total: int):
+            # Called by the handler on the event loop: update the live job, write it now and then
+            nonlocal writing, written_at
+            job.done, job.total = done, total
+            if time.monotonic() - written_at >= self.progress_interval and (writing is None or writing.done()):
+                written_at = time.monotonic()
+                writing = asyncio.ensure_future(self._save(job))
+
+        async def save():
+            # A progress write still in flight must not land after a later status change
+            if writing is not None:
+                await asyncio.gather(writing, return_exceptions=True)
+            await self._save(job)
+
+        while True:
+            job.status = RUNNING
+            job.attempts += 1
+            await save()
+            try:
+                job.result = await self.handler(job, progress)
+                job.status = SUCCEEDED
+                job.error = None
+                await save()
+                logger.info(f"✅ Job {job.id} finished after {job.attempts} attempt(s)")
+                return
+            except self.retry_on as e:
+                if job.attempts >= self.max_attempts:
+                    await self._fail(job, e, save)
+                    return
+                delay = self.backoff * (2 ** (job.attempts - 1)) * random.uniform(0.5, 1.5)
+                logger.warning(f"⚠️ Job {job.id} attempt {job.attempts} failed ({e}), retrying in {delay:.1f}s")
+                job.error = str(e)
+                await save()
+                await asyncio.sleep(delay)
+            except Exception as e:
+                await self._fail(job, e, save)
+                return
+
+    async def _fail(self, job: Job, error: Exception, save: Callable[[], Awaitable[None]]):
+        job.status = FAILED
+        job.error = str(error)
+        await save()
+        logger.error(f"❌ Job {job.id} failed after {job.attempts} attempt(s): {error}")
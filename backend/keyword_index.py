@@ -0,0 +1,125 @@
+import hashlib
+import math
+import re
+from collections import Counter
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = frozenset("""
+a about am an and are as at be been but by can could did do does doing for from had has have how i if in
+into is it its me my myself of on or our should so than that the their them then there these they this to
+up was we were what when where which while who why will with would you your
+""".split())
+
+
+def _stem(token: str) -> str:
+    """Very light suffix stripping so "goals"/"goal" and "running"/"run" meet"""
+    if len(token) > 5 and token.endswith("ing"):
+        token = token[:-3]
+        if len(token) > 2 and token[-1] == token[-2]:
+            token = token[:-1]
+    elif len(token) > 4 and token.endswith("ies"):
+        token = token[:-3] + "y"
+    elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        _stem(token)
+        for token in _WORD.findall(text.lower())
+        if token not in STOPWORDS and (len(token) > 1 or token.isdigit())
+    ]
+
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring over one user's documents.
+
+    Documents are keyed by any hashable (the RAG service uses (type, id)) and
+    can be added, replaced or removed one at a time; the corpus statistics
+    are kept up to date incrementally, so nothing is rebuilt per query.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        self._lengths: Dict[Hashable, int] = {}
+        self._signatures: Dict[Hashable, str] = {}
+        self._terms: Dict[Hashable, Tuple[str, ...]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._lengths
+
+    def upsert(self, key: Hashable, text: str) -> bool:
+        """Index text under key; returns False if it was already indexed unchanged"""
+        signature = hashlib.sha1(text.encode()).hexdigest()
+        if self._signatures.get(key) == signature:
+            return False
+        self.remove(key)
+        terms = Counter(tokenize(text))
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[key] = frequency
+        length = sum(terms.values())
+        self._lengths[key] = length
+        self._signatures[key] = signature
+        self._terms[key] = tuple(terms)
+        self._total_length += length
+        return True
+
+    def remove(self, key: Hashable) -> bool:
+        if key not in self._lengths:
+            return False
+        for term in self._terms.pop(key):
+            postings = self._postings[term]
+            del postings[key]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(key)
+        del self._signatures[key]
+        return True
+
+    def sync(self, documents: Dict[Hashable, str]) -> Tuple[int, int]:
+        """Make the index hold exactly documents; returns (changed, removed)"""
+        changed = sum(self.upsert(key, text) for key, text in documents.items())
+        stale = [key for key in self._lengths if key not in documents]
+        for key in stale:
+            self.remove(key)
+        return changed, len(stale)
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[Hashable, float]]:
+        """Keys of documents matching query, best BM25 score first"""
+        if not self._lengths:
+            return []
+        count = len(self._lengths)
+        average_length = self._total_length / count or 1.0
+        scores: Dict[Hashable, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[key] / average_length)
+                scores[key] = scores.get(key, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Hashable]],
+    k: int = 60,
+    limit: Optional[int] = None,
+) -> List[Tuple[Hashable, float]]:
+    """Fuse ranked key lists: score(d) = sum over rankings of 1 / (k + rank)"""
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return fused[:limit] if limit is not None else fused
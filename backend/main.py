@@ -1,15 +1,40 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import AsyncGenerator, AsyncIterator, List, Dict, Optional, Tuple
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
+import asyncio
+import anyio
+import httpx
 import openai
-from supabase import create_client, Client
+from supabase import AsyncClient, AsyncClientOptions
 import json
 import logging
+import time
+from dataclasses import asdict
+from datetime import datetime, timezone
+
+from admission import AdmissionController, AdmissionRejected, Permit
+from auth import AuthError, TokenVerifier
+from cache import TTLCache
+from conversations import Conversation, ConversationNotFound, ConversationStore
+from embedding_cache import EmbeddingCache
+from jobs import Job, JobQueue, SQLiteJobStore
+from metrics import PROMETHEUS_CONTENT_TYPE, MetricsMiddleware, registry, span
+from prompt_budget import PromptBudget, PromptPlan, assemble_prompt
+from priority import parse_priority_weights, prioritize
+from prompts import CONVERSATION_SUMMARY_INSTRUCTIONS, PROMPT_TEMPLATES, PromptTemplate, choose_template, parse_version_weights, render_summary_request
+from rag_service import RAGService
+from routing import ModelRouter, RouteDecision
+from singleflight import SingleFlight, message_key
+from transport import Upstream, UpstreamConfig
+from user_state import FileCheckpoint, StateRefresher, UserStateStore, current_state, rpc_snapshot_loader, state_lines
+from vector_store import LocalVectorStore, PgVectorBackend
 
 # Load environment variables
 load_dotenv()
@@ -18,11 +43,30 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the JWKS once and keep refreshing it in the background
+    await token_verifier.start()
+    await embedding_jobs.start()
+    if user_state_refresher is not None:
+        await user_state_refresher.start(USER_STATE_REFRESH_INTERVAL)
+    yield
+    if user_state_refresher is not None:
+        await user_state_refresher.stop()
+    # Let conversation summaries that are already running finish
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await embedding_jobs.stop()
+    await token_verifier.stop()
+    embedding_cache.close()
+    for upstream in upstreams.values():
+        await upstream.aclose()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Digm AI Coach API",
     description="RAG-powered AI Coach for personalized goal coaching",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware for React Native app
@@ -32,66 +76,335 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# Request latency histogram and a per-request Server-Timing header of the stage spans
+app.add_middleware(MetricsMiddleware)
+
+# One pooled keep-alive HTTP client per upstream, with per-stage timeouts, budgeted
+# jittered retries and a circuit breaker (see transport.py); tune with <PREFIX>_<SETTING>
+# environment variables, e.g. OPENAI_READ_TIMEOUT or SUPABASE_REST_MAX_CONNECTIONS
+upstreams = {
+    'openai': Upstream('openai', UpstreamConfig.from_env("OPENAI", read_timeout=30.0)),
+    'supabase_rest': Upstream('supabase_rest', UpstreamConfig.from_env("SUPABASE_REST", read_timeout=10.0)),
+    'supabase_auth': Upstream('supabase_auth', UpstreamConfig.from_env("SUPABASE_AUTH", read_timeout=5.0, max_connections=20)),
+}
 
-# Initialize clients
-openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Initialize clients; retries happen in the transport, so the SDK's own retries are off
 if not os.getenv("OPENAI_API_KEY"):
     raise ValueError("OPENAI_API_KEY environment variable is required")
+openai_client = openai.AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=upstreams['openai'].client,
+    timeout=upstreams['openai'].config.timeout,
+    max_retries=0
+)
 
 supabase_url = os.getenv("SUPABASE_URL")
 supabase_anon_key = os.getenv("SUPABASE_ANON_KEY")
 if not supabase_url or not supabase_anon_key:
     raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY environment variables are required")
 
-supabase: Client = create_client(supabase_url, supabase_anon_key)
+# Async clients so upstream I/O never blocks the event loop
+supabase: AsyncClient = AsyncClient(
+    supabase_url,
+    supabase_anon_key,
+    options=AsyncClientOptions(httpx_client=upstreams['supabase_rest'].client)
+)
+
+# This server calls Supabase without the user's JWT, so tables with owner-only RLS (user_embeddings,
+# user_state_summaries) hide every row from the anon client. Per-user data goes through the service
+# role client instead, scoped by the user id taken from the verified token.
+supabase_service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+if not supabase_service_key:
+    raise ValueError("SUPABASE_SERVICE_ROLE_KEY environment variable is required")
+# postgrest writes the key into its httpx client's headers, so this client cannot share the anon one;
+# it gets its own client on the same pooled, retrying, circuit-broken transport
+supabase_admin: AsyncClient = AsyncClient(
+    supabase_url,
+    supabase_service_key,
+    options=AsyncClientOptions(httpx_client=upstreams['supabase_rest'].new_client())
+)
+
+embedding_cache = EmbeddingCache(
+    path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3") or None,
+    memory_size=int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "5000")),
+    disk_size=int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "200000"))
+)
+# Vector search: "pgvector" (match_documents RPC) or "local" (in-process memory-mapped matrices).
+# match_documents is security-invoker, so both go through the service role client to see any rows
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pgvector")
+if VECTOR_BACKEND == "local":
+    vector_backend = LocalVectorStore(
+        supabase_admin,
+        path=os.getenv("VECTOR_STORE_PATH", "vector_store"),
+        max_users=int(os.getenv("VECTOR_STORE_MAX_USERS", "256")),
+        max_age=float(os.getenv("VECTOR_STORE_MAX_AGE", "600")),
+        quantization=os.getenv("VECTOR_QUANTIZATION", "none")
+    )
+elif VECTOR_BACKEND == "pgvector":
+    vector_backend = PgVectorBackend(supabase_admin, quantization=os.getenv("VECTOR_QUANTIZATION", "none"))
+else:
+    raise ValueError("VECTOR_BACKEND must be 'pgvector' or 'local'")
+rag_service = RAGService(supabase_admin, openai_client, embedding_cache, vector_backend=vector_backend)
+
+# Background embedding jobs; transient upstream failures are retried with backoff
+embedding_jobs = JobQueue(
+    handler=lambda job, progress: run_embedding_job(job, progress),
+    store=SQLiteJobStore(os.getenv("EMBEDDING_JOBS_DB", "embedding_jobs.sqlite3")),
+    workers=int(os.getenv("EMBEDDING_JOB_WORKERS", "2")),
+    retention=float(os.getenv("EMBEDDING_JOB_RETENTION", "86400")),
+    owner=os.getenv("EMBEDDING_JOB_OWNER") or None,
+    retry_on=(openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError, openai.InternalServerError, httpx.TransportError)
+)
+
+# Per-user profile + onboarding context; invalidated by the app when either is saved
+context_cache = TTLCache(
+    maxsize=int(os.getenv("CONTEXT_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("CONTEXT_CACHE_TTL", "300"))
+)
+
+# Retrieval settings: search ranks RAG_SEARCH_DEPTH items against the message, then the
+# priority scorer picks the RAG_MATCH_COUNT most useful ones across goals, tasks and journals
+RAG_MATCH_COUNT = int(os.getenv("RAG_MATCH_COUNT", "6"))
+RAG_MATCH_THRESHOLD = float(os.getenv("RAG_MATCH_THRESHOLD", "0.3"))
+RAG_SEARCH_DEPTH = int(os.getenv("RAG_SEARCH_DEPTH", "20"))
+priority_weights = parse_priority_weights(os.getenv("PRIORITY_WEIGHTS", ""))
+
+# Coach completion settings
+COACH_MODEL = os.getenv("COACH_MODEL", "gpt-4")
+COACH_TEMPERATURE = 0.7
+COACH_MAX_TOKENS = 500
+COACH_FALLBACK_RESPONSE = "I'm having trouble processing your request right now. Please try again later."
+
+# Model routing: simple lookups go to COACH_FAST_MODEL (empty disables it), everything else to
+# COACH_MODEL; a tier whose model has a latency or error spike is avoided for a cooldown
+COACH_FAST_MODEL = os.getenv("COACH_FAST_MODEL", "gpt-4o-mini")
+coach_router = ModelRouter(
+    {'strong': COACH_MODEL, 'fast': COACH_FAST_MODEL} if COACH_FAST_MODEL else {'strong': COACH_MODEL},
+    latency_limit=float(os.getenv("COACH_ROUTE_LATENCY_LIMIT", "10")),
+    error_limit=float(os.getenv("COACH_ROUTE_ERROR_LIMIT", "0.5")),
+    cooldown=float(os.getenv("COACH_ROUTE_COOLDOWN", "60"))
+)
+
+# Admission control for coach completions: a global slot limit sized to the OpenAI quota,
+# a bounded wait queue, and per-user rate/concurrency limits; overload is answered with 429
+coach_admission = AdmissionController(
+    max_concurrent=int(os.getenv("COACH_MAX_CONCURRENCY", "16")),
+    max_queue=int(os.getenv("COACH_MAX_QUEUE", "64")),
+    queue_timeout=float(os.getenv("COACH_QUEUE_TIMEOUT", "10")),
+    user_rate=float(os.getenv("COACH_USER_RATE_PER_MINUTE", "20")) / 60,
+    user_burst=int(os.getenv("COACH_USER_BURST", "5")),
+    user_concurrency=int(os.getenv("COACH_USER_CONCURRENCY", "2"))
+)
+
+# Prompt token budget: a hard ceiling, split among user context, retrieved items and history
+coach_prompt_budget = PromptBudget(
+    total=int(os.getenv("COACH_PROMPT_BUDGET", "4000")),
+    context=int(os.getenv("COACH_CONTEXT_BUDGET", "300")),
+    retrieved=int(os.getenv("COACH_RETRIEVED_BUDGET", "600")),
+    history=int(os.getenv("COACH_HISTORY_BUDGET", "1200")),
+    recent_turns=int(os.getenv("COACH_RECENT_TURNS", "3"))
+)
+
+# Prompt versions served, as an A/B split ("v1=90,v2=10"); users are bucketed deterministically
+COACH_PROMPT_WEIGHTS = parse_version_weights(os.getenv("COACH_PROMPT_VERSIONS", "v1"))
+
+# Rendered per-user prompt fragments, keyed by (user_id, prompt version)
+prompt_fragment_cache = TTLCache(
+    maxsize=int(os.getenv("CONTEXT_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("CONTEXT_CACHE_TTL", "300"))
+)
+
+# Single-flight deduplication: concurrent identical coach queries share one completion and
+# successful answers are kept briefly to absorb immediate retries; context loads are only coalesced.
+# Server-side conversation answers are never reused: the key cannot see the stored history, so a
+# repeated "ok" would get the previous turn's answer and the new turn would not be stored
+coach_queries = SingleFlight(
+    cache=TTLCache(
+        maxsize=int(os.getenv("COACH_RESULT_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("COACH_RESULT_CACHE_TTL", "15"))
+    ),
+    cacheable=lambda result: result.response != COACH_FALLBACK_RESPONSE and result.conversation_id is None
+)
+context_loads = SingleFlight()
+
+# Server-side coach conversations (coach_threads / coach_messages): older turns are folded into a
+# rolling summary in the background, so requests carry only the conversation id and the new message.
+# Written with the service role client: the anon key cannot insert past RLS, and every query is
+# scoped to the user id of the verified token
+conversation_store = ConversationStore(
+    supabase_admin,
+    summarize=lambda summary, turns: summarize_conversation(summary, turns),
+    keep_turns=int(os.getenv("CONVERSATION_KEEP_TURNS", "6")),
+    max_turns=int(os.getenv("CONVERSATION_MAX_TURNS", "12"))
+)
+CONVERSATION_SUMMARY_MAX_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_MAX_TOKENS", "300"))
+conversation_compactions = SingleFlight()
+# Fire-and-forget work started by requests (summaries); awaited on shutdown
+background_tasks: set = set()
+
+# Precomputed per-user coaching state (user_state.py), read back through get_user_snapshot with the
+# service role client (user_state_summaries is owner-only under RLS). Refreshed by
+# `python -m user_state`, or in-process every USER_STATE_REFRESH_INTERVAL seconds (0 = off)
+USER_STATE_REFRESH_INTERVAL = float(os.getenv("USER_STATE_REFRESH_INTERVAL", "0"))
+user_state_refresher: Optional[StateRefresher] = None
+if USER_STATE_REFRESH_INTERVAL > 0:
+    user_state_refresher = StateRefresher(
+        UserStateStore(supabase_admin),
+        rpc_snapshot_loader(supabase_admin),
+        chunk_size=int(os.getenv("USER_STATE_CHUNK_SIZE", "100")),
+        concurrency=int(os.getenv("USER_STATE_CONCURRENCY", "8")),
+        checkpoint=FileCheckpoint(os.getenv("USER_STATE_CHECKPOINT", "user_state_checkpoint.json"))
+    )
+
+# Prometheus metrics (served on /metrics); stage latencies are recorded with metrics.span
+# prompt_version is "none" for completions outside a coach prompt (summaries) and failures before one was chosen
+openai_tokens = registry.counter("digm_openai_tokens_total", "OpenAI tokens used by coach completions", ("model", "kind", "prompt_version"))
+coach_errors = registry.counter("digm_coach_errors_total", "Coach completions answered with the fallback message", ("kind", "prompt_version"))
+coach_first_token_seconds = registry.histogram("digm_coach_first_token_seconds", "Time to the first streamed coach token")
+coach_stream_seconds = registry.histogram("digm_coach_stream_seconds", "Duration of a streamed coach completion")
+user_states = registry.counter("digm_user_state_total", "Coach turns that used the precomputed user state or had to compute it", ("source",))
+
+def cache_lookups() -> Dict[Tuple[str, str], float]:
+    lookups = {}
+    for name, cache in [('context', context_cache), ('prompt_fragments', prompt_fragment_cache),
+                        ('auth_tokens', token_verifier.cache), ('keyword_indexes', rag_service.keyword_indexes),
+                        ('coach_results', coach_queries.cache)]:
+        stats = cache.stats()
+        lookups[(name, 'hit')] = stats['hits']
+        lookups[(name, 'miss')] = stats['misses']
+    stats = embedding_cache.stats()
+    lookups[('embeddings', 'hit')] = stats['memory_hits'] + stats['disk_hits']
+    lookups[('embeddings', 'miss')] = stats['misses']
+    return lookups
+
+def upstream_events() -> Dict[Tuple[str, str], float]:
+    return {
+        (name, event): upstream.stats()[event]
+        for name, upstream in upstreams.items()
+        for event in ('requests', 'retries', 'failures', 'rejected', 'budget_exhausted')
+    }
+
+registry.collected("digm_cache_lookups_total", "In-process cache lookups", ("cache", "result"), cache_lookups, type="counter")
+registry.collected("digm_upstream_events_total", "Upstream HTTP requests, retries, failures and circuit rejections", ("upstream", "event"), upstream_events, type="counter")
+registry.collected(
+    "digm_upstream_circuit_open", "1 while an upstream's circuit breaker refuses calls", ("upstream",),
+    lambda: {(name,): float(upstream.stats()['circuit'] == 'open') for name, upstream in upstreams.items()}
+)
+registry.collected(
+    "digm_coach_admission_slots", "Coach completions holding a slot or waiting for one", ("state",),
+    lambda: {('active',): coach_admission.active, ('waiting',): coach_admission.waiting}
+)
+registry.collected(
+    "digm_coach_admission_rejections_total", "Coach requests answered with 429", ("reason",),
+    lambda: {(reason,): count for reason, count in coach_admission.rejections.items()}, type="counter"
+)
+registry.collected(
+    "digm_singleflight_calls_total", "Deduplicated calls by how they were answered (leader ran it, shared a running call, cached)", ("flight", "result"),
+    lambda: {(name, result): count for name, flight in [('coach_queries', coach_queries), ('context_loads', context_loads)]
+             for result, count in flight.counters.items()}, type="counter"
+)
+registry.collected(
+    "digm_coach_routes_total", "Coach model routing decisions", ("tier", "model", "reason"),
+    lambda: dict(coach_router.decisions), type="counter"
+)
+registry.collected(
+    "digm_coach_escalations_total", "Fast-tier coach answers retried on the strong model", ("reason",),
+    lambda: {(reason,): count for reason, count in coach_router.escalations.items()}, type="counter"
+)
+registry.collected(
+    "digm_coach_model_degraded", "1 while a coach model is avoided after a latency or error spike", ("model",),
+    lambda: {(model,): float(coach_router.degraded(model)) for model in coach_router.health}
+)
+registry.collected(
+    "digm_conversation_events_total", "Server-side conversation loads, appended turns, compactions and turns folded into summaries", ("event",),
+    lambda: {(event,): count for event, count in conversation_store.counters.items()}, type="counter"
+)
+registry.collected(
+    "digm_search_total", "Searches by how they were answered", ("mode",),
+    lambda: {(mode,): count for mode, count in rag_service.search_stats.items()}, type="counter"
+)
 
 # Security
 security = HTTPBearer()
 
+async def verify_token_remote(token: str) -> Optional[str]:
+    """Verify a token with Supabase Auth (AUTH_VERIFY_MODE=remote)"""
+    response = await upstreams['supabase_auth'].client.get(
+        f"{supabase_url.rstrip('/')}/auth/v1/user",
+        headers={'apikey': supabase_anon_key, 'Authorization': f"Bearer {token}"}
+    )
+    response.raise_for_status()
+    return response.json().get('id')
+
+token_verifier = TokenVerifier(
+    supabase_url,
+    jwt_secret=os.getenv("SUPABASE_JWT_SECRET"),
+    mode=os.getenv("AUTH_VERIFY_MODE", "local"),
+    remote_verify=verify_token_remote,
+    http_client=upstreams['supabase_auth'].client,
+    jwks_refresh_interval=float(os.getenv("AUTH_JWKS_REFRESH_SECONDS", "600")),
+    cache_size=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000")),
+    cache_ttl=float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300")),
+)
+
 # Pydantic models
 class CoachQuery(BaseModel):
     message: str
     chat_history: Optional[List[Dict]] = None  # Add chat history field
+    conversation_id: Optional[str] = None  # Server-side history instead of chat_history
 
 class CoachResponse(BaseModel):
     response: str
     relevant_data: List[Dict]
     user_context: Dict
+    conversation_id: Optional[str] = None
+    stored: bool = False  # False: the backend did not store this turn, so the client should
+    prompt_version: Optional[str] = None  # PROMPT_TEMPLATES version that answered (None if none was built)
+
+class ConversationResponse(BaseModel):
+    conversation_id: str
 
 class EmbeddingRequest(BaseModel):
     user_id: str
+    force: bool = False  # Re-embed everything instead of only new/changed items
 
-class EmbeddingResponse(BaseModel):
-    message: str
-    embeddings_generated: int
+class EmbeddingJobResponse(BaseModel):
+    job_id: str
+    status: str  # queued | running | succeeded | failed
+    done: int = 0
+    total: int = 0
+    attempts: int = 0
+    error: Optional[str] = None
+    report: Optional[Dict] = None  # skipped / embedded / refreshed / deleted once finished
 
 # Authentication middleware
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     """Verify Supabase JWT token and return user ID"""
     try:
-        token = credentials.credentials
-        logger.info(f"🔑 Received token length: {len(token)}")
-        logger.info(f"🔑 Token starts with: {token[:20]}...")
-        
-        # Verify the token with Supabase
-        user = supabase.auth.get_user(token)
-        if not user or not user.user:
-            logger.error("❌ Token verification failed: no user returned")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication token"
-            )
-        
-        logger.info(f"✅ Token verified for user: {user.user.id}")
-        return user.user.id
-    except Exception as e:
+        with span("auth"):
+            return await token_verifier.verify(credentials.credentials)
+    except AuthError as e:
         logger.error(f"❌ Authentication error: {e}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication token"
         )
 
+async def admit_coach_call(user_id: str) -> Permit:
+    """Take a coach completion slot, or fail fast with 429 and Retry-After when overloaded"""
+    try:
+        with span("admission"):
+            return await coach_admission.acquire(user_id)
+    except AdmissionRejected as e:
+        logger.warning(f"Coach request of user {user_id} rejected: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many coach requests, please retry shortly",
+            headers={"Retry-After": e.retry_after_header}
+        )
+
 # Health check endpoint
 @app.get("/")
 async def root():
@@ -99,7 +412,12 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": "2024-01-01T00:00:00Z"}
+    return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
+
+@app.get("/metrics")
+async def metrics():
+    """Latency histograms, token and error counters, cache and upstream stats for Prometheus"""
+    return Response(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
 
 # Auth link redirectors (password reset, etc.)
 @app.get("/auth/reset")
@@ -160,277 +478,578 @@ async def query_coach(
     user_id: str = Depends(get_current_user)
 ):
     """Main RAG endpoint for AI Coach queries"""
+    # A repeated message (client retry, double tap) shares the in-flight or just-finished answer
+    key = message_key(user_id, query.message, query.chat_history) + (query.conversation_id,)
+    return await coach_queries.do(key, lambda: answer_coach_query(user_id, query))
+
+async def answer_coach_query(user_id: str, query: CoachQuery) -> CoachResponse:
+    """Load context, retrieve and complete one coach query"""
+    # Admit before loading anything, so shed requests cost no retrieval work
+    permit = await admit_coach_call(user_id)
     try:
         logger.info(f"Processing coach query for user {user_id}")
+        asked_at = datetime.now(timezone.utc)
         
-        # Get user context
-        user_context = await get_user_context(user_id)
-        
-        # Get relevant data using vector similarity
-        relevant_data = await get_relevant_data(user_id, query.message)
+        # Load everything the coach needs in one round-trip (plus the conversation, if server-side)
+        with span("context"):
+            (user_context, snapshot), conversation = await asyncio.gather(
+                load_coach_context(user_id),
+                load_conversation(user_id, query.conversation_id)
+            )
+        with span("retrieval"):
+            relevant_data = await get_relevant_data(user_id, query.message, snapshot)
         
         # Generate AI response
-        ai_response = await generate_coach_response(user_context, relevant_data, query.message, query.chat_history)
+        history = conversation.turns if conversation else query.chat_history
+        summary = conversation.summary if conversation else None
+        ai_response, prompt_version = await generate_coach_response(user_id, user_context, relevant_data, query.message, history, summary)
+        stored = bool(conversation) and await remember_turn(conversation, query.message, ai_response, asked_at)
         
         return CoachResponse(
             response=ai_response,
             relevant_data=relevant_data,
-            user_context=user_context
+            user_context=user_context,
+            conversation_id=query.conversation_id,
+            stored=stored,
+            prompt_version=prompt_version
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in coach query: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to process coach query: {str(e)}"
         )
+    finally:
+        permit.release()
+
+# Streaming RAG Coach endpoint (Server-Sent Events)
+@app.post("/api/coach/stream")
+async def stream_coach(
+    query: CoachQuery,
+    request: Request,
+    user_id: str = Depends(get_current_user)
+):
+    """Stream the AI Coach answer token by token"""
+    logger.info(f"Processing streaming coach query for user {user_id}")
+    
+    permit = await admit_coach_call(user_id)
+    try:
+        asked_at = datetime.now(timezone.utc)
+        with span("context"):
+            (user_context, snapshot), conversation = await asyncio.gather(
+                load_coach_context(user_id),
+                load_conversation(user_id, query.conversation_id)
+            )
+        with span("retrieval"):
+            relevant_data = await get_relevant_data(user_id, query.message, snapshot)
+    except BaseException:
+        permit.release()
+        raise
+    
+    # The slot is held until the stream ends; the background task also frees it if the stream never started
+    events = stream_coach_response(
+        request, user_id, user_context, relevant_data, query.message,
+        conversation.turns if conversation else query.chat_history,
+        conversation=conversation, asked_at=asked_at
+    )
+    return StreamingResponse(
+        release_when_done(permit, events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(permit.release)
+    )
+
+# Server-side conversation endpoint
+@app.post("/api/coach/conversations", response_model=ConversationResponse, status_code=status.HTTP_201_CREATED)
+async def create_conversation(user_id: str = Depends(get_current_user)):
+    """Start a server-side coach conversation; pass its id as conversation_id instead of chat_history"""
+    try:
+        return ConversationResponse(conversation_id=await conversation_store.create(user_id))
+    except Exception as e:
+        logger.error(f"Error creating conversation: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to create conversation: {str(e)}"
+        )
 
 # Generate embeddings endpoint
-@app.post("/api/embeddings/generate", response_model=EmbeddingResponse)
+@app.post("/api/embeddings/generate", response_model=EmbeddingJobResponse, status_code=status.HTTP_202_ACCEPTED)
 async def generate_embeddings(
     request: EmbeddingRequest,
     user_id: str = Depends(get_current_user)
 ):
-    """Generate embeddings for all user data"""
-    try:
-        if request.user_id != user_id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Can only generate embeddings for your own data"
-            )
-        
-        logger.info(f"Generating embeddings for user {user_id}")
-        
-        # Generate embeddings for user data
-        embeddings_count = await generate_user_embeddings(user_id)
-        
-        return EmbeddingResponse(
-            message="Embeddings generated successfully",
-            embeddings_generated=embeddings_count
+    """Queue an embedding sync for all user data and return the job immediately"""
+    if request.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Can only generate embeddings for your own data"
         )
+    
+    try:
+        logger.info(f"Queueing embedding sync for user {user_id}")
+        with span("enqueue"):
+            job = await embedding_jobs.enqueue(user_id, force=request.force)
+        return embedding_job_response(job)
         
     except Exception as e:
-        logger.error(f"Error generating embeddings: {e}")
+        logger.error(f"Error queueing embeddings: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate embeddings: {str(e)}"
         )
 
+# Embedding job status endpoint
+@app.get("/api/embeddings/jobs/{job_id}", response_model=EmbeddingJobResponse)
+async def get_embedding_job(
+    job_id: str,
+    user_id: str = Depends(get_current_user)
+):
+    """Report progress of an embedding job"""
+    job = await embedding_jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Embedding job not found"
+        )
+    return embedding_job_response(job)
+
+def embedding_job_response(job: Job) -> EmbeddingJobResponse:
+    return EmbeddingJobResponse(
+        job_id=job.id,
+        status=job.status,
+        done=job.done,
+        total=job.total,
+        attempts=job.attempts,
+        error=job.error,
+        report=job.result
+    )
+
+async def run_embedding_job(job: Job, progress) -> Dict:
+    """Job handler: embed only new or changed user data and drop embeddings of deleted items"""
+    report = await rag_service.sync_user_embeddings(
+        job.user_id,
+        force=job.params.get('force', False),
+        progress=progress
+    )
+    return asdict(report)
+
+# Context cache invalidation (called by the app after saving profile or onboarding answers)
+@app.post("/api/context/invalidate", status_code=status.HTTP_204_NO_CONTENT)
+async def invalidate_context(user_id: str = Depends(get_current_user)):
+    """Drop the cached profile/onboarding context of the current user"""
+    context_cache.pop(user_id)
+    forget_prompt_fragments(user_id)
+
+# Cache statistics
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Hit rates and sizes of the in-process caches, and how searches were answered"""
+    return {
+        'context': context_cache.stats(),
+        'prompt_fragments': prompt_fragment_cache.stats(),
+        'auth_tokens': token_verifier.cache.stats(),
+        'embeddings': embedding_cache.stats(),
+        'keyword_indexes': rag_service.keyword_indexes.stats(),
+        'vector_store': vector_backend.stats(),
+        'search': rag_service.search_stats,
+        'coach_admission': coach_admission.stats(),
+        'coach_routing': coach_router.stats(),
+        'conversations': conversation_store.stats(),
+        'coach_queries': {**coach_queries.stats(), 'cache': coach_queries.cache.stats()},
+        'context_loads': context_loads.stats(),
+        'user_state_refresh': user_state_refresher.stats() if user_state_refresher else None,
+        'upstreams': {name: upstream.stats() for name, upstream in upstreams.items()}
+    }
+
 # Helper functions
-async def get_user_context(user_id: str) -> Dict:
-    """Get user profile and preferences"""
+async def load_conversation(user_id: str, conversation_id: Optional[str]) -> Optional[Conversation]:
+    """The user's server-side conversation, or None when the client sends its own chat_history"""
+    if not conversation_id:
+        return None
     try:
-        # Get user profile - handle case where profile might not exist
-        profile_result = supabase.table('profiles').select('*').eq('id', user_id).execute()
-        profile = profile_result.data[0] if profile_result.data else {}
-        
-        # Get onboarding answers
-        onboarding_result = supabase.table('onboarding_answers').select('*').eq('user_id', user_id).execute()
-        onboarding = onboarding_result.data if onboarding_result.data else []
-        
-        # Debug: Log what we found
-        logger.info(f"User ID being queried: {user_id}")
-        logger.info(f"Profile found: {bool(profile)}")
-        logger.info(f"Onboarding answers found: {len(onboarding) if onboarding else 0}")
-        
-        return {
-            'profile': profile,
-            'onboarding': onboarding
-        }
+        return await conversation_store.load(user_id, conversation_id)
+    except ConversationNotFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation not found"
+        )
+
+async def remember_turn(conversation: Conversation, message: str, response: str, asked_at: datetime) -> bool:
+    """Store a finished exchange and return whether it was stored; once too many turns are unsummarized, fold them in the background"""
+    if not response or response == COACH_FALLBACK_RESPONSE:
+        return False  # The user will ask again; a failed answer is not worth remembering
+    try:
+        await conversation_store.append_turn(conversation, message, response, asked_at)
     except Exception as e:
-        logger.error(f"Error getting user context: {e}")
-        return {'profile': {}, 'onboarding': []}
+        # Reported to the client as stored: false, so the app keeps the turn itself
+        logger.error(f"Error saving coach turn: {e}")
+        return False
+    if conversation_store.needs_compaction(conversation):
+        run_in_background(conversation_compactions.do(conversation.id, lambda: compact_conversation(conversation.id)))
+    return True
 
-async def get_relevant_data(user_id: str, query: str) -> List[Dict]:
-    """Get relevant data using vector similarity search"""
+def run_in_background(coroutine):
+    """Start work that must not delay the response; it is awaited on shutdown"""
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def compact_conversation(conversation_id: str):
     try:
-        # For now, return basic data - we'll implement vector search next
-        goals_result = supabase.table('goals').select('*').eq('user_id', user_id).execute()
-        tasks_result = supabase.table('tasks').select('*').eq('user_id', user_id).execute()
-        journals_result = supabase.table('journal_entries').select('*').eq('user_id', user_id).execute()
+        with span("summarize"):
+            await conversation_store.compact(conversation_id)
+    except Exception as e:
+        logger.error(f"Error summarizing conversation {conversation_id}: {e}")
+
+async def summarize_conversation(summary: Optional[str], turns: List[Dict]) -> str:
+    """Fold turns into a conversation's rolling summary (with the fast model when there is one)"""
+    model = COACH_FAST_MODEL or COACH_MODEL
+    response = await openai_client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": CONVERSATION_SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": render_summary_request(summary, turns)}
+        ],
+        temperature=0.2,
+        max_tokens=CONVERSATION_SUMMARY_MAX_TOKENS
+    )
+    record_token_usage(model, response.usage and response.usage.model_dump())
+    content = (response.choices[0].message.content or "").strip()
+    if not content:
+        raise ValueError("Summarizer returned an empty summary")
+    return content
+
+async def load_coach_context(user_id: str) -> Tuple[Dict, Dict]:
+    """Get the (cached) user context and a fresh snapshot of goals, tasks and journals"""
+    # Simultaneous requests of one user share a single snapshot load
+    return await context_loads.do(user_id, lambda: fetch_coach_context(user_id))
+
+async def fetch_coach_context(user_id: str) -> Tuple[Dict, Dict]:
+    user_context = context_cache.get(user_id)
+    # Profile and onboarding rarely change, so they are only fetched on a cache miss
+    snapshot = await get_user_snapshot(user_id, include_profile=user_context is None)
+    if user_context is None:
+        user_context = get_user_context(user_id, snapshot)
+        forget_prompt_fragments(user_id)
+        if snapshot:
+            context_cache.set(user_id, user_context)
+    if snapshot:
+        # get_user_snapshot only returns the precomputed state while it is built from the current data version; otherwise it is computed now
+        state, stored = current_state(snapshot)
+        user_states.inc(source="stored" if stored else "computed")
+        user_context = {**user_context, 'state': state}
+    return user_context, snapshot
+
+async def get_user_snapshot(user_id: str, include_profile: bool = True) -> Dict:
+    """Get the user's profile, onboarding, goals, tasks and journals in one round-trip"""
+    try:
+        # The service role can see the user's state summary; user_id comes from the verified token
+        result = await supabase_admin.rpc('get_user_snapshot', {
+            'user_id_param': user_id,
+            'include_profile': include_profile
+        }).execute()
+        return result.data or {}
+    except Exception as e:
+        logger.error(f"Error getting user snapshot: {e}")
+        return {}
+
+def get_user_context(user_id: str, snapshot: Dict) -> Dict:
+    """Get user profile and preferences"""
+    profile = snapshot.get('profile') or {}
+    onboarding = snapshot.get('onboarding') or []
+    
+    # Debug: Log what we found
+    logger.info(f"User ID being queried: {user_id}")
+    logger.info(f"Profile found: {bool(profile)}")
+    logger.info(f"Onboarding answers found: {len(onboarding)}")
+    
+    return {
+        'profile': profile,
+        'onboarding': onboarding
+    }
+
+async def get_relevant_data(user_id: str, query: str, snapshot: Dict) -> List[Dict]:
+    """Rank the user's goals, tasks and journals by search relevance and priority"""
+    try:
+        # Candidate items from the snapshot; vector search ranks them against the query
+        goals = snapshot.get('goals') or []
+        tasks = snapshot.get('tasks') or []
+        journals = snapshot.get('journals') or []
         
         relevant_data = []
         
-        # Debug: Check what user IDs exist in the tables
-        all_goals = supabase.table('goals').select('user_id').execute()
-        all_tasks = supabase.table('tasks').select('user_id').execute()
-        
-        if all_goals.data:
-            unique_goal_users = list(set([goal['user_id'] for goal in all_goals.data]))
-            logger.info(f"All user IDs with goals: {unique_goal_users}")
-        if all_tasks.data:
-            unique_task_users = list(set([task['user_id'] for task in all_tasks.data]))
-            logger.info(f"All user IDs with tasks: {unique_task_users}")
-        
-        if goals_result.data:
-            logger.info(f"Found {len(goals_result.data)} goals for user {user_id}")
+        if goals:
+            logger.info(f"Found {len(goals)} goals for user {user_id}")
             relevant_data.extend([{
                 'type': 'goal',
+                'id': goal.get('id'),
                 'content': f"{goal['title']} (Due: {goal.get('due_date', 'No due date')}, Progress: {goal.get('progress', 0)}%)",
                 'metadata': {'due_date': goal.get('due_date'), 'progress': goal.get('progress'), 'timeframe': goal.get('timeframe')}
-            } for goal in goals_result.data])
+            } for goal in goals])
         else:
             logger.info(f"No goals found for user {user_id}")
         
-        if tasks_result.data:
-            logger.info(f"Found {len(tasks_result.data)} tasks for user {user_id}")
+        if tasks:
+            logger.info(f"Found {len(tasks)} tasks for user {user_id}")
             relevant_data.extend([{
                 'type': 'task',
+                'id': task.get('id'),
                 'content': f"{task['title']} (Status: {task.get('status', 'Unknown')}, High Impact: {task.get('is_high_impact', False)})",
                 'metadata': {'status': task.get('status'), 'is_high_impact': task.get('is_high_impact'), 'is_completed': task.get('is_completed')}
-            } for task in tasks_result.data])
+            } for task in tasks])
         else:
             logger.info(f"No tasks found for user {user_id}")
         
-        if journals_result.data:
-            logger.info(f"Found {len(journals_result.data)} journal entries for user {user_id}")
+        if journals:
+            logger.info(f"Found {len(journals)} journal entries for user {user_id}")
             relevant_data.extend([{
                 'type': 'journal',
+                'id': journal.get('id'),
                 'content': journal.get('content', ''),
                 'metadata': {'mood': journal.get('mood'), 'created_at': journal.get('created_at')}
-            } for journal in journals_result.data])
+            } for journal in journals])
         else:
             logger.info(f"No journal entries found for user {user_id}")
         
-        logger.info(f"Total relevant data items: {len(relevant_data)}")
-        return relevant_data[:10]  # Limit to 10 most recent items
+        logger.info(f"Total candidate data items: {len(relevant_data)}")
+        matches = await rag_service.search_relevant_data(
+            user_id,
+            query,
+            limit=RAG_SEARCH_DEPTH,
+            match_threshold=RAG_MATCH_THRESHOLD,
+            candidates=relevant_data
+        )
+        # Every candidate is scored; matched ones carry their relevance (and matched chunk)
+        matched = {(item['type'], str(item.get('id'))): item for item in matches}
+        scored = [matched.pop((item['type'], str(item.get('id'))), item) for item in relevant_data]
+        return prioritize(scored + list(matched.values()), RAG_MATCH_COUNT, priority_weights)
         
     except Exception as e:
         logger.error(f"Error getting relevant data: {e}")
         return []
 
-async def generate_coach_response(user_context: Dict, relevant_data: List[Dict], user_message: str, chat_history: Optional[List[Dict]] = None) -> str:
-    """Generate personalized AI coach response"""
+def forget_prompt_fragments(user_id: str):
+    """Drop the rendered prompt fragments of a user (every prompt version)"""
+    for version in PROMPT_TEMPLATES:
+        prompt_fragment_cache.pop((user_id, version))
+
+def user_prompt_section(user_id: str, user_context: Dict, template: PromptTemplate) -> str:
+    """Rendered per-user prompt fragment, cached alongside the user context until the user's data or the day changes"""
+    key = (user_id, template.version)
+    state = user_context.get('state')
+    today = datetime.now(timezone.utc).date()
+    # Overdue days and the streak are rendered for today, so the fragment is also keyed on the day
+    state_key = (state.source_version, today) if state else None
+    cached = prompt_fragment_cache.get(key)
+    if cached is not None and cached[0] == state_key:
+        return cached[1]
+    profile = user_context.get('profile') or {}
+    name = profile.get('display_name') or profile.get('first_name') or 'a user'
+    section = template.user_section(
+        name, format_user_context(user_context), coach_prompt_budget, COACH_MODEL,
+        state_lines(state, today) if state else ()
+    )
+    prompt_fragment_cache.set(key, (state_key, section))
+    return section
+
+def build_coach_messages(user_id: str, user_context: Dict, relevant_data: List[Dict], user_message: str, chat_history: Optional[List[Dict]] = None, summary: Optional[str] = None) -> Tuple[PromptPlan, str]:
+    """Assemble the chat completion messages for a coach turn within COACH_PROMPT_BUDGET"""
+    template = choose_template(user_id, COACH_PROMPT_WEIGHTS)
+    plan = assemble_prompt(
+        template.instructions,
+        user_prompt_section(user_id, user_context, template),
+        template.data_section,
+        format_relevant_data(relevant_data),
+        user_message,
+        chat_history,
+        budget=coach_prompt_budget,
+        model=COACH_MODEL,
+        summary=summary
+    )
+    logger.info(f"Coach prompt {template.version} tokens: {plan.tokens} turns: {plan.turns}")
+    return plan, template.version
+
+async def generate_coach_response(user_id: str, user_context: Dict, relevant_data: List[Dict], user_message: str, chat_history: Optional[List[Dict]] = None, summary: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """Generate personalized AI coach response: (content, prompt version that answered)"""
+    prompt_version = None
     try:
-        # Build system prompt
-        system_prompt = build_system_prompt(user_context, relevant_data)
-        
-        # Prepare conversation
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
+        with span("prompt"):
+            plan, prompt_version = build_coach_messages(user_id, user_context, relevant_data, user_message, chat_history, summary)
         
-        # Add chat history to messages if provided
-        if chat_history:
-            for turn in chat_history:
-                messages.append({"role": "user", "content": turn["message"]})
-                messages.append({"role": "assistant", "content": turn["response"]})
+        decision = route_coach_query(user_message, chat_history, relevant_data)
+        try:
+            content, finish_reason = await complete_coach(decision.model, plan.messages, prompt_version)
+            escalation = coach_router.escalation(decision, content, finish_reason)
+        except Exception as e:
+            escalation = coach_router.escalation(decision, failed=True)
+            if escalation is None:
+                raise
+            logger.warning(f"Coach completion with {decision.model} failed: {e}")
         
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
+        if escalation is not None:
+            logger.info(f"Coach route escalated to {escalation.model} ({escalation.reason})")
+            content, _ = await complete_coach(escalation.model, plan.messages, prompt_version)
+        return content, prompt_version
         
-        # Generate response using OpenAI (new syntax)
-        response = openai_client.chat.completions.create(
-            model="gpt-4",
+    except Exception as e:
+        logger.error(f"Error generating AI response: {e}")
+        coach_errors.inc(kind=type(e).__name__, prompt_version=prompt_version or "none")
+        return COACH_FALLBACK_RESPONSE, prompt_version
+
+def route_coach_query(user_message: str, chat_history: Optional[List[Dict]], relevant_data: List[Dict]) -> RouteDecision:
+    """Pick the model tier for a coach turn and log the decision with its features for tuning"""
+    decision = coach_router.route(user_message, chat_history, relevant_data)
+    logger.info(f"Coach route {decision.tier}/{decision.model} ({decision.reason}) {asdict(decision.features)}")
+    return decision
+
+async def complete_coach(model: str, messages: List[Dict], prompt_version: str) -> Tuple[str, Optional[str]]:
+    """One chat completion: (content, finish_reason); feeds the router's view of the model's health"""
+    started = time.perf_counter()
+    try:
+        with span("completion"):
+            response = await openai_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=COACH_TEMPERATURE,
+                max_tokens=COACH_MAX_TOKENS
+            )
+    except Exception:
+        coach_router.record(model, time.perf_counter() - started, ok=False)
+        raise
+    coach_router.record(model, time.perf_counter() - started, ok=True)
+    record_token_usage(model, response.usage and response.usage.model_dump(), prompt_version)
+    choice = response.choices[0]
+    return choice.message.content, choice.finish_reason
+
+def record_token_usage(model: str, usage: Optional[Dict], prompt_version: Optional[str] = None):
+    """Add a completion's prompt/completion token counts to the token counter"""
+    for kind in ('prompt', 'completion'):
+        if usage and usage.get(f'{kind}_tokens'):
+            openai_tokens.inc(usage[f'{kind}_tokens'], model=model, kind=kind, prompt_version=prompt_version or "none")
+
+async def release_when_done(permit: Permit, events: AsyncGenerator[str, None]) -> AsyncIterator[str]:
+    """Pass events through and release the admission permit when the stream ends or is cancelled"""
+    try:
+        async for event in events:
+            yield event
+    finally:
+        permit.release()
+        await events.aclose()
+
+async def open_coach_stream(model: str, messages: List[Dict]):
+    """Start a streamed chat completion; a failure to start counts against the model's health"""
+    started = time.perf_counter()
+    try:
+        return await openai_client.chat.completions.create(
+            model=model,
             messages=messages,
-            temperature=0.7,
-            max_tokens=500
+            temperature=COACH_TEMPERATURE,
+            max_tokens=COACH_MAX_TOKENS,
+            stream=True,
+            stream_options={"include_usage": True}
         )
+    except Exception:
+        coach_router.record(model, time.perf_counter() - started, ok=False)
+        raise
+
+def sse_event(event: str, data: Dict) -> str:
+    """Format a Server-Sent Event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_coach_response(request: Request, user_id: str, user_context: Dict, relevant_data: List[Dict], user_message: str, chat_history: Optional[List[Dict]] = None,
+                                conversation: Optional[Conversation] = None, asked_at: Optional[datetime] = None) -> AsyncIterator[str]:
+    """Stream the coach completion as SSE: `token` events, then one `done` (or `error`) event"""
+    started = time.perf_counter()
+    first_token_ms = None
+    decision = None
+    prompt_version = None
+    stream = None
+    try:
+        # Inside the try so a failure here still reaches the client as an `error` event
+        with span("prompt"):
+            plan, prompt_version = build_coach_messages(user_id, user_context, relevant_data, user_message, chat_history,
+                                                        conversation.summary if conversation else None)
+        decision = route_coach_query(user_message, chat_history, relevant_data)
+        try:
+            stream = await open_coach_stream(decision.model, plan.messages)
+        except Exception as e:
+            # Nothing has been sent yet, so a failed fast-tier stream can still move to the strong model
+            escalation = coach_router.escalation(decision, failed=True)
+            if escalation is None:
+                raise
+            logger.warning(f"Coach stream with {decision.model} failed: {e}")
+            decision = escalation
+            stream = await open_coach_stream(decision.model, plan.messages)
+        
+        usage = None
+        parts = []
+        async for chunk in stream:
+            if await request.is_disconnected():
+                logger.info("Client disconnected, cancelling coach stream")
+                return
+            if chunk.usage:
+                usage = chunk.usage.model_dump()
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - started) * 1000)
+                    coach_first_token_seconds.observe(first_token_ms / 1000)
+                    coach_router.record(decision.model, first_token_ms / 1000, ok=True)
+                parts.append(chunk.choices[0].delta.content)
+                yield sse_event("token", {"content": chunk.choices[0].delta.content})
         
-        return response.choices[0].message.content
+        record_token_usage(decision.model, usage, prompt_version)
+        coach_stream_seconds.observe(time.perf_counter() - started)
+        stored = bool(conversation) and await remember_turn(conversation, user_message, "".join(parts), asked_at or datetime.now(timezone.utc))
+        yield sse_event("done", {
+            "relevant_data": relevant_data,
+            "usage": usage,
+            "model": decision.model,
+            "conversation_id": conversation.id if conversation else None,
+            "stored": stored,
+            "prompt_tokens": plan.tokens,
+            "prompt_version": prompt_version,
+            "time_to_first_token_ms": first_token_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000)
+        })
         
     except Exception as e:
-        logger.error(f"Error generating AI response: {e}")
-        return "I'm having trouble processing your request right now. Please try again later."
+        logger.error(f"Error streaming AI response: {e}")
+        coach_errors.inc(kind=type(e).__name__, prompt_version=prompt_version or "none")
+        if stream is not None and first_token_ms is None:
+            coach_router.record(decision.model, time.perf_counter() - started, ok=False)
+        yield sse_event("error", {"detail": COACH_FALLBACK_RESPONSE})
+    finally:
+        # Closing the response aborts the upstream completion so we stop paying for tokens.
+        # Shielded because Starlette cancels this generator when the client disconnects.
+        if stream is not None:
+            with anyio.CancelScope(shield=True):
+                await stream.close()
 
-def build_system_prompt(user_context: Dict, relevant_data: List[Dict]) -> str:
-    """Build personalized system prompt for the AI coach"""
-    profile = user_context.get('profile', {})
-    onboarding = user_context.get('onboarding', [])
-    
-    # Format relevant data
-    data_summary = ""
-    for item in relevant_data:
-        data_summary += f"- {item['type'].title()}: {item['content'][:100]}...\n"
-    
-    return f"""
-    You are personalized AI coach called **Coach DIGM** for {profile.get('display_name', profile.get('first_name', 'a user'))}
-    You have are an abundance-minded, servant-leadership AI coach blending the voices of Tony Robbins, Les Brown, Dr. Myles Munroe, 
-    Kobe Bryant, and Napoleon Hill. You are a wise, supportive guide who helps users discover and live their **Vision • Identity • Purpose**. 
-    Foundations are faith-informed but never preachy or pushy.
-
-    USER CONTEXT
-    - Vision: {profile.get('vision', 'Not set yet')}
-    - Level: {profile.get('level', 1)}
-    - XP: {profile.get('xp', 0)}
-    - Onboarding: {onboarding}
-
-    AVAILABLE USER DATA
-    {data_summary}
-
-    COACHING STYLE
-    - Conversational; use bullets when helpful; be concise, uplifting, and high-energy.
-    - Practice servant leadership: put the user’s growth and wellbeing first, empower them to lead their own journey.
-    - People first. Impact → Influence → Income.
-    - Encourage big thinking; break false beliefs; defeat distractions (“Big Boss” = fear, lies, drifting).
-    - Tie advice to their actual data, values, and vision.
-    - If journal tone is negative: be empathetic; never shame; provide stabilizing support and practical steps forward.
-
-    CRITICAL INSTRUCTIONS
-    - **Must** cite concrete items from AVAILABLE USER DATA (goals, tasks, progress, journals). If none: say “I don’t see any [goals/tasks/etc.] yet.”
-    - Do not invent facts or goals. Avoid generic advice.
-    - Where relevant, help the user: clarify vision, align identity, define core values, turn vision into **SMART** goals, create time-blocked plans, suggest vision boards.
-    - Label distractions/false beliefs as “Big Boss” and provide strategies to overcome them.
-    - Safety: If crisis signals appear, encourage real-world help; do not give medical/legal/financial directives.
-
-    RESPONSE FORMAT (≤ ~200 words)
-    1) Acknowledge + reflect emotion/context
-    2) Mirror their **actual data** (goals/tasks/progress/notes)
-    3) Insight: what matters now (tie to Vision/Identity/Values)
-    4) **Action plan**: 3–5 concrete next steps (SMART + time-block)
-    5) Motivation: short, powerful closer in Coach DIGM’s servant-leader voice
-
-    GUARDRAILS
-    - Always stay in role as Coach DIGM.
-    - If conversation drifts off-topic (jokes, gossip, trivia, random info requests), gently steer it back to the user’s Vision, Identity, Purpose, or growth.
-    - Do not provide medical, financial, or legal advice. Instead, encourage seeking real-world experts while offering support for mindset and habits.
-    - When irrelevant questions arise, acknowledge them briefly but pivot with: “How does this tie into your bigger goals or vision?” 
-    - Every response must ultimately reinforce servant leadership, abundance mindset, actionable growth, and breaking false beliefs.
-
-    ---
-
-    ### FEW-SHOT EXAMPLES
-
-    **Example 1 – User asks:** “What are my goals?”
-    - Response:
-    “Great question — let’s look at what you’ve already set for yourself.  
-
-    Here’s what I see in your data:  
-    Goal🎯 Finish PMP certification (Due: July 15, Progress: 40%)  
-    Goal🎯 Build DIGM app MVP (Due: September, Progress: 20%)  
-
-    What matters now is prioritizing time-blocks so each goal gets steady focus.  
-
-    Next Steps⏭️
-    1. Schedule 2 study blocks this week for PMP.  
-    2. Dedicate one 90-min deep work session daily to the MVP.  
-    3. Track small wins so momentum builds.  
-
-    Remember: servant leaders lead by example — your discipline now sets the standard for your future influence.”
-
-    ---
-
-    **Example 2 – User journals negatively:** “I feel stuck. Nothing I do works.”
-    - Response:
-    “I hear the frustration in your words. It’s okay to feel this way — but this feeling does *not* define who you are.  
-    Looking at your data, I see: 3 active tasks still open, including ‘Draft app wireframes’ and ‘Study Module 5 for PMP’. These are opportunities to create momentum.  
-
-    DIGM Shift🧠👀 
-    The ‘Big Boss’ here is the false belief that effort = failure. That’s not true — each attempt is progress and learning.  
-
-    Next Steps⏭️
-    1. Break ‘Draft app wireframes’ into one small step: sketch the home screen today.  
-    2. Celebrate completion🎉, not perfection.  
-    3. Journal tonight: write 3 things you did accomplish today.  
-
-    You’re not stuck — you’re in the middle of building. And remember: diamonds form under pressure. You’ve got this.💎”
-    """
-
-async def generate_user_embeddings(user_id: str) -> int:
-    """Generate embeddings for all user data (placeholder for now)"""
-    # This will be implemented in the next step with pgvector
-    logger.info(f"Placeholder: Would generate embeddings for user {user_id}")
-    return 0
+def format_user_context(user_context: Dict) -> List[str]:
+    """USER CONTEXT lines: profile basics, then one line per onboarding answer"""
+    profile = user_context.get('profile') or {}
+    lines = [
+        f"- Vision: {profile.get('vision') or 'Not set yet'}",
+        f"- Level: {profile.get('level', 1)}",
+        f"- XP: {profile.get('xp', 0)}",
+    ]
+    for answers in user_context.get('onboarding') or []:
+        if not isinstance(answers, dict):
+            lines.append(f"- Onboarding: {answers}")
+            continue
+        for question, answer in answers.items():
+            if isinstance(answer, list):
+                answer = ", ".join(str(a) for a in answer)
+            if answer not in (None, ""):
+                lines.append(f"- Onboarding {str(question).replace('_', ' ')}: {answer}")
+    return lines
+
+def format_relevant_data(relevant_data: List[Dict]) -> List[str]:
+    """AVAILABLE USER DATA lines, most relevant first"""
+    return [f"- {item['type'].title()}: {item['content']}" for item in relevant_data]
 
 if __name__ == "__main__":
     import uvicorn
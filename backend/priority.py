@@ -0,0 +1,150 @@
+import math
+from dataclasses import dataclass, fields, replace
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Feature columns, in the order of PriorityWeights.vector()
+FEATURES = ("similarity", "due", "progress", "high_impact", "completed", "recency", "mood")
+
+# Days until a due date (or since a journal entry) at which that feature has halved
+DUE_HALF_LIFE_DAYS = 7.0
+RECENCY_HALF_LIFE_DAYS = 3.0
+
+# How low a worded mood is, 0 (fine) to 1 (struggling); numeric moods are read as 1-5 (or 1-10)
+MOOD_LOWNESS = {
+    "awful": 1.0, "terrible": 1.0, "depressed": 1.0,
+    "sad": 0.75, "bad": 0.75, "anxious": 0.75, "stressed": 0.75, "angry": 0.75, "frustrated": 0.75,
+    "tired": 0.5, "meh": 0.5, "low": 0.5,
+    "okay": 0.25, "ok": 0.25, "neutral": 0.25, "calm": 0.25,
+    "good": 0.0, "happy": 0.0, "great": 0.0, "excited": 0.0, "amazing": 0.0, "motivated": 0.0,
+}
+
+
+@dataclass(frozen=True)
+class PriorityWeights:
+    """Weight per feature (each feature is in [0, 1]) plus the same-type diversity penalty"""
+    similarity: float = 3.0    # search relevance to the message, relative to the best match
+    due: float = 1.5           # goal due soon or overdue
+    progress: float = 0.5      # goal still far from done
+    high_impact: float = 1.0   # high-impact task
+    completed: float = -2.0    # finished goal or task
+    recency: float = 1.0       # journal written recently
+    mood: float = 0.75         # journal written in a low mood
+    diversity: float = 0.75    # subtracted per better-scored item of the same type
+
+    def vector(self) -> np.ndarray:
+        return np.array([getattr(self, name) for name in FEATURES], dtype=np.float64)
+
+
+def parse_priority_weights(spec: str, base: PriorityWeights = PriorityWeights()) -> PriorityWeights:
+    """Parse "similarity=2, due=1" into base with those weights replaced"""
+    known = {field.name for field in fields(PriorityWeights)}
+    overrides = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in known or not value.strip():
+            raise ValueError(f"Bad priority weight {part!r}; expected name=number with name in {sorted(known)}")
+        overrides[name] = float(value)
+    return replace(base, **overrides)
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """Timezone-aware datetime from an ISO string (naive values are taken as UTC); None if missing or unparseable"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _days_from(now: datetime, value) -> float:
+    """Days from now until value (negative if in the past); NaN if missing or unparseable"""
+    moment = parse_timestamp(value)
+    return (moment - now).total_seconds() / 86400 if moment else math.nan
+
+
+def _number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def mood_lowness(mood) -> float:
+    """How low a journal mood is, from 0 (best) to 1 (worst): a known mood word, or a 1-5 / 1-10 rating; NaN if unknown"""
+    if isinstance(mood, str) and mood.strip().lower() in MOOD_LOWNESS:
+        return MOOD_LOWNESS[mood.strip().lower()]
+    value = _number(mood)
+    if math.isnan(value) or isinstance(mood, bool):
+        return math.nan
+    top = 5.0 if value <= 5 else 10.0
+    return min(max((top - value) / (top - 1), 0.0), 1.0)
+
+
+def feature_matrix(items: Sequence[Dict], now: Optional[datetime] = None) -> np.ndarray:
+    """(len(items), len(FEATURES)) matrix of features in [0, 1] for relevant_data items.
+
+    Raw fields are read once per item; every transform after that is a column
+    operation, so scoring cost is dominated by the single pass over metadata.
+    """
+    now = now or datetime.now(timezone.utc)
+    metadata = [item.get("metadata") or {} for item in items]
+    is_goal = np.array([item["type"] == "goal" for item in items])
+    is_journal = np.array([item["type"] == "journal" for item in items])
+    relevance = np.array([_number(item.get("relevance_score")) for item in items])
+    due_days = np.array([_days_from(now, meta.get("due_date")) for meta in metadata])
+    age_days = -np.array([_days_from(now, meta.get("created_at")) for meta in metadata])
+    progress = np.array([_number(meta.get("progress")) for meta in metadata])
+    high_impact = np.array([bool(meta.get("is_high_impact")) for meta in metadata])
+    done = np.array([bool(meta.get("is_completed")) or meta.get("status") == "done" for meta in metadata])
+    mood = np.array([mood_lowness(meta.get("mood")) for meta in metadata])
+
+    with np.errstate(invalid="ignore"):
+        best = np.nanmax(relevance) if np.any(relevance > 0) else 1.0
+        similarity = np.clip(np.nan_to_num(relevance / best), 0.0, 1.0)
+        # Overdue and due today score 1, then halve every DUE_HALF_LIFE_DAYS
+        due = np.nan_to_num(0.5 ** (np.clip(due_days, 0.0, None) / DUE_HALF_LIFE_DAYS))
+        remaining = np.where(is_goal, np.nan_to_num(1.0 - np.clip(progress, 0.0, 100.0) / 100.0), 0.0)
+        completed = done | (is_goal & (progress >= 100))
+        recency = np.where(is_journal, np.nan_to_num(0.5 ** (np.clip(age_days, 0.0, None) / RECENCY_HALF_LIFE_DAYS)), 0.0)
+        low_mood = np.where(is_journal, np.nan_to_num(mood), 0.0)
+
+    return np.column_stack([
+        similarity, due, remaining, high_impact, completed, recency, low_mood
+    ]).astype(np.float64)
+
+
+def select_diverse(types: Sequence[str], scores: np.ndarray, k: int, diversity: float) -> List[int]:
+    """Indexes of the top k items after penalizing each by diversity x its rank within its type.
+
+    This equals greedily picking the best item and charging ``diversity`` to
+    every remaining item of the same type, but runs as a sort instead of a loop.
+    """
+    if k <= 0 or not len(scores):
+        return []
+    codes = np.unique(np.asarray(types), return_inverse=True)[1]
+    order = np.lexsort((-scores, codes))
+    sorted_codes = codes[order]
+    rank = np.empty(len(scores), dtype=np.int64)
+    rank[order] = np.arange(len(scores)) - np.searchsorted(sorted_codes, sorted_codes, side="left")
+    adjusted = scores - diversity * rank
+    return np.argsort(-adjusted, kind="stable")[:k].tolist()
+
+
+def prioritize(
+    items: Sequence[Dict],
+    k: int,
+    weights: PriorityWeights = PriorityWeights(),
+    now: Optional[datetime] = None,
+) -> List[Dict]:
+    """The k items most worth showing the coach, each with its ``priority_score``"""
+    if not items:
+        return []
+    scores = feature_matrix(items, now) @ weights.vector()
+    chosen = select_diverse([item["type"] for item in items], scores, k, weights.diversity)
+    return [{**items[i], "priority_score": round(float(scores[i]), 4)} for i in chosen]
@@ -0,0 +1,242 @@
+import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence
+
+from chunking import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Chat models spend a few tokens framing every message, plus a few to prime the reply
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+ELLIPSIS = "…"
+SUMMARY_HEADER = "Summary of the conversation so far:"
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    """tiktoken encoding for model, or None to fall back to the character estimate"""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Not installed, or the encoding file could not be downloaded
+        logger.warning(f"tiktoken unavailable ({e}), estimating prompt tokens from length")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = "gpt-4") -> str:
+    """Cut text to at most max_tokens, marking the cut with an ellipsis"""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    if max_tokens <= 1:
+        return ""
+    encoding = _encoding(model)
+    if encoding is None:
+        cut = text[:(max_tokens - 2) * 4].rstrip() + ELLIPSIS
+    else:
+        cut = encoding.decode(encoding.encode(text)[:max_tokens - 1]).rstrip() + ELLIPSIS
+    # Re-encoding can merge differently at the cut, so shrink until it really fits
+    while cut and count_tokens(cut, model) > max_tokens:
+        cut = cut[:-2] + ELLIPSIS if len(cut) > 2 else ""
+    return cut
+
+
+def count_message_tokens(messages: Sequence[Dict], model: str = "gpt-4") -> int:
+    """Prompt tokens of a chat completion request"""
+    return REPLY_PRIMING_TOKENS + sum(
+        MESSAGE_OVERHEAD_TOKENS + count_tokens(message["content"], model) for message in messages
+    )
+
+
+@dataclass
+class PromptBudget:
+    """Token budget of one coach prompt.
+
+    ``total`` is a hard ceiling on prompt tokens. The static instructions, the
+    per-user context (capped at ``context``) and the user's message come first;
+    the remainder is handed out in order to the retrieved items and the chat
+    history, each up to its own cap.
+    """
+    total: int = 4000
+    message: int = 600
+    context: int = 300
+    state: int = 200                   # precomputed coaching state (within the per-user section)
+    retrieved: int = 600
+    history: int = 1200
+    item_tokens: int = 128             # per retrieved item / context line (fits a journal chunk)
+    recent_turns: int = 3              # newest turns kept verbatim
+    summary: int = 400                 # rolling summary of a server-side conversation (within history)
+    compressed_turn_tokens: int = 60   # per older turn in the summary
+
+
+@dataclass
+class PromptPlan:
+    messages: List[Dict]
+    tokens: Dict[str, int] = field(default_factory=dict)
+    turns: Dict[str, int] = field(default_factory=dict)
+
+
+def pack_lines(lines: Sequence[str], max_tokens: int, line_tokens: int, model: str) -> List[str]:
+    """Leading lines (each capped at line_tokens) whose joined text fits max_tokens"""
+    packed: List[str] = []
+    for line in lines:
+        line = truncate_tokens(line, line_tokens, model)
+        if not line:
+            continue
+        if count_tokens("\n".join(packed + [line]), model) > max_tokens:
+            break
+        packed.append(line)
+    return packed
+
+
+def _turn_messages(turn: Dict) -> List[Dict]:
+    return [
+        {"role": "user", "content": turn.get("message") or ""},
+        {"role": "assistant", "content": turn.get("response") or ""},
+    ]
+
+
+def _compress_turn(turn: Dict, max_tokens: int, model: str) -> str:
+    half = max(max_tokens // 2, 1)
+    user = truncate_tokens(" ".join((turn.get("message") or "").split()), half, model)
+    coach = truncate_tokens(" ".join((turn.get("response") or "").split()), half, model)
+    return f"- User: {user} / Coach: {coach}"
+
+
+def _pack_history(history: Sequence[Dict], max_tokens: int, budget: PromptBudget, model: str, summary: Optional[str] = None):
+    """Recent turns verbatim, then the conversation summary and older turns compressed to one line each, all within max_tokens"""
+    verbatim: List[List[Dict]] = []
+    used = 0
+    older = list(history)
+    while older and len(verbatim) < budget.recent_turns:
+        turn = _turn_messages(older[-1])
+        cost = count_message_tokens(turn, model) - REPLY_PRIMING_TOKENS
+        if used + cost > max_tokens:
+            break
+        verbatim.insert(0, turn)
+        used += cost
+        older.pop()
+
+    sections: List[str] = []
+    compressed = 0
+    header = "Summary of earlier conversation (oldest first):"
+    remaining = max_tokens - used - MESSAGE_OVERHEAD_TOKENS
+    if summary:
+        text = truncate_tokens(" ".join(summary.split()), min(budget.summary, remaining - count_tokens(SUMMARY_HEADER + "\n", model)), model)
+        if text:
+            sections = [SUMMARY_HEADER, text]
+            remaining -= count_tokens("\n".join(sections) + "\n", model)
+    if older and remaining > count_tokens(header, model):
+        lines = [_compress_turn(turn, budget.compressed_turn_tokens, model) for turn in reversed(older)]
+        lines = pack_lines(lines, remaining - count_tokens(header + "\n", model), budget.compressed_turn_tokens + 8, model)
+        if lines:
+            sections += [header] + list(reversed(lines))
+            compressed = len(lines)
+
+    lead = [{"role": "system", "content": "\n".join(sections)}] if sections else []
+    messages = lead + [message for turn in verbatim for message in turn]
+    turns = {
+        'verbatim': len(verbatim),
+        'compressed': compressed,
+        'dropped': len(history) - len(verbatim) - compressed,
+        'summary': int(bool(sections) and sections[0] == SUMMARY_HEADER),
+    }
+    return messages, turns
+
+
+@lru_cache(maxsize=64)
+def _static_tokens(text: str, model: str) -> int:
+    """Token count of text that repeats across requests (the compiled instructions)"""
+    return count_tokens(text, model)
+
+
+def assemble_prompt(
+    instructions: str,
+    user_section: str,
+    data_section: Callable[[str], str],
+    retrieved_lines: Sequence[str],
+    user_message: str,
+    chat_history: Optional[Sequence[Dict]] = None,
+    budget: Optional[PromptBudget] = None,
+    model: str = "gpt-4",
+    summary: Optional[str] = None,
+) -> PromptPlan:
+    """Build chat messages that never exceed budget.total prompt tokens.
+
+    Messages are ordered from most to least stable so provider prefix caching
+    covers as much as possible: the static instructions, the per-user section,
+    the chat history (after ``summary``, the rolling summary of a server-side
+    conversation), then data_section(retrieved_text) and the user message.
+    Raises ValueError if the instructions and user section alone do not fit.
+    """
+    budget = budget or PromptBudget()
+    history = list(chat_history or [])
+
+    base = (
+        REPLY_PRIMING_TOKENS + 4 * MESSAGE_OVERHEAD_TOKENS
+        + _static_tokens(instructions, model)
+        + count_tokens(user_section, model)
+        + count_tokens(data_section(""), model)
+    )
+    if base >= budget.total:
+        raise ValueError(f"Prompt budget of {budget.total} tokens is smaller than the {base}-token fixed prompt")
+    remaining = budget.total - base
+
+    message = truncate_tokens(user_message, min(budget.message, remaining), model)
+    remaining -= count_tokens(message, model)
+
+    retrieved = pack_lines(retrieved_lines, min(budget.retrieved, remaining), budget.item_tokens, model)
+    remaining -= count_tokens("\n".join(retrieved), model)
+
+    history_messages, turns = _pack_history(history, min(budget.history, remaining), budget, model, summary)
+
+    def render():
+        return (
+            [{"role": "system", "content": instructions}, {"role": "system", "content": user_section}]
+            + history_messages
+            + [{"role": "system", "content": data_section("\n".join(retrieved))}, {"role": "user", "content": message}]
+        )
+
+    # Section counts are measured in isolation; joining them can shift a few
+    # tokens, so shed the least important content until the whole prompt fits.
+    messages = render()
+    while count_message_tokens(messages, model) > budget.total:
+        if history_messages and history_messages[0]["role"] == "system":
+            history_messages.pop(0)
+            turns['dropped'] += turns['compressed']
+            turns['compressed'] = 0
+            turns['summary'] = 0
+        elif history_messages:
+            del history_messages[:2]
+            turns['verbatim'] -= 1
+            turns['dropped'] += 1
+        elif retrieved:
+            retrieved.pop()
+        else:
+            message = truncate_tokens(message, count_tokens(message, model) - 1, model)
+        messages = render()
+
+    tokens = {
+        'instructions': _static_tokens(instructions, model),
+        'context': count_tokens(user_section, model),
+        'retrieved': count_tokens(messages[-2]["content"], model),
+        'history': count_message_tokens(history_messages, model) - REPLY_PRIMING_TOKENS if history_messages else 0,
+        'message': count_tokens(message, model),
+        'total': count_message_tokens(messages, model),
+    }
+    turns['retrieved_items'] = len(retrieved)
+    return PromptPlan(messages=messages, tokens=tokens, turns=turns)
@@ -0,0 +1,165 @@
+import hashlib
+import textwrap
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+from prompt_budget import PromptBudget, pack_lines
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """One version of the coach prompt.
+
+    ``instructions`` is compiled once and always sent first, byte for byte,
+    so the provider can reuse its cached prefix across users and turns. The
+    per-user and per-turn sections follow it as separate messages.
+    """
+    version: str
+    instructions: str
+    user_header: str = "USER CONTEXT"
+    state_header: str = "CURRENT STATE"
+    data_header: str = "AVAILABLE USER DATA"
+
+    def user_section(self, name: str, context_lines: Sequence[str], budget: PromptBudget, model: str = "gpt-4",
+                     state_lines: Sequence[str] = ()) -> str:
+        """Per-user fragment: who the coach is talking to (budget.context) and where they stand (budget.state)"""
+        lines = [f"You are coaching {name}.", "", self.user_header] + pack_lines(context_lines, budget.context, budget.item_tokens, model)
+        if state_lines:
+            lines += ["", self.state_header] + pack_lines(state_lines, budget.state, budget.item_tokens, model)
+        return "\n".join(lines)
+
+    def data_section(self, data_text: str) -> str:
+        """Per-turn fragment: the items retrieved for this message"""
+        return f"{self.data_header}\n{data_text}" if data_text else f"{self.data_header}\n(none found)"
+
+
+def _compile(text: str) -> str:
+    return textwrap.dedent(text).strip()
+
+
+COACH_V1 = PromptTemplate(
+    version="v1",
+    instructions=_compile("""
+    You are a personalized AI coach called **Coach DIGM**. The user you are coaching is described in USER CONTEXT below.
+    You have are an abundance-minded, servant-leadership AI coach blending the voices of Tony Robbins, Les Brown, Dr. Myles Munroe,
+    Kobe Bryant, and Napoleon Hill. You are a wise, supportive guide who helps users discover and live their **Vision • Identity • Purpose**.
+    Foundations are faith-informed but never preachy or pushy.
+
+    COACHING STYLE
+    - Conversational; use bullets when helpful; be concise, uplifting, and high-energy.
+    - Practice servant leadership: put the user’s growth and wellbeing first, empower them to lead their own journey.
+    - People first. Impact → Influence → Income.
+    - Encourage big thinking; break false beliefs; defeat distractions (“Big Boss” = fear, lies, drifting).
+    - Tie advice to their actual data, values, and vision.
+    - If journal tone is negative: be empathetic; never shame; provide stabilizing support and practical steps forward.
+
+    CRITICAL INSTRUCTIONS
+    - **Must** cite concrete items from AVAILABLE USER DATA (goals, tasks, progress, journals). If none: say “I don’t see any [goals/tasks/etc.] yet.”
+    - Do not invent facts or goals. Avoid generic advice.
+    - Where relevant, help the user: clarify vision, align identity, define core values, turn vision into **SMART** goals, create time-blocked plans, suggest vision boards.
+    - Label distractions/false beliefs as “Big Boss” and provide strategies to overcome them.
+    - Safety: If crisis signals appear, encourage real-world help; do not give medical/legal/financial directives.
+
+    RESPONSE FORMAT (≤ ~200 words)
+    1) Acknowledge + reflect emotion/context
+    2) Mirror their **actual data** (goals/tasks/progress/notes)
+    3) Insight: what matters now (tie to Vision/Identity/Values)
+    4) **Action plan**: 3–5 concrete next steps (SMART + time-block)
+    5) Motivation: short, powerful closer in Coach DIGM’s servant-leader voice
+
+    GUARDRAILS
+    - Always stay in role as Coach DIGM.
+    - If conversation drifts off-topic (jokes, gossip, trivia, random info requests), gently steer it back to the user’s Vision, Identity, Purpose, or growth.
+    - Do not provide medical, financial, or legal advice. Instead, encourage seeking real-world experts while offering support for mindset and habits.
+    - When irrelevant questions arise, acknowledge them briefly but pivot with: “How does this tie into your bigger goals or vision?”
+    - Every response must ultimately reinforce servant leadership, abundance mindset, actionable growth, and breaking false beliefs.
+
+    ---
+
+    ### FEW-SHOT EXAMPLES
+
+    **Example 1 – User asks:** “What are my goals?”
+    - Response:
+    “Great question — let’s look at what you’ve already set for yourself.
+
+    Here’s what I see in your data:
+    Goal🎯 Finish PMP certification (Due: July 15, Progress: 40%)
+    Goal🎯 Build DIGM app MVP (Due: September, Progress: 20%)
+
+    What matters now is prioritizing time-blocks so each goal gets steady focus.
+
+    Next Steps⏭️
+    1. Schedule 2 study blocks this week for PMP.
+    2. Dedicate one 90-min deep work session daily to the MVP.
+    3. Track small wins so momentum builds.
+
+    Remember: servant leaders lead by example — your discipline now sets the standard for your future influence.”
+
+    ---
+
+    **Example 2 – User journals negatively:** “I feel stuck. Nothing I do works.”
+    - Response:
+    “I hear the frustration in your words. It’s okay to feel this way — but this feeling does *not* define who you are.
+    Looking at your data, I see: 3 active tasks still open, including ‘Draft app wireframes’ and ‘Study Module 5 for PMP’. These are opportunities to create momentum.
+
+    DIGM Shift🧠👀
+    The ‘Big Boss’ here is the false belief that effort = failure. That’s not true — each attempt is progress and learning.
+
+    Next Steps⏭️
+    1. Break ‘Draft app wireframes’ into one small step: sketch the home screen today.
+    2. Celebrate completion🎉, not perfection.
+    3. Journal tonight: write 3 things you did accomplish today.
+
+    You’re not stuck — you’re in the middle of building. And remember: diamonds form under pressure. You’ve got this.💎”
+    """)
+)
+
+# Folds older turns of a server-side conversation into its rolling summary (conversations.py)
+CONVERSATION_SUMMARY_INSTRUCTIONS = _compile("""
+    You maintain the running memory of a coaching conversation between a user and Coach DIGM.
+    You get the summary so far (if any) and the turns that happened after it. Write the updated summary:
+    - Keep what the coach needs later: the user's stated goals, struggles, feelings, decisions and commitments,
+      advice already given, and open questions or follow-ups.
+    - Drop greetings, filler and anything already superseded.
+    - Write plain third-person notes ("The user…"), oldest to newest, at most 150 words. No preamble.
+    """)
+
+
+def render_summary_request(summary: Optional[str], turns: Sequence[Dict]) -> str:
+    """User message asking for the updated conversation summary"""
+    lines = [f"SUMMARY SO FAR\n{summary or '(none)'}", "", "NEW TURNS"]
+    for turn in turns:
+        lines.append(f"- User: {' '.join((turn.get('message') or '').split())}")
+        lines.append(f"  Coach: {' '.join((turn.get('response') or '').split())}")
+    return "\n".join(lines)
+
+
+# Every prompt version that can be served; add new ones here and roll them out with COACH_PROMPT_VERSIONS
+PROMPT_TEMPLATES: Dict[str, PromptTemplate] = {
+    COACH_V1.version: COACH_V1,
+}
+
+
+def parse_version_weights(spec: str) -> Dict[str, int]:
+    """Parse "v1=90,v2=10" into {"v1": 90, "v2": 10}; a bare "v1" means 100%"""
+    weights = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        version, _, weight = part.partition("=")
+        version = version.strip()
+        if version not in PROMPT_TEMPLATES:
+            raise ValueError(f"Unknown prompt version {version!r}; known: {sorted(PROMPT_TEMPLATES)}")
+        weights[version] = int(weight) if weight else 100
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError(f"Prompt version weights {spec!r} select nothing")
+    return weights
+
+
+def choose_template(user_id: str, weights: Dict[str, int]) -> PromptTemplate:
+    """Deterministic A/B assignment: a user always lands on the same version for a given split"""
+    bucket = int(hashlib.sha256(user_id.encode()).hexdigest()[:8], 16) % sum(weights.values())
+    versions: List[str] = sorted(weights)
+    for version in versions:
+        if bucket < weights[version]:
+            return PROMPT_TEMPLATES[version]
+        bucket -= weights[version]
+    return PROMPT_TEMPLATES[versions[-1]]
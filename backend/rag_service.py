@@ -1,77 +1,370 @@
 import openai
-from supabase import Client
-from typing import List, Dict, Optional
+from supabase import AsyncClient
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple
+from dataclasses import dataclass
 import numpy as np
+import asyncio
+import hashlib
+import itertools
 import logging
 import json
+import time
+
+from cache import TTLCache
+from chunking import estimate_tokens, iter_chunks
+from embedding_cache import EmbeddingCache
+from keyword_index import BM25Index, reciprocal_rank_fusion, tokenize
+from metrics import span
+from vector_store import FETCH_PAGE_SIZE, PgVectorBackend, VectorSearchBackend
 
 logger = logging.getLogger(__name__)
 
+# OpenAI text-embedding-3-small: 1536 dimensions, matches user_embeddings.embedding
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Request packing limits (the API allows 2048 inputs / 300k tokens per request
+# and 8191 tokens per input); kept below the hard caps to leave headroom.
+EMBEDDING_BATCH_SIZE = 512
+EMBEDDING_BATCH_TOKENS = 200_000
+EMBEDDING_MAX_INPUT_TOKENS = 8000
+EMBEDDING_CONCURRENCY = 4
+UPSERT_CHUNK_SIZE = 500
+
+# Hybrid search: each ranker contributes limit * SEARCH_DEPTH_FACTOR results to
+# reciprocal-rank fusion; RRF_K damps the weight of top ranks (60 is the usual choice)
+SEARCH_DEPTH_FACTOR = 3
+RRF_K = 60
+
+def content_hash(text: str, model: str = EMBEDDING_MODEL) -> str:
+    """Hash of the embedded text and model; changes whenever the vector would"""
+    return hashlib.sha256(f"{model}\n{text}".encode()).hexdigest()
+
+@dataclass
+class SyncReport:
+    """Outcome of an incremental embedding sync"""
+    skipped: int = 0
+    embedded: int = 0
+    refreshed: int = 0
+    deleted: int = 0
+    elapsed_ms: int = 0
+
 class RAGService:
-    def __init__(self, supabase_client: Client, openai_client):
+    def __init__(self, supabase_client: AsyncClient, openai_client: openai.AsyncOpenAI, embedding_cache: Optional[EmbeddingCache] = None, keyword_indexes: Optional[TTLCache] = None, vector_backend: Optional[VectorSearchBackend] = None):
         self.supabase = supabase_client
         self.openai = openai_client
+        # Shared by query-time and index-time embedding
+        self.embedding_cache = embedding_cache or EmbeddingCache()
+        # match_documents in Postgres unless an in-process store is configured
+        self.vector_backend = vector_backend or PgVectorBackend(supabase_client)
+        # Per-user BM25 indexes, synced from the rows each request already loads
+        self.keyword_indexes = keyword_indexes if keyword_indexes is not None else TTLCache(maxsize=1000, ttl=900)
+        self.search_stats = {'hybrid': 0, 'vector': 0, 'keyword': 0, 'fallback': 0}
         
     async def generate_user_embeddings(self, user_id: str) -> int:
-        """Generate embeddings for all user data"""
+        """Regenerate embeddings for all user data and upsert them into user_embeddings"""
+        report = await self.sync_user_embeddings(user_id, force=True)
+        return report.embedded
+    
+    async def sync_user_embeddings(
+        self,
+        user_id: str,
+        force: bool = False,
+        progress: Optional[Callable[[int, int], None]] = None
+    ) -> "SyncReport":
+        """Bring user_embeddings in line with the user's data.
+
+        Long journal entries are split into overlapping chunks, one row each.
+        Chunks whose content hash changed (or that are new) are embedded; chunks
+        whose text is unchanged but whose ``updated_at`` moved only get their
+        metadata rewritten; rows whose source item (or chunk) no longer exists
+        are deleted. ``force`` re-embeds everything. ``progress(done, total)``
+        is called as batches of chunks are embedded.
+        
+        Documents are generated lazily: a first pass only keeps the keys of
+        stale chunks, and a second pass streams those chunks into the embedding
+        batches, so the chunked corpus is never held in memory at once.
+        """
         try:
-            logger.info(f"Generating embeddings for user {user_id}")
-            
-            # Fetch all user data
-            goals = await self._fetch_user_goals(user_id)
-            tasks = await self._fetch_user_tasks(user_id)
-            journals = await self._fetch_user_journals(user_id)
-            profile = await self._fetch_user_profile(user_id)
-            
-            embeddings_created = 0
+            logger.info(f"Syncing embeddings for user {user_id}")
+            started = time.perf_counter()
             
-            # Generate embeddings for goals
-            for goal in goals:
-                await self._create_goal_embedding(user_id, goal)
-                embeddings_created += 1
-            
-            # Generate embeddings for tasks
-            for task in tasks:
-                await self._create_task_embedding(user_id, task)
-                embeddings_created += 1
-            
-            # Generate embeddings for journal entries
-            for journal in journals:
-                await self._create_journal_embedding(user_id, journal)
-                embeddings_created += 1
+            with span("sync_plan"):
+                sources, existing = await asyncio.gather(
+                    self._fetch_sources(user_id),
+                    self._fetch_embedding_index(user_id)
+                )
+                
+                stale_keys, touched, seen = set(), [], 0
+                for doc in self._iter_documents(user_id, sources):
+                    seen += 1
+                    key = self._document_key(doc)
+                    row = existing.pop(key, None)
+                    if force or row is None or row.get('content_hash') != doc['content_hash']:
+                        stale_keys.add(key)
+                    elif doc.get('source_updated_at') != row.get('source_updated_at'):
+                        # Same text, so the vector is still valid; only metadata moved on
+                        touched.append(doc)
+                # Whatever is left in the index has no source chunk anymore
+                orphan_ids = [row['id'] for row in existing.values()]
             
-            # Generate embedding for profile/vision
-            if profile and profile.get('vision'):
-                await self._create_profile_embedding(user_id, profile)
-                embeddings_created += 1
+            with span("sync_embed"):
+                stale = (doc for doc in self._iter_documents(user_id, sources) if self._document_key(doc) in stale_keys)
+                embedded = await self._embed_and_store(stale, len(stale_keys), progress)
+            with span("sync_write"):
+                await self._upsert_embeddings(touched)
+                await self._delete_embeddings(orphan_ids)
+                if stale_keys or touched or orphan_ids:
+                    await self.vector_backend.invalidate(user_id)
             
-            logger.info(f"Generated {embeddings_created} embeddings for user {user_id}")
-            return embeddings_created
+            report = SyncReport(
+                skipped=seen - len(stale_keys) - len(touched),
+                embedded=embedded,
+                refreshed=len(touched),
+                deleted=len(orphan_ids),
+                elapsed_ms=round((time.perf_counter() - started) * 1000)
+            )
+            logger.info(f"Embedding sync for user {user_id}: {report}")
+            return report
             
         except Exception as e:
             logger.error(f"Error generating embeddings for user {user_id}: {e}")
             raise
     
-    async def search_relevant_data(self, user_id: str, query: str, limit: int = 10) -> List[Dict]:
-        """Search for relevant data using vector similarity"""
+    async def _fetch_sources(self, user_id: str) -> Dict:
+        """Fetch all of the user's embeddable rows concurrently.
+
+        Failures propagate: an empty list standing in for a failed fetch would
+        make the sync delete every embedding of that type as an orphan.
+        """
+        goals, tasks, journals, profile = await asyncio.gather(
+            self._select_user_rows('goals', user_id),
+            self._select_user_rows('tasks', user_id),
+            self._select_user_rows('journal_entries', user_id),
+            self._fetch_user_profile(user_id)
+        )
+        return {'goals': goals, 'tasks': tasks, 'journals': journals, 'profile': profile}
+    
+    def _iter_documents(self, user_id: str, sources: Dict) -> Iterator[Dict]:
+        """Yield the user_embeddings rows (minus vectors) for the user's data, one chunk at a time"""
+        documents = itertools.chain(
+            (self._goal_document(user_id, goal) for goal in sources['goals']),
+            (self._task_document(user_id, task) for task in sources['tasks']),
+            (chunk for journal in sources['journals'] for chunk in self._journal_documents(user_id, journal)),
+            [self._profile_document(user_id, sources['profile'])] if sources['profile'] else []
+        )
+        for doc in documents:
+            if not doc['content_text'].strip():
+                continue
+            # Inputs above the per-input limit are rejected by the API, so clip them
+            doc['content_text'] = doc['content_text'][:EMBEDDING_MAX_INPUT_TOKENS * 4]
+            doc['content_hash'] = content_hash(doc['content_text'])
+            doc.setdefault('chunk_index', 0)
+            yield doc
+    
+    @staticmethod
+    def _document_key(doc: Dict) -> tuple:
+        return (doc['content_type'], str(doc['content_id']), doc.get('chunk_index') or 0)
+    
+    async def _fetch_embedding_index(self, user_id: str) -> Dict[tuple, Dict]:
+        """Fetch the stored hashes (not the vectors) of the user's embeddings"""
+        rows = await self._select_all(
+            'user_embeddings', user_id, 'id, content_type, content_id, chunk_index, content_hash, source_updated_at'
+        )
+        return {self._document_key(row): row for row in rows}
+    
+    async def _delete_embeddings(self, ids: List[str]):
+        """Delete embedding rows by id"""
+        for start in range(0, len(ids), UPSERT_CHUNK_SIZE):
+            await self.supabase.table('user_embeddings').delete() \
+                .in_('id', ids[start:start + UPSERT_CHUNK_SIZE]).execute()
+    
+    async def _embed_and_store(
+        self,
+        documents: Iterable[Dict],
+        total: int,
+        progress: Optional[Callable[[int, int], None]] = None
+    ) -> int:
+        """Embed documents in batches and bulk upsert each batch.
+
+        EMBEDDING_CONCURRENCY workers pull batches from one shared generator,
+        so at most that many batches exist at a time however large the input.
+        """
+        batches = self._batch_documents(documents)
+        done = 0
+        if progress:
+            progress(0, total)
+        
+        async def worker():
+            nonlocal done
+            # next() runs synchronously, so workers never advance the generator concurrently
+            for batch in batches:
+                embeddings = await self._generate_batch_embeddings([doc['content_text'] for doc in batch])
+                rows = [{**doc, 'embedding': embedding} for doc, embedding in zip(batch, embeddings)]
+                await self._upsert_embeddings(rows)
+                done += len(rows)
+                if progress:
+                    progress(done, total)
+        
+        await asyncio.gather(*(worker() for _ in range(EMBEDDING_CONCURRENCY)))
+        return done
+    
+    def _batch_documents(self, documents: Iterable[Dict]):
+        """Pack documents into embedding requests within the item and token limits"""
+        batch, batch_tokens = [], 0
+        for doc in documents:
+            tokens = estimate_tokens(doc['content_text'])
+            if batch and (len(batch) >= EMBEDDING_BATCH_SIZE or batch_tokens + tokens > EMBEDDING_BATCH_TOKENS):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(doc)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+    
+    async def _generate_batch_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Generate OpenAI embeddings for many texts in one request, skipping cached texts"""
+        embeddings = await self.embedding_cache.get_many(EMBEDDING_MODEL, texts)
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if missing:
+            response = await self.openai.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=missing
+            )
+            vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            await self.embedding_cache.put_many(EMBEDDING_MODEL, missing, vectors)
+            generated = dict(zip(missing, vectors))
+            embeddings = [generated[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+        return embeddings
+    
+    async def _upsert_embeddings(self, rows: List[Dict]):
+        """Bulk upsert embedding rows keyed on (user_id, content_type, content_id, chunk_index)"""
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            await self.supabase.table('user_embeddings').upsert(
+                rows[start:start + UPSERT_CHUNK_SIZE],
+                on_conflict='user_id,content_type,content_id,chunk_index'
+            ).execute()
+    
+    async def search_relevant_data(
+        self,
+        user_id: str,
+        query: str,
+        limit: int = 10,
+        match_threshold: float = 0.3,
+        candidates: Optional[List[Dict]] = None
+    ) -> List[Dict]:
+        """Hybrid search: pgvector similarity fused with BM25 keyword ranking.
+
+        ``candidates`` are the user's already-loaded items (with ``type`` and ``id``);
+        they keep the user's keyword index in sync and results are mapped back onto
+        them so the prompt keeps their richer formatting. Without candidates the
+        last indexed items are reused, and the rows are only fetched when the
+        user has no index yet. Either ranking alone is enough, so search keeps
+        working while embeddings are missing.
+        """
+        started = time.perf_counter()
+        depth = limit * SEARCH_DEPTH_FACTOR
+        if candidates is None and self.keyword_indexes.get(user_id) is None:
+            candidates = await self._fetch_candidates(user_id)
+        index, items = self._keyword_index(user_id, candidates)
+        keyword_ranking = [key for key, _ in index.search(query, depth)]
+        
         try:
             # Generate embedding for the query
             query_embedding = await self._generate_text_embedding(query)
             
-            # Search for similar embeddings
-            # Note: This will be implemented with pgvector in the next step
-            # For now, return basic search results
-            return await self._basic_search(user_id, query, limit)
-            
+            # Search for similar embeddings, ranked by similarity
+            matches = await self._match_documents(user_id, query_embedding, match_threshold, depth)
         except Exception as e:
             logger.error(f"Error searching relevant data: {e}")
-            return []
+            matches = []
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if not matches and not keyword_ranking:
+            # Nothing above the similarity threshold and no shared terms
+            self.search_stats['fallback'] += 1
+            logger.info(f"🔎 No vector or keyword matches for user {user_id} after {elapsed_ms:.0f}ms")
+            return list(items.values())[:limit]
+        
+        mode = 'hybrid' if matches and keyword_ranking else 'vector' if matches else 'keyword'
+        self.search_stats[mode] += 1
+        logger.info(
+            f"🔎 {mode.title()} search for user {user_id}: {len(matches)} vector / "
+            f"{len(keyword_ranking)} keyword matches in {elapsed_ms:.0f}ms"
+        )
+        matched = {}
+        for match in matches:
+            # Matches come best first, so each item keeps its best matching chunk
+            matched.setdefault((match['content_type'], str(match.get('content_id'))), match)
+        fused = reciprocal_rank_fusion([list(matched), keyword_ranking], k=RRF_K, limit=limit)
+        
+        results = []
+        for key, score in fused:
+            if key in items:
+                item = dict(items[key])
+                if key[0] == 'journal':
+                    # Quote the part of a long entry that matched, not its opening lines
+                    item['content'] = matched[key]['content_text'] if key in matched else self._best_chunk(item.get('content') or '', query)
+            else:
+                item = self._match_item(matched[key])
+            item['relevance_score'] = round(score, 6)
+            results.append(item)
+        return results
+    
+    def _keyword_index(self, user_id: str, candidates: Optional[List[Dict]]) -> Tuple[BM25Index, Dict]:
+        """The user's BM25 index and indexed items, brought in line with candidates if given"""
+        index, items = self.keyword_indexes.get(user_id) or (BM25Index(), {})
+        if candidates is not None:
+            # A fresh dict, so a search still ranking against the previous items is unaffected
+            items = {(item['type'], str(item.get('id'))): item for item in candidates}
+            # Only new or edited rows are re-tokenized
+            index.sync({key: f"{item['type']} {item.get('content', '')}" for key, item in items.items()})
+        self.keyword_indexes.set(user_id, (index, items))
+        return index, items
+    
+    async def _match_documents(self, user_id: str, query_embedding: List[float], match_threshold: float, match_count: int) -> List[Dict]:
+        """Rank the user's stored embeddings against the query (pgvector or the local store)"""
+        return await self.vector_backend.search(user_id, query_embedding, match_threshold, match_count)
+    
+    @staticmethod
+    def _best_chunk(text: str, query: str) -> str:
+        """The chunk of text sharing the most terms with query (the whole text if it is one chunk)"""
+        terms = set(tokenize(query))
+        best, best_overlap = text, -1
+        for _, chunk in iter_chunks(text):
+            overlap = len(terms.intersection(tokenize(chunk)))
+            if overlap > best_overlap:
+                best, best_overlap = chunk, overlap
+        return best
+    
+    def _match_item(self, match: Dict) -> Dict:
+        """relevant_data item for a match_documents row with no loaded candidate (e.g. the profile)"""
+        return {
+            'type': match['content_type'],
+            'id': match.get('content_id'),
+            'content': match['content_text'],
+            'metadata': match.get('metadata') or {}
+        }
+    
+    async def _select_user_rows(self, table: str, user_id: str) -> List[Dict]:
+        """All of the user's rows in table; raises on failure"""
+        return await self._select_all(table, user_id, '*')
+    
+    async def _select_all(self, table: str, user_id: str, columns: str) -> List[Dict]:
+        """Every row of the user's in table. PostgREST caps a response at FETCH_PAGE_SIZE rows, so this
+        pages in id order; a truncated read would re-embed the missing chunks and delete live rows as orphans"""
+        rows = []
+        while True:
+            result = await self.supabase.table(table).select(columns).eq('user_id', user_id) \
+                .order('id').range(len(rows), len(rows) + FETCH_PAGE_SIZE - 1).execute()
+            page = result.data or []
+            rows.extend(page)
+            if len(page) < FETCH_PAGE_SIZE:
+                return rows
     
     async def _fetch_user_goals(self, user_id: str) -> List[Dict]:
         """Fetch user goals from Supabase"""
         try:
-            result = self.supabase.table('goals').select('*').eq('user_id', user_id).execute()
-            return result.data if result.data else []
+            return await self._select_user_rows('goals', user_id)
         except Exception as e:
             logger.error(f"Error fetching goals: {e}")
             return []
@@ -79,8 +372,7 @@ class RAGService:
     async def _fetch_user_tasks(self, user_id: str) -> List[Dict]:
         """Fetch user tasks from Supabase"""
         try:
-            result = self.supabase.table('tasks').select('*').eq('user_id', user_id).execute()
-            return result.data if result.data else []
+            return await self._select_user_rows('tasks', user_id)
         except Exception as e:
             logger.error(f"Error fetching tasks: {e}")
             return []
@@ -88,179 +380,108 @@ class RAGService:
     async def _fetch_user_journals(self, user_id: str) -> List[Dict]:
         """Fetch user journal entries from Supabase"""
         try:
-            result = self.supabase.table('journal_entries').select('*').eq('user_id', user_id).execute()
-            return result.data if result.data else []
+            return await self._select_user_rows('journal_entries', user_id)
         except Exception as e:
             logger.error(f"Error fetching journal entries: {e}")
             return []
     
     async def _fetch_user_profile(self, user_id: str) -> Optional[Dict]:
-        """Fetch user profile from Supabase"""
-        try:
-            result = self.supabase.table('profiles').select('*').eq('id', user_id).single().execute()
-            return result.data if result.data else None
-        except Exception as e:
-            logger.error(f"Error fetching profile: {e}")
-            return None
+        """Fetch user profile from Supabase (None if there is none); raises on failure"""
+        result = await self.supabase.table('profiles').select('*').eq('id', user_id).limit(1).execute()
+        rows = result.data or []
+        return rows[0] if rows else None
     
     async def _generate_text_embedding(self, text: str) -> List[float]:
         """Generate OpenAI embedding for text"""
         try:
-            response = self.openai.Embedding.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-            return response['data'][0]['embedding']
+            return (await self._generate_batch_embeddings([text]))[0]
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             raise
     
-    async def _create_goal_embedding(self, user_id: str, goal: Dict):
-        """Create embedding for a goal"""
-        try:
-            text = f"{goal.get('title', '')} {goal.get('description', '')}"
-            embedding = await self._generate_text_embedding(text)
-            
-            # Store in user_embeddings table (will be created in Supabase)
-            embedding_data = {
-                'user_id': user_id,
-                'content_type': 'goal',
-                'content_id': goal['id'],
-                'content_text': text,
-                'embedding': embedding,
-                'metadata': {
-                    'status': goal.get('status'),
-                    'timeframe': goal.get('timeframe'),
-                    'priority': goal.get('priority')
-                }
+    def _goal_document(self, user_id: str, goal: Dict) -> Dict:
+        """Build the user_embeddings row (minus the vector) for a goal"""
+        text = " ".join(filter(None, [goal.get('title'), goal.get('description')]))
+        return {
+            'user_id': user_id,
+            'content_type': 'goal',
+            'content_id': goal['id'],
+            'content_text': text,
+            'source_updated_at': goal.get('updated_at'),
+            'metadata': {
+                'due_date': goal.get('due_date'),
+                'progress': goal.get('progress'),
+                'timeframe': goal.get('timeframe')
             }
-            
-            # For now, just log - we'll implement storage when we set up pgvector
-            logger.info(f"Would store goal embedding: {goal.get('title', 'Unknown Goal')}")
-            
-        except Exception as e:
-            logger.error(f"Error creating goal embedding: {e}")
+        }
     
-    async def _create_task_embedding(self, user_id: str, task: Dict):
-        """Create embedding for a task"""
-        try:
-            text = f"{task.get('title', '')} {task.get('description', '')}"
-            embedding = await self._generate_text_embedding(text)
-            
-            embedding_data = {
-                'user_id': user_id,
-                'content_type': 'task',
-                'content_id': task['id'],
-                'content_text': text,
-                'embedding': embedding,
-                'metadata': {
-                    'status': task.get('status'),
-                    'priority': task.get('priority'),
-                    'goal_id': task.get('goal_id')
-                }
+    def _task_document(self, user_id: str, task: Dict) -> Dict:
+        """Build the user_embeddings row (minus the vector) for a task"""
+        text = " ".join(filter(None, [task.get('title'), task.get('description')]))
+        return {
+            'user_id': user_id,
+            'content_type': 'task',
+            'content_id': task['id'],
+            'content_text': text,
+            'source_updated_at': task.get('updated_at'),
+            'metadata': {
+                'status': task.get('status'),
+                'is_high_impact': task.get('is_high_impact'),
+                'goal_id': task.get('goal_id')
             }
-            
-            logger.info(f"Would store task embedding: {task.get('title', 'Unknown Task')}")
-            
-        except Exception as e:
-            logger.error(f"Error creating task embedding: {e}")
+        }
     
-    async def _create_journal_embedding(self, user_id: str, journal: Dict):
-        """Create embedding for a journal entry"""
-        try:
-            text = journal.get('content', '')
-            if not text:
-                return
-                
-            embedding = await self._generate_text_embedding(text)
-            
-            embedding_data = {
+    def _journal_documents(self, user_id: str, journal: Dict) -> Iterator[Dict]:
+        """Yield the user_embeddings rows (minus vectors) for a journal entry, one per chunk"""
+        for chunk_index, text in iter_chunks(journal.get('content') or ''):
+            yield {
                 'user_id': user_id,
                 'content_type': 'journal',
                 'content_id': journal['id'],
+                'chunk_index': chunk_index,
                 'content_text': text,
-                'embedding': embedding,
+                'source_updated_at': journal.get('updated_at'),
                 'metadata': {
                     'mood': journal.get('mood'),
                     'created_at': journal.get('created_at')
                 }
             }
-            
-            logger.info(f"Would store journal embedding: {text[:50]}...")
-            
-        except Exception as e:
-            logger.error(f"Error creating journal embedding: {e}")
     
-    async def _create_profile_embedding(self, user_id: str, profile: Dict):
-        """Create embedding for user profile/vision"""
-        try:
-            text = profile.get('vision', '')
-            if not text:
-                return
-                
-            embedding = await self._generate_text_embedding(text)
-            
-            embedding_data = {
-                'user_id': user_id,
-                'content_type': 'profile',
-                'content_id': profile['id'],
-                'content_text': text,
-                'embedding': embedding,
-                'metadata': {
-                    'level': profile.get('level'),
-                    'xp': profile.get('xp')
-                }
+    def _profile_document(self, user_id: str, profile: Dict) -> Dict:
+        """Build the user_embeddings row (minus the vector) for the user's vision"""
+        return {
+            'user_id': user_id,
+            'content_type': 'profile',
+            'content_id': profile['id'],
+            'content_text': profile.get('vision') or '',
+            'source_updated_at': profile.get('updated_at'),
+            'metadata': {
+                'level': profile.get('level'),
+                'xp': profile.get('xp')
             }
-            
-            logger.info(f"Would store profile embedding: {text[:50]}...")
-            
-        except Exception as e:
-            logger.error(f"Error creating profile embedding: {e}")
+        }
     
-    async def _basic_search(self, user_id: str, query: str, limit: int) -> List[Dict]:
-        """Basic search without vector similarity (fallback)"""
-        try:
-            # Simple text-based search for now
-            goals = await self._fetch_user_goals(user_id)
-            tasks = await self._fetch_user_tasks(user_id)
-            journals = await self._fetch_user_journals(user_id)
-            
-            relevant_data = []
-            
-            # Search in goals
-            for goal in goals:
-                if query.lower() in goal.get('title', '').lower() or query.lower() in goal.get('description', '').lower():
-                    relevant_data.append({
-                        'type': 'goal',
-                        'content': f"{goal['title']}: {goal['description']}",
-                        'metadata': {'status': goal.get('status'), 'timeframe': goal.get('timeframe')},
-                        'relevance_score': 0.8
-                    })
-            
-            # Search in tasks
-            for task in tasks:
-                if query.lower() in task.get('title', '').lower() or query.lower() in task.get('description', '').lower():
-                    relevant_data.append({
-                        'type': 'task',
-                        'content': f"{task['title']}: {task['description']}",
-                        'metadata': {'status': task.get('status'), 'priority': task.get('priority')},
-                        'relevance_score': 0.7
-                    })
-            
-            # Search in journal entries
-            for journal in journals:
-                if query.lower() in journal.get('content', '').lower():
-                    relevant_data.append({
-                        'type': 'journal',
-                        'content': journal.get('content', ''),
-                        'metadata': {'mood': journal.get('mood'), 'created_at': journal.get('created_at')},
-                        'relevance_score': 0.6
-                    })
-            
-            # Sort by relevance and limit results
-            relevant_data.sort(key=lambda x: x['relevance_score'], reverse=True)
-            return relevant_data[:limit]
-            
-        except Exception as e:
-            logger.error(f"Error in basic search: {e}")
-            return []
+    async def _fetch_candidates(self, user_id: str) -> List[Dict]:
+        """Load the user's goals, tasks and journals as search candidates"""
+        goals, tasks, journals = await asyncio.gather(
+            self._fetch_user_goals(user_id),
+            self._fetch_user_tasks(user_id),
+            self._fetch_user_journals(user_id)
+        )
+        documents = (
+            [self._goal_document(user_id, goal) for goal in goals]
+            + [self._task_document(user_id, task) for task in tasks]
+        )
+        candidates = [{
+            'type': doc['content_type'],
+            'id': doc['content_id'],
+            'content': doc['content_text'],
+            'metadata': doc['metadata']
+        } for doc in documents]
+        # Journals stay whole here; search picks the matching chunk per query
+        return candidates + [{
+            'type': 'journal',
+            'id': journal['id'],
+            'content': journal.get('content') or '',
+            'metadata': {'mood': journal.get('mood'), 'created_at': journal.get('created_at')}
+        } for journal in journals]
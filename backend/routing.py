@@ -0,0 +1,193 @@
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from chunking import estimate_tokens
+
+FAST = "fast"
+STRONG = "strong"
+
+# Questions about the user's own data that a small model answers as well as a large one
+_LOOKUP = re.compile(
+    r"\b(what (are|is|was|were) my|list|show me|how many|when (is|are)|which (goals?|tasks?)|remind me|due|progress on)\b",
+    re.IGNORECASE,
+)
+# Requests for advice, planning or emotional support, where answer quality matters most
+_COACHING = re.compile(
+    r"\b(why|should i|help me|how (can|do|should) i|plan|advice|feel(ing)?|stress(ed)?|anxious|motivat\w*|"
+    r"struggl\w*|stuck|overwhelm\w*|procrastinat\w*|putting off|reflect\w*|prioriti[sz]e)\b",
+    re.IGNORECASE,
+)
+# Hedging that suggests the small model did not manage the question
+_LOW_CONFIDENCE = re.compile(
+    r"\b(i'?m not sure|i am not sure|i don'?t (know|have enough)|i do not (know|have enough)|i can(no|')t (tell|determine))\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass(frozen=True)
+class RouteFeatures:
+    message_tokens: int
+    history_turns: int
+    retrieved_tokens: int
+    lookup: bool
+    coaching: bool
+
+
+@dataclass(frozen=True)
+class RouteDecision:
+    tier: str
+    model: str
+    reason: str
+    features: RouteFeatures
+
+
+def route_features(message: str, history: Optional[List[Dict]], relevant_data: List[Dict]) -> RouteFeatures:
+    return RouteFeatures(
+        message_tokens=estimate_tokens(message),
+        history_turns=len(history or []),
+        retrieved_tokens=sum(estimate_tokens(str(item.get('content', ''))) for item in relevant_data),
+        lookup=bool(_LOOKUP.search(message)),
+        coaching=bool(_COACHING.search(message)),
+    )
+
+
+@dataclass(frozen=True)
+class RoutingThresholds:
+    """Largest query still sent to the fast tier"""
+    message_tokens: int = 60
+    history_turns: int = 4
+    retrieved_tokens: int = 600
+    short_message_tokens: int = 12   # short, history-free messages go fast even without a lookup keyword
+
+
+def classify(features: RouteFeatures, thresholds: RoutingThresholds = RoutingThresholds()) -> Tuple[str, str]:
+    """(tier, reason) from cheap local heuristics; anything not clearly simple goes to the strong tier"""
+    if features.coaching:
+        return STRONG, "coaching_intent"
+    if features.message_tokens > thresholds.message_tokens:
+        return STRONG, "long_message"
+    if features.history_turns > thresholds.history_turns:
+        return STRONG, "long_history"
+    if features.retrieved_tokens > thresholds.retrieved_tokens:
+        return STRONG, "large_context"
+    if features.lookup:
+        return FAST, "lookup_intent"
+    if features.message_tokens <= thresholds.short_message_tokens and not features.history_turns:
+        return FAST, "short_message"
+    return STRONG, "default"
+
+
+class ModelHealth:
+    """Smoothed response latency and error rate of one model"""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.degraded_until = 0.0
+        self.degradations = 0
+
+    def record(self, seconds: float, ok: bool):
+        if ok:
+            self.latency = seconds if self.latency is None else (1 - self.alpha) * self.latency + self.alpha * seconds
+        self.error_rate = (1 - self.alpha) * self.error_rate + self.alpha * (0.0 if ok else 1.0)
+
+
+class ModelRouter:
+    """Sends each coach query to a model tier and moves traffic off a tier whose model is spiking.
+
+    ``tiers`` maps "fast" and "strong" to model names; without a fast tier
+    everything goes to the strong model. A model whose smoothed latency
+    (time to first token when streaming) passes ``latency_limit`` seconds, or
+    whose smoothed error rate passes ``error_limit``, is avoided for
+    ``cooldown`` seconds while the other tier is healthy. Answers from the
+    fast tier that fail, are cut off or hedge are escalated to the strong one.
+    """
+
+    def __init__(
+        self,
+        tiers: Dict[str, str],
+        thresholds: RoutingThresholds = RoutingThresholds(),
+        latency_limit: float = 10.0,
+        error_limit: float = 0.5,
+        cooldown: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if STRONG not in tiers:
+            raise ValueError("A strong tier model is required")
+        self.tiers = dict(tiers)
+        self.thresholds = thresholds
+        self.latency_limit = latency_limit
+        self.error_limit = error_limit
+        self.cooldown = cooldown
+        self.clock = clock
+        self.health: Dict[str, ModelHealth] = {model: ModelHealth() for model in self.tiers.values()}
+        self.decisions: Counter = Counter()     # (tier, model, reason) -> count
+        self.escalations: Counter = Counter()   # reason -> count
+
+    def degraded(self, model: str) -> bool:
+        return self.health[model].degraded_until > self.clock()
+
+    def route(self, message: str, history: Optional[List[Dict]], relevant_data: List[Dict]) -> RouteDecision:
+        features = route_features(message, history, relevant_data)
+        tier, reason = classify(features, self.thresholds) if FAST in self.tiers else (STRONG, "single_tier")
+        other = STRONG if tier == FAST else FAST
+        if other in self.tiers and self.degraded(self.tiers[tier]) and not self.degraded(self.tiers[other]):
+            tier, reason = other, f"{tier}_degraded"
+        decision = RouteDecision(tier, self.tiers[tier], reason, features)
+        self.decisions[(decision.tier, decision.model, decision.reason)] += 1
+        return decision
+
+    def escalation(self, decision: RouteDecision, content: Optional[str] = None,
+                   finish_reason: Optional[str] = None, failed: bool = False) -> Optional[RouteDecision]:
+        """The strong-tier retry for a fast-tier answer that failed or looks weak, else None"""
+        if decision.tier != FAST:
+            return None
+        if failed:
+            reason = "error"
+        elif not (content or "").strip():
+            reason = "empty"
+        elif finish_reason == "length":
+            reason = "truncated"
+        elif _LOW_CONFIDENCE.search(content):
+            reason = "low_confidence"
+        else:
+            return None
+        self.escalations[reason] += 1
+        escalated = RouteDecision(STRONG, self.tiers[STRONG], f"escalated_{reason}", decision.features)
+        self.decisions[(escalated.tier, escalated.model, escalated.reason)] += 1
+        return escalated
+
+    def record(self, model: str, seconds: float, ok: bool):
+        """Feed one call's outcome into the model's health; trips the cooldown on a spike"""
+        health = self.health.get(model)
+        if health is None:
+            return
+        health.record(seconds, ok)
+        if self.degraded(model):
+            return
+        if (health.latency or 0.0) > self.latency_limit or health.error_rate > self.error_limit:
+            health.degraded_until = self.clock() + self.cooldown
+            health.degradations += 1
+            # Start over after the cooldown instead of staying tripped on stale numbers
+            health.latency = None
+            health.error_rate = 0.0
+
+    def stats(self) -> Dict:
+        return {
+            'tiers': dict(self.tiers),
+            'models': {
+                model: {
+                    'latency': health.latency,
+                    'error_rate': round(health.error_rate, 4),
+                    'degraded': self.degraded(model),
+                    'degradations': health.degradations,
+                }
+                for model, health in self.health.items()
+            },
+            'decisions': {f"{tier}/{model}/{reason}": count for (tier, model, reason), count in sorted(self.decisions.items())},
+            'escalations': dict(self.escalations),
+        }
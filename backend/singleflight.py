@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+
+from cache import TTLCache
+
+T = TypeVar("T")
+
+_MISSING = object()
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution, optionally followed by a short result cache.
+
+    The first caller for a key (the leader) starts the work as its own task;
+    callers arriving while it runs await the same task instead of repeating
+    it. A caller that goes away does not cancel the shared work unless it was
+    the last one waiting. Failures are never cached, and ``cacheable`` can
+    keep unwanted results (e.g. fallback answers) out of the cache too.
+    """
+
+    def __init__(self, cache: Optional[TTLCache] = None, cacheable: Callable[[Any], bool] = lambda result: True):
+        self.cache = cache
+        self.cacheable = cacheable
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.counters = {"leader": 0, "shared": 0, "cached": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Return fn()'s result for key, sharing an in-flight call or a cached result if there is one"""
+        if self.cache is not None:
+            result = self.cache.get(key, _MISSING)
+            if result is not _MISSING:
+                self.counters["cached"] += 1
+                return result
+
+        task = self._flights.get(key)
+        if task is None:
+            self.counters["leader"] += 1
+            task = asyncio.ensure_future(self._run(key, fn))
+            self._flights[key] = task
+            self._waiters[key] = 0
+        else:
+            self.counters["shared"] += 1
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if key in self._waiters and self._waiters[key] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            if self._flights.get(key) is task:
+                self._waiters[key] -= 1
+
+    async def _run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        try:
+            result = await fn()
+            if self.cache is not None and self.cacheable(result):
+                self.cache.set(key, result)
+            return result
+        finally:
+            self._flights.pop(key, None)
+            self._waiters.pop(key, None)
+
+    def forget(self, key: Hashable):
+        """Drop a cached result so the next call for key runs again"""
+        if self.cache is not None:
+            self.cache.pop(key)
+
+    def stats(self) -> Dict:
+        return {**self.counters, "in_flight": len(self._flights)}
+
+
+def message_key(user_id: str, message: str, history: Optional[List[Dict]] = None) -> tuple:
+    """Key for a user's message in a conversation: case/whitespace-normalized text plus a digest of the history"""
+    normalized = " ".join(message.split()).casefold()
+    digest = hashlib.sha256(json.dumps(history or [], sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return (user_id, normalized, digest)
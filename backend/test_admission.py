@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Tests for coach admission control: global slots, the wait queue and per-user limits
+"""
+
+import asyncio
+
+from admission import AdmissionController, AdmissionRejected, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_at_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=0.5, burst=2, clock=clock)
+    assert bucket.take() == 0 and bucket.take() == 0
+    assert bucket.take() == 2.0
+    clock.now += 1
+    assert bucket.take() == 1.0
+    clock.now += 1
+    assert bucket.take() == 0
+
+
+def test_queue_hands_slots_over_in_order():
+    async def run():
+        admission = AdmissionController(max_concurrent=1, max_queue=2, user_rate=0, user_concurrency=0)
+        first = await admission.acquire("a")
+        order = []
+
+        async def queued(user_id):
+            async with await admission.acquire(user_id):
+                order.append(user_id)
+
+        waiters = [asyncio.create_task(queued(user_id)) for user_id in ("b", "c")]
+        await asyncio.sleep(0)
+        assert (admission.active, admission.waiting) == (1, 2)
+
+        try:
+            await admission.acquire("d")
+        except AdmissionRejected as e:
+            assert e.reason == "queue_full" and e.retry_after_header == "3"
+        else:
+            raise AssertionError("expected queue_full")
+
+        first.release()
+        first.release()  # a second release must not free another slot
+        await asyncio.gather(*waiters)
+        assert order == ["b", "c"]
+        assert admission.stats() == {
+            'active': 0, 'limit': 1, 'waiting': 0, 'max_queue': 2, 'admitted': 3, 'queued': 2,
+            'rejected': {'user_rate': 0, 'user_concurrency': 0, 'queue_full': 1, 'queue_timeout': 0},
+        }
+
+    asyncio.run(run())
+
+
+def test_waiters_time_out_and_cancelled_waiters_leave_the_queue():
+    async def run():
+        admission = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.01, user_rate=0, user_concurrency=0)
+        held = await admission.acquire("a")
+        try:
+            await admission.acquire("b")
+        except AdmissionRejected as e:
+            assert e.reason == "queue_timeout"
+        else:
+            raise AssertionError("expected queue_timeout")
+
+        admission.queue_timeout = 10
+        cancelled = asyncio.create_task(admission.acquire("c"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert admission.waiting == 0
+
+        held.release()
+        assert admission.active == 0
+        (await admission.acquire("d")).release()
+
+    asyncio.run(run())
+
+
+def test_per_user_rate_and_concurrency_limits():
+    async def run():
+        clock = FakeClock()
+        admission = AdmissionController(max_concurrent=8, user_rate=1.0, user_burst=2, user_concurrency=1, clock=clock)
+        permit = await admission.acquire("a")
+        try:
+            await admission.acquire("a")
+        except AdmissionRejected as e:
+            assert e.reason == "user_concurrency"
+        else:
+            raise AssertionError("expected user_concurrency")
+
+        permit.release()
+        (await admission.acquire("a")).release()
+        try:
+            await admission.acquire("a")
+        except AdmissionRejected as e:
+            assert e.reason == "user_rate" and e.retry_after == 1.0
+        else:
+            raise AssertionError("expected user_rate")
+
+        # Other users are unaffected, and the bucket refills
+        (await admission.acquire("b")).release()
+        clock.now += 1
+        (await admission.acquire("a")).release()
+        assert admission.rejections['user_rate'] == 1 and admission.rejections['user_concurrency'] == 1
+
+    asyncio.run(run())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Tests for the Supabase/OpenAI stand-ins used by the load benchmark (bench/fakes.py)
+"""
+
+import json
+
+from fastapi.testclient import TestClient
+
+from bench.fakes import FakeOpenAI, FakeSupabase, FakeUpstreamConfig, synthetic_users
+
+FAST = FakeUpstreamConfig(latency_ms=0, jitter_ms=0, token_interval_ms=0, completion_tokens=3, dimensions=8)
+
+
+def test_synthetic_users_are_seeded():
+    users = synthetic_users(3, goals=2, tasks=4, journals=5, seed=1)
+    assert users == synthetic_users(3, goals=2, tasks=4, journals=5, seed=1)
+    assert users != synthetic_users(3, goals=2, tasks=4, journals=5, seed=2)
+    user = next(iter(users.values()))
+    assert (len(user['goals']), len(user['tasks']), len(user['journal_entries'])) == (2, 4, 5)
+
+
+def test_supabase_serves_snapshot_tables_and_embedding_writes():
+    users = synthetic_users(2, goals=2, tasks=3, journals=4)
+    user_id = next(iter(users))
+    supabase = FakeSupabase(users, FAST)
+    client = TestClient(supabase.app)
+
+    snapshot = client.post("/rest/v1/rpc/get_user_snapshot", json={'user_id_param': user_id, 'include_profile': False}).json()
+    assert snapshot['profile'] is None and len(snapshot['journals']) == 4
+    assert len(client.get(f"/rest/v1/tasks?select=*&user_id=eq.{user_id}").json()) == 3
+    profile = client.get(f"/rest/v1/profiles?select=*&id=eq.{user_id}", headers={'accept': 'application/vnd.pgrst.object+json'}).json()
+    assert profile['id'] == user_id
+
+    row = {'user_id': user_id, 'content_type': 'goal', 'content_id': 'g1', 'chunk_index': 0, 'content_hash': 'h', 'embedding': [0.1]}
+    assert client.post("/rest/v1/user_embeddings?on_conflict=user_id", json=[row, {**row, 'content_hash': 'h2'}]).status_code == 201
+    stored = client.get(f"/rest/v1/user_embeddings?user_id=eq.{user_id}").json()
+    assert len(stored) == 1 and stored[0]['content_hash'] == 'h2' and 'embedding' not in stored[0]
+    client.delete(f"/rest/v1/user_embeddings?id=in.({stored[0]['id']})")
+    assert client.get(f"/rest/v1/user_embeddings?user_id=eq.{user_id}").json() == []
+    assert supabase.calls['select/user_embeddings'] == 2
+
+
+def test_openai_streams_and_injects_errors():
+    openai = FakeOpenAI(FAST)
+    client = TestClient(openai.app)
+
+    vectors = client.post("/v1/embeddings", json={'model': 'm', 'input': ['a', 'b', 'a']}).json()['data']
+    assert len(vectors[0]['embedding']) == 8 and vectors[0]['embedding'] == vectors[2]['embedding']
+
+    lines = client.post("/v1/chat/completions", json={'model': 'm', 'messages': [], 'stream': True}).text.split("\n\n")
+    chunks = [json.loads(line[6:]) for line in lines if line.startswith("data: {")]
+    assert len(chunks) == 4 and chunks[-1]['usage']['completion_tokens'] == 3
+    assert lines[-2] == "data: [DONE]"
+
+    failing = FakeOpenAI(FakeUpstreamConfig(latency_ms=0, jitter_ms=0, error_rate=1.0, error_status=429))
+    assert TestClient(failing.app).post("/v1/chat/completions", json={'messages': []}).status_code == 429
+    assert failing.errors['chat/completions'] == 1
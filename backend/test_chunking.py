@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Tests for sentence-aware, overlapping chunking of long journal entries
+"""
+
+import types
+
+from chunking import CHUNK_MAX_TOKENS, estimate_tokens, iter_chunks, iter_sentences
+
+LONG_ENTRY = " ".join(f"Today I thought about topic {i} for a while and wrote it down." for i in range(40))
+
+
+def test_sentences_split_on_punctuation_and_line_breaks():
+    text = 'Slept badly. Ran 5k anyway! Was it worth it? "Yes."\nTomorrow: rest'
+    assert list(iter_sentences(text)) == ["Slept badly.", "Ran 5k anyway!", "Was it worth it?", '"Yes."', "Tomorrow: rest"]
+
+
+def test_short_text_is_one_unchanged_chunk():
+    assert list(iter_chunks("  Short entry.  ")) == [(0, "  Short entry.  ")]
+    assert list(iter_chunks("   ")) == []
+
+
+def test_long_text_chunks_are_bounded_whole_sentences_with_overlap():
+    chunks = list(iter_chunks(LONG_ENTRY, max_tokens=60, overlap_tokens=20))
+
+    assert [index for index, _ in chunks] == list(range(len(chunks)))
+    assert all(estimate_tokens(text) <= 60 for _, text in chunks)
+    assert all(text.endswith("down.") for _, text in chunks)
+    for (_, previous), (_, current) in zip(chunks, chunks[1:]):
+        # Each chunk starts with the last sentence of the one before
+        last_sentence = list(iter_sentences(previous))[-1]
+        assert current.startswith(last_sentence)
+    # Nothing is lost
+    covered = set(s for _, text in chunks for s in iter_sentences(text))
+    assert covered == set(iter_sentences(LONG_ENTRY))
+
+
+def test_chunk_ids_are_stable_when_text_is_appended():
+    before = list(iter_chunks(LONG_ENTRY, max_tokens=60, overlap_tokens=20))
+    after = list(iter_chunks(LONG_ENTRY + " A new final thought.", max_tokens=60, overlap_tokens=20))
+    assert after[:len(before) - 1] == before[:-1]
+
+
+def test_run_on_sentences_are_word_wrapped():
+    chunks = list(iter_chunks("word " * 400, max_tokens=50, overlap_tokens=0))
+    assert len(chunks) > 1
+    assert all(estimate_tokens(text) <= 50 for _, text in chunks)
+
+
+def test_text_without_spaces_is_sliced_to_the_chunk_size():
+    text = "日本語の文章" * 300
+    chunks = list(iter_chunks(text, overlap_tokens=0))
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= CHUNK_MAX_TOKENS for _, chunk in chunks)
+    assert "".join(chunk for _, chunk in chunks) == text
+
+
+def test_chunks_are_generated_lazily():
+    chunks = iter_chunks(LONG_ENTRY, max_tokens=60)
+    assert isinstance(chunks, types.GeneratorType)
+    assert next(chunks)[0] == 0
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+End-to-end tests of the coach endpoints: the app served on a thread against the Supabase/OpenAI fakes
+"""
+
+import asyncio
+import importlib
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from bench.fakes import FakeOpenAI, FakeSupabase, FakeUpstreamConfig, ServerThread, synthetic_users
+
+FAST = FakeUpstreamConfig(latency_ms=0, jitter_ms=0, token_interval_ms=0, completion_tokens=4, dimensions=8)
+USERS = synthetic_users(4, goals=2, tasks=3, journals=3)
+
+
+@pytest.fixture(scope="module")
+def backend():
+    """(main module, fake OpenAI, app URL); requests authenticate with "Bearer <user id>" """
+    supabase, openai = FakeSupabase(USERS, FAST), FakeOpenAI(FAST)
+    workdir = tempfile.TemporaryDirectory()
+    with ServerThread(supabase.app) as supabase_server, ServerThread(openai.app) as openai_server:
+        os.environ.update({
+            "OPENAI_API_KEY": "test",
+            "OPENAI_BASE_URL": f"{openai_server.url}/v1",
+            "SUPABASE_URL": supabase_server.url,
+            "SUPABASE_ANON_KEY": "test",
+            "SUPABASE_SERVICE_ROLE_KEY": "test",
+            "EMBEDDING_CACHE_PATH": "",
+            "EMBEDDING_JOBS_DB": os.path.join(workdir.name, "jobs.sqlite3"),
+        })
+        main = importlib.import_module("main")
+
+        def user_from_token(credentials: main.HTTPAuthorizationCredentials = main.Depends(main.security)) -> str:
+            return credentials.credentials
+
+        main.app.dependency_overrides[main.get_current_user] = user_from_token
+        with ServerThread(main.app) as app_server:
+            yield main, openai, app_server.url
+        main.app.dependency_overrides.clear()
+    workdir.cleanup()
+
+
+def headers(user_id):
+    return {"Authorization": f"Bearer {user_id}"}
+
+
+def test_repeated_message_in_a_server_side_conversation_is_answered_and_stored_again(backend, monkeypatch):
+    main, openai, url = backend
+    user_id = list(USERS)[0]
+    stored = []
+
+    async def load_conversation(user_id, conversation_id):
+        return main.Conversation(conversation_id, user_id) if conversation_id else None
+
+    async def remember_turn(conversation, message, response, asked_at):
+        stored.append((conversation.id, message))
+        return True
+
+    monkeypatch.setattr(main, "load_conversation", load_conversation)
+    monkeypatch.setattr(main, "remember_turn", remember_turn)
+    openai.reset_counts()
+
+    for _ in range(2):
+        response = httpx.post(f"{url}/api/coach/query", json={"message": "ok", "conversation_id": "c1"}, headers=headers(user_id))
+        assert response.status_code == 200 and response.json()["conversation_id"] == "c1" and response.json()["stored"]
+    assert stored == [("c1", "ok"), ("c1", "ok")]
+    assert sum(openai.model_calls.values()) == 2
+
+    # Client-side history keeps the short retry cache
+    for _ in range(2):
+        response = httpx.post(f"{url}/api/coach/query", json={"message": "ok"}, headers=headers(user_id))
+        assert response.status_code == 200 and response.json()["stored"] is False
+    assert sum(openai.model_calls.values()) == 3
+
+
+def test_a_turn_the_backend_failed_to_store_is_reported_so_the_app_keeps_it(backend, monkeypatch):
+    main, _, url = backend
+    user_id = list(USERS)[1]
+
+    async def load_conversation(user_id, conversation_id):
+        return main.Conversation(conversation_id, user_id)
+
+    async def append_turn(*args):
+        raise ConnectionError("insert failed")
+
+    monkeypatch.setattr(main, "load_conversation", load_conversation)
+    monkeypatch.setattr(main.conversation_store, "append_turn", append_turn)
+
+    response = httpx.post(f"{url}/api/coach/query", json={"message": "still there?", "conversation_id": "c2"}, headers=headers(user_id))
+    assert response.status_code == 200 and response.json()["stored"] is False
+
+    with httpx.stream("POST", f"{url}/api/coach/stream", json={"message": "and now?", "conversation_id": "c2"}, headers=headers(user_id)) as stream:
+        frames = stream.read().decode().strip().split("\n\n")
+    assert frames[-1].startswith("event: done") and json.loads(frames[-1].split("data: ", 1)[1])["stored"] is False
+
+
+def test_answers_and_token_metrics_carry_the_prompt_version(backend):
+    main, _, url = backend
+    response = httpx.post(f"{url}/api/coach/query", json={"message": "Which prompt was this?"}, headers=headers(list(USERS)[2]))
+    version = response.json()["prompt_version"]
+    assert response.status_code == 200 and version in main.PROMPT_TEMPLATES
+
+    metrics = httpx.get(f"{url}/metrics").text
+    assert any(line.startswith("digm_openai_tokens_total{") and f'prompt_version="{version}"' in line for line in metrics.splitlines())
+
+
+def stream_events(url, user_id, message="How am I doing?"):
+    """(event, data) pairs of one /coach/stream call"""
+    events = []
+    with httpx.stream("POST", f"{url}/api/coach/stream", json={"message": message}, headers=headers(user_id)) as response:
+        assert response.status_code == 200
+        for frame in response.read().decode().split("\n\n"):
+            if frame:
+                event, data = frame.split("\n", 1)
+                events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_stream_sends_tokens_then_one_done_event(backend):
+    main, _, url = backend
+    events = stream_events(url, list(USERS)[1])
+
+    assert [event for event, _ in events] == ["token"] * FAST.completion_tokens + ["done"]
+    done = events[-1][1]
+    assert done["model"] and done["prompt_tokens"] and done["conversation_id"] is None and done["stored"] is False
+    assert main.coach_admission.stats()["active"] == 0
+
+
+def test_a_failure_while_building_the_prompt_is_sent_as_an_error_event(backend, monkeypatch):
+    main, _, url = backend
+
+    def build_coach_messages(*args):
+        raise ValueError("bad template")
+
+    monkeypatch.setattr(main, "build_coach_messages", build_coach_messages)
+    assert stream_events(url, list(USERS)[2]) == [("error", {"detail": main.COACH_FALLBACK_RESPONSE})]
+    assert main.coach_admission.stats()["active"] == 0
+
+
+def test_a_client_disconnect_mid_stream_releases_the_admission_slot(backend, monkeypatch):
+    main, openai, url = backend
+    monkeypatch.setattr(openai, "config", FakeUpstreamConfig(latency_ms=0, jitter_ms=0, token_interval_ms=20, completion_tokens=500, dimensions=8))
+    started = time.monotonic()
+
+    with httpx.stream("POST", f"{url}/api/coach/stream", json={"message": "Tell me a lot"}, headers=headers(list(USERS)[3])) as response:
+        assert next(response.iter_lines()).startswith("event: token")
+        assert main.coach_admission.stats()["active"] == 1
+
+    while main.coach_admission.stats()["active"] and time.monotonic() - started < 5:
+        time.sleep(0.02)
+    assert main.coach_admission.stats()["active"] == 0
+    assert time.monotonic() - started < 5   # well before the 10s completion would have finished
+
+
+def test_stream_is_rejected_with_retry_after_when_the_user_is_over_their_rate(backend, monkeypatch):
+    main, _, url = backend
+    monkeypatch.setattr(main, "coach_admission", main.AdmissionController(user_rate=1 / 60, user_burst=1))
+    user_id = list(USERS)[0]
+
+    assert [event for event, _ in stream_events(url, user_id)][-1] == "done"
+    response = httpx.post(f"{url}/api/coach/stream", json={"message": "again"}, headers=headers(user_id))
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert main.coach_admission.stats()["rejected"]["user_rate"] == 1
+
+
+def test_per_user_data_is_read_with_the_service_role_client(backend, monkeypatch):
+    main, _, _ = backend
+    assert main.rag_service.supabase is main.supabase_admin
+    assert main.vector_backend.supabase is main.supabase_admin
+    assert main.conversation_store.supabase is main.supabase_admin
+    calls = []
+
+    class ServiceRoleClient:
+        def rpc(self, name, params):
+            calls.append((name, params['user_id_param']))
+            return self
+
+        async def execute(self):
+            return SimpleNamespace(data={'goals': [], 'state': {'version': 1}})
+
+    monkeypatch.setattr(main, "supabase_admin", ServiceRoleClient())
+    snapshot = asyncio.run(main.get_user_snapshot("user-1"))
+    assert calls == [('get_user_snapshot', "user-1")] and snapshot['state'] == {'version': 1}
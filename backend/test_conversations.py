@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Tests for server-side coach conversations and rolling summaries against an in-memory Supabase fake
+"""
+
+import asyncio
+import itertools
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from conversations import ConversationNotFound, ConversationStore, group_turns
+
+START = datetime(2025, 6, 1, 9, 0, tzinfo=timezone.utc)
+
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.filters = []
+        self.ordering = []
+        self.limit_to = None
+        self.offset = 0
+        self.rows = None
+        self.changes = None
+
+    def select(self, *args):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) > value)
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.limit_to = count
+        return self
+
+    def range(self, start, end):
+        self.offset, self.limit_to = start, end - start + 1
+        return self
+
+    def insert(self, rows):
+        self.rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def update(self, changes):
+        self.changes = changes
+        return self
+
+    async def execute(self):
+        table = self.db.tables.setdefault(self.table, [])
+        if self.rows is not None:
+            inserted = [{'id': f"{self.table}-{next(self.db.ids)}", **row} for row in self.rows]
+            table.extend(inserted)
+            return SimpleNamespace(data=inserted)
+        matched = [row for row in table if all(f(row) for f in self.filters)]
+        if self.changes is not None:
+            for row in matched:
+                row.update(self.changes)
+            return SimpleNamespace(data=matched)
+        for column, desc in reversed(self.ordering):
+            matched.sort(key=lambda row: row[column], reverse=desc)
+        end = None if self.limit_to is None else self.offset + self.limit_to
+        return SimpleNamespace(data=[dict(row) for row in matched[self.offset:end]])
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.tables = {}
+        self.ids = itertools.count(1)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+def make_store(**kwargs):
+    calls = []
+
+    async def summarize(summary, turns):
+        calls.append((summary, [t['message'] for t in turns]))
+        return f"{summary or ''}[{','.join(t['message'] for t in turns)}]"
+
+    return ConversationStore(FakeSupabase(), summarize, **kwargs), calls
+
+
+async def add_turns(store, conversation, count, offset=0):
+    for i in range(offset, offset + count):
+        asked = START + timedelta(minutes=i)
+        await store.append_turn(conversation, f"q{i}", f"a{i}", asked, asked + timedelta(seconds=5))
+
+
+def test_group_turns_pairs_user_rows_with_the_replies_after_them():
+    rows = [
+        {'role': 'assistant', 'content': "welcome"},
+        {'role': 'user', 'content': "hi"},
+        {'role': 'assistant', 'content': "hello"},
+        {'role': 'assistant', 'content': "how can I help?"},
+        {'role': 'user', 'content': "bye"},
+    ]
+    assert [[r['content'] for r in g] for g in group_turns(rows)] == [
+        ["welcome"], ["hi", "hello", "how can I help?"], ["bye"],
+    ]
+
+
+def test_conversations_are_scoped_to_their_owner():
+    async def run():
+        store, _ = make_store()
+        conversation_id = await store.create("user-1")
+        conversation = await store.load("user-1", conversation_id)
+        await add_turns(store, conversation, 2)
+
+        reloaded = await store.load("user-1", conversation_id)
+        assert [(t['message'], t['response']) for t in reloaded.turns] == [("q0", "a0"), ("q1", "a1")]
+        assert reloaded.summary is None
+
+        for user_id, cid in [("user-2", conversation_id), ("user-1", "missing")]:
+            try:
+                await store.load(user_id, cid)
+            except ConversationNotFound:
+                pass
+            else:
+                raise AssertionError(f"expected {cid} to be hidden from {user_id}")
+
+    asyncio.run(run())
+
+
+def test_compaction_folds_older_turns_into_the_summary():
+    async def run():
+        store, calls = make_store(keep_turns=2, max_turns=4)
+        conversation_id = await store.create("user-1")
+        conversation = await store.load("user-1", conversation_id)
+        await add_turns(store, conversation, 4)
+        assert not store.needs_compaction(conversation)
+        assert await store.compact(conversation_id) == 0
+
+        await add_turns(store, conversation, 2, offset=4)
+        assert store.needs_compaction(conversation)
+        assert await store.compact(conversation_id) == 4
+        assert calls == [(None, ["q0", "q1", "q2", "q3"])]
+
+        reloaded = await store.load("user-1", conversation_id)
+        assert reloaded.summary == "[q0,q1,q2,q3]"
+        assert [t['message'] for t in reloaded.turns] == ["q4", "q5"]
+
+        # The next fold builds on the previous summary and only sees newer turns
+        await add_turns(store, reloaded, 3, offset=6)
+        assert await store.compact(conversation_id) == 3
+        assert calls[-1] == ("[q0,q1,q2,q3]", ["q4", "q5", "q6"])
+        thread = store.supabase.tables['coach_threads'][0]
+        assert thread['summarized_turns'] == 7
+        assert [t['message'] for t in (await store.load("user-1", conversation_id)).turns] == ["q7", "q8"]
+        assert store.stats()['compacted'] == 2
+
+    asyncio.run(run())
+
+
+def test_a_backlog_beyond_the_load_window_is_folded_in_batches_not_dropped():
+    async def run():
+        store, calls = make_store(keep_turns=2, max_turns=4, page_size=7)
+        conversation_id = await store.create("user-1")
+        conversation = await store.load("user-1", conversation_id)
+        await add_turns(store, conversation, 30)   # the summarizer never ran
+
+        loaded = await store.load("user-1", conversation_id)
+        assert len(loaded.turns) == 8 and store.stats()['backlogged'] == 1
+
+        assert await store.compact(conversation_id) == 28
+        folded = [message for _, messages in calls for message in messages]
+        assert folded == [f"q{i}" for i in range(28)]
+        assert [len(messages) for _, messages in calls] == [4] * 7
+        assert calls[1][0] == "[q0,q1,q2,q3]"   # each batch builds on the previous summary
+        assert [t['message'] for t in (await store.load("user-1", conversation_id)).turns] == ["q28", "q29"]
+        assert store.supabase.tables['coach_threads'][0]['summarized_turns'] == 28
+
+    asyncio.run(run())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Tests for the two-tier embedding cache
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from embedding_cache import EmbeddingCache, cache_key
+from rag_service import RAGService
+
+MODEL = "text-embedding-3-small"
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_key_ignores_whitespace_but_not_model():
+    assert cache_key(MODEL, "  Read   10 pages\n") == cache_key(MODEL, "Read 10 pages")
+    assert cache_key(MODEL, "Read 10 pages") != cache_key("other-model", "Read 10 pages")
+
+
+def test_memory_tier_is_lru_bounded():
+    cache = EmbeddingCache(memory_size=2)
+    run(cache.put_many(MODEL, ["a", "b"], [[1.0], [2.0]]))
+    run(cache.get_many(MODEL, ["a"]))  # "a" becomes most recently used
+    run(cache.put_many(MODEL, ["c"], [[3.0]]))
+
+    assert run(cache.get_many(MODEL, ["a", "b", "c"])) == [[1.0], None, [3.0]]
+    stats = cache.stats()
+    assert stats['memory_evictions'] == 1
+    assert (stats['memory_hits'], stats['misses']) == (3, 1)
+
+
+def test_disk_tier_survives_restart_and_promotes(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path=path)
+    run(cache.put_many(MODEL, ["journal"], [[0.5, 0.25]]))
+    cache.close()
+
+    reopened = EmbeddingCache(path=path)
+    assert run(reopened.get_many(MODEL, ["journal", "unknown"])) == [[0.5, 0.25], None]
+    assert reopened.stats()['disk_hits'] == 1
+    # Promoted to memory, so the second lookup does not touch disk
+    run(reopened.get_many(MODEL, ["journal"]))
+    assert reopened.stats()['memory_hits'] == 1
+    reopened.close()
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "cache.sqlite3"), memory_size=1, disk_size=3)
+    for i in range(5):
+        run(cache.put_many(MODEL, [f"text {i}"], [[float(i)]]))
+
+    assert cache.stats()['disk_evictions'] == 2
+    found = run(cache.get_many(MODEL, [f"text {i}" for i in range(5)]))
+    assert found[:2] == [None, None]
+    assert found[2:] == [[2.0], [3.0], [4.0]]
+    cache.close()
+
+
+def test_disk_row_count_is_tracked_across_replacements_and_restarts(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path=path, disk_size=2)
+    run(cache.put_many(MODEL, ["a", "b"], [[1.0], [2.0]]))
+    run(cache.put_many(MODEL, ["a"], [[1.5]]))   # replacements are not new rows
+    run(cache.put_many(MODEL, ["b"], [[2.5]]))
+    assert cache.stats()['disk_evictions'] == 0
+    cache.close()
+
+    reopened = EmbeddingCache(path=path, memory_size=1, disk_size=2)
+    run(reopened.put_many(MODEL, ["c"], [[3.0]]))
+    assert reopened.stats()['disk_evictions'] == 1
+    assert run(reopened.get_many(MODEL, ["a", "b", "c"])) == [None, [2.5], [3.0]]
+    reopened.close()
+
+
+def test_memory_hits_do_not_wait_for_disk_io(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "cache.sqlite3"))
+    run(cache.put_many(MODEL, ["warm"], [[1.0]]))
+
+    async def scenario():
+        cache._disk_lock.acquire()   # a slow SQLite call in progress
+        try:
+            write = asyncio.create_task(cache.put_many(MODEL, ["cold"], [[2.0]]))
+            await asyncio.sleep(0.05)
+            assert await asyncio.wait_for(cache.get_many(MODEL, ["warm", "cold"]), timeout=1) == [[1.0], [2.0]]
+            assert not write.done()
+        finally:
+            cache._disk_lock.release()
+        await write
+
+    run(scenario())
+    cache.close()
+
+
+def test_rag_service_only_embeds_cache_misses():
+    requests = []
+
+    async def create(model, input):
+        requests.append(list(input))
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[float(len(t))]) for i, t in enumerate(input)])
+
+    service = RAGService(None, SimpleNamespace(embeddings=SimpleNamespace(create=create)))
+
+    assert run(service._generate_text_embedding("what are my goals?")) == pytest.approx([18.0])
+    vectors = run(service._generate_batch_embeddings(["what are my goals?", "drink water", "drink water"]))
+
+    assert vectors == [[18.0], [11.0], [11.0]]
+    assert requests == [["what are my goals?"], ["drink water"]]
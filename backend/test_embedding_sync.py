@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Tests for batched, incremental embedding sync against in-memory Supabase/OpenAI fakes
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import rag_service
+from rag_service import RAGService, content_hash
+
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.ordering = None
+        self.page = None
+
+    def select(self, *args):
+        return self
+
+    def eq(self, *args):
+        return self
+
+    def single(self):
+        return self
+
+    def limit(self, count):
+        return self
+
+    def order(self, column):
+        self.ordering = column
+        return self
+
+    def range(self, start, end):
+        self.page = (start, end)
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self.db.upserts.append((rows, on_conflict))
+        return self
+
+    def delete(self):
+        return self
+
+    def in_(self, column, values):
+        self.db.deleted.extend(values)
+        return self
+
+    async def execute(self):
+        if self.table in self.db.failing:
+            raise ConnectionError(f"{self.table} unavailable")
+        rows = self.db.tables.get(self.table)
+        if self.page is not None:
+            self.db.pages.append((self.table, self.page))
+            start, end = self.page
+            rows = sorted(rows, key=lambda row: row[self.ordering])[start:end + 1]
+        return SimpleNamespace(data=rows)
+
+
+class FakeSupabase:
+    def __init__(self, tables):
+        self.tables = tables
+        self.upserts = []
+        self.deleted = []
+        self.failing = set()
+        self.pages = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.requests = []
+
+    async def create(self, model, input):
+        self.requests.append(list(input))
+        # The API does not promise response order; the service must sort by index
+        data = [SimpleNamespace(index=i, embedding=[float(i)]) for i in range(len(input))]
+        return SimpleNamespace(data=list(reversed(data)))
+
+
+def make_service(tables):
+    embeddings = FakeEmbeddings()
+    service = RAGService(FakeSupabase(tables), SimpleNamespace(embeddings=embeddings))
+    return service, embeddings
+
+
+def source_tables(**overrides):
+    tables = {'goals': [], 'tasks': [], 'journal_entries': [], 'profiles': None, 'user_embeddings': []}
+    tables.update(overrides)
+    return tables
+
+
+def test_full_generation_batches_requests_and_upserts():
+    journals = [{'id': f'j{i}', 'content': f'entry {i}'} for i in range(1200)]
+    service, embeddings = make_service(source_tables(journal_entries=journals))
+
+    assert asyncio.run(service.generate_user_embeddings('user-1')) == 1200
+    assert len(embeddings.requests) == 3
+    upserted = [row for rows, _ in service.supabase.upserts for row in rows]
+    assert len(upserted) == 1200
+    assert all(conflict == 'user_id,content_type,content_id,chunk_index' for _, conflict in service.supabase.upserts)
+    by_id = {row['content_id']: row for row in upserted}
+    assert by_id['j0']['content_hash'] == content_hash('entry 0')
+    # Vectors line up with their inputs even though the response order was shuffled
+    assert by_id['j1']['embedding'] == [1.0]
+
+
+def test_sync_skips_unchanged_and_deletes_orphans():
+    tables = source_tables(
+        goals=[
+            {'id': 'g1', 'title': 'unchanged', 'updated_at': 't1'},
+            {'id': 'g2', 'title': 'edited title'},
+            {'id': 'g3', 'title': 'progress moved', 'updated_at': 't2'},
+            {'id': 'g4', 'title': 'brand new'},
+        ],
+        user_embeddings=[
+            {'id': 'e1', 'content_type': 'goal', 'content_id': 'g1', 'content_hash': content_hash('unchanged'), 'source_updated_at': 't1'},
+            {'id': 'e2', 'content_type': 'goal', 'content_id': 'g2', 'content_hash': content_hash('old title')},
+            {'id': 'e3', 'content_type': 'goal', 'content_id': 'g3', 'content_hash': content_hash('progress moved'), 'source_updated_at': 't1'},
+            {'id': 'e4', 'content_type': 'task', 'content_id': 'deleted-task', 'content_hash': 'abc'},
+        ],
+    )
+    service, embeddings = make_service(tables)
+
+    report = asyncio.run(service.sync_user_embeddings('user-1'))
+
+    assert (report.skipped, report.embedded, report.refreshed, report.deleted) == (1, 2, 1, 1)
+    assert embeddings.requests == [['edited title', 'brand new']]
+    assert service.supabase.deleted == ['e4']
+    refreshed = service.supabase.upserts[-1][0]
+    assert [row['content_id'] for row in refreshed] == ['g3']
+    assert 'embedding' not in refreshed[0]
+
+
+def test_failed_source_fetch_aborts_the_sync_without_deleting_anything():
+    tables = source_tables(
+        goals=[{'id': 'g1', 'title': 'run a marathon'}],
+        user_embeddings=[
+            {'id': 'e1', 'content_type': 'goal', 'content_id': 'g1', 'content_hash': content_hash('run a marathon')},
+            {'id': 'e2', 'content_type': 'task', 'content_id': 't1', 'content_hash': content_hash('long run')},
+        ],
+    )
+    service, embeddings = make_service(tables)
+    service.supabase.failing.add('tasks')
+
+    try:
+        asyncio.run(service.sync_user_embeddings('user-1'))
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("expected the failed fetch to fail the sync so the job is retried")
+    assert service.supabase.deleted == [] and service.supabase.upserts == []
+    assert embeddings.requests == []
+
+    # The lenient fetch used for search candidates still degrades to an empty list
+    assert asyncio.run(service._fetch_user_tasks('user-1')) == []
+
+
+def test_index_and_sources_are_read_in_full_across_pages(monkeypatch):
+    monkeypatch.setattr(rag_service, 'FETCH_PAGE_SIZE', 2)
+    goals = [{'id': f'g{i}', 'title': f'goal {i}'} for i in range(5)]
+    stored = [
+        {'id': f'e{i}', 'content_type': 'goal', 'content_id': f'g{i}', 'content_hash': content_hash(f'goal {i}')}
+        for i in range(5)
+    ]
+    service, embeddings = make_service(source_tables(goals=goals[::-1], user_embeddings=stored[::-1]))
+
+    report = asyncio.run(service.sync_user_embeddings('user-1'))
+
+    assert (report.skipped, report.embedded, report.deleted) == (5, 0, 0)
+    assert embeddings.requests == [] and service.supabase.deleted == []
+    assert [page for table, page in service.supabase.pages if table == 'goals'] == [(0, 1), (2, 3), (4, 5)]
+
+def test_hash_changes_with_model():
+    assert content_hash('same text') != content_hash('same text', model='text-embedding-3-large')
+
+
+def test_long_journals_are_chunked_and_resynced_per_chunk():
+    sentences = [f"Sentence {i} about the long run and my knee." for i in range(60)]
+    journal = {'id': 'j1', 'content': " ".join(sentences), 'updated_at': 't1'}
+    service, embeddings = make_service(source_tables(journal_entries=[journal]))
+
+    report = asyncio.run(service.sync_user_embeddings('user-1'))
+    rows = [row for rows, _ in service.supabase.upserts for row in rows]
+    assert report.embedded == len(rows) > 1
+    assert [row['chunk_index'] for row in rows] == list(range(len(rows)))
+    assert all(row['content_id'] == 'j1' for row in rows)
+
+    # Appending a sentence only re-embeds the last chunk
+    service.supabase.tables['user_embeddings'] = [
+        {'id': f'e{row["chunk_index"]}', **{key: row[key] for key in ('content_type', 'content_id', 'chunk_index', 'content_hash', 'source_updated_at')}}
+        for row in rows
+    ]
+    journal['content'] += " One more thing."
+    embeddings.requests.clear()
+    report = asyncio.run(service.sync_user_embeddings('user-1'))
+    assert (report.embedded, report.deleted) == (1, 0)
+    assert embeddings.requests[0][0].endswith("One more thing.")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Tests for the background job queue
+"""
+
+import asyncio
+import time
+
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, Job, JobQueue, MemoryJobStore, SQLiteJobStore
+
+
+class Transient(Exception):
+    pass
+
+
+async def wait_for(queue, job_id, statuses=(SUCCEEDED, FAILED)):
+    for _ in range(200):
+        job = await queue.get(job_id)
+        if job.status in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_jobs_report_progress_and_result():
+    async def handler(job, progress):
+        progress(5, 10)
+        progress(10, 10)
+        return {'embedded': 10}
+
+    async def scenario():
+        queue = JobQueue(handler)
+        await queue.start()
+        job = await queue.enqueue('user-1')
+        job = await wait_for(queue, job.id)
+        await queue.stop()
+        return job
+
+    job = asyncio.run(scenario())
+    assert (job.status, job.done, job.total, job.result) == (SUCCEEDED, 10, 10, {'embedded': 10})
+
+
+def test_concurrent_jobs_for_same_user_are_deduplicated():
+    started = []
+
+    async def handler(job, progress):
+        started.append(job.user_id)
+        await asyncio.sleep(0.05)
+
+    async def scenario():
+        queue = JobQueue(handler, workers=4)
+        await queue.start()
+        first, second, other = await asyncio.gather(
+            queue.enqueue('user-1'), queue.enqueue('user-1'), queue.enqueue('user-2')
+        )
+        await wait_for(queue, first.id)
+        await wait_for(queue, other.id)
+        await queue.stop()
+        return first, second, other
+
+    first, second, other = asyncio.run(scenario())
+    assert first.id == second.id != other.id
+    assert sorted(started) == ['user-1', 'user-2']
+
+
+def test_transient_failures_retry_then_permanent_failures_stop():
+    attempts = {'flaky': 0, 'broken': 0}
+
+    async def handler(job, progress):
+        attempts[job.user_id] += 1
+        if job.user_id == 'flaky' and attempts['flaky'] < 3:
+            raise Transient("429")
+        if job.user_id == 'broken':
+            raise ValueError("bad data")
+        return {}
+
+    async def scenario():
+        queue = JobQueue(handler, max_attempts=3, backoff=0.001, retry_on=(Transient,))
+        await queue.start()
+        flaky = await queue.enqueue('flaky')
+        broken = await queue.enqueue('broken')
+        results = await wait_for(queue, flaky.id), await wait_for(queue, broken.id)
+        await queue.stop()
+        return results
+
+    flaky, broken = asyncio.run(scenario())
+    assert (flaky.status, flaky.attempts) == (SUCCEEDED, 3)
+    assert (broken.status, broken.attempts, broken.error) == (FAILED, 1, "bad data")
+
+
+def test_sqlite_store_resumes_interrupted_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+
+    async def never(job, progress):
+        await asyncio.sleep(10)
+
+    async def done(job, progress):
+        return {'resumed': True}
+
+    async def interrupted():
+        queue = JobQueue(never, store=SQLiteJobStore(path))
+        await queue.start()
+        job = await queue.enqueue('user-1', force=True)
+        await wait_for(queue, job.id, statuses=('running',))
+        await queue.stop()
+        return job.id
+
+    async def restarted(job_id):
+        queue = JobQueue(done, store=SQLiteJobStore(path))
+        await queue.start()
+        job = await wait_for(queue, job_id)
+        await queue.stop()
+        return job
+
+    job = asyncio.run(restarted(asyncio.run(interrupted())))
+    assert (job.status, job.params, job.result) == (SUCCEEDED, {'force': True}, {'resumed': True})
+
+
+def test_progress_is_written_at_most_every_interval_but_read_live(tmp_path):
+    writes = []
+
+    class CountingStore(SQLiteJobStore):
+        def save(self, job):
+            writes.append((job.status, job.done))
+            super().save(job)
+
+    async def handler(job, progress):
+        for done in range(1, 101):
+            progress(done, 100)
+        assert (await queue.get(job.id)).done == 100
+        return {}
+
+    async def scenario():
+        await queue.start()
+        job = await queue.enqueue('user-1')
+        job = await wait_for(queue, job.id)
+        await queue.stop()
+        return job
+
+    queue = JobQueue(handler, store=CountingStore(str(tmp_path / "jobs.sqlite3")), progress_interval=60)
+    job = asyncio.run(scenario())
+    assert (job.status, job.done) == (SUCCEEDED, 100)
+    assert [status for status, _ in writes] == [QUEUED, RUNNING, RUNNING, SUCCEEDED]   # enqueue, claim, attempt, result
+    assert queue.store.get(job.id).done == 100
+
+
+def test_a_restart_leaves_running_jobs_of_another_live_owner_alone(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    store = SQLiteJobStore(path)
+    mine, theirs, abandoned = (Job(user_id=f'user-{i}') for i in range(3))
+    for job, owner in ((mine, 'a'), (theirs, 'b'), (abandoned, 'c')):
+        store.save(job)
+        store.claim(job.id, owner)
+    # c went away mid-job an hour ago
+    store._db.execute("UPDATE jobs SET data = json_set(data, '$.updated_at', ?) WHERE id = ?", (time.time() - 3601, abandoned.id))
+    store._db.commit()
+    ran = []
+
+    async def handler(job, progress):
+        ran.append(job.user_id)
+        return {}
+
+    async def restarted():
+        queue = JobQueue(handler, store=SQLiteJobStore(path), owner='a')
+        await queue.start()
+        results = await wait_for(queue, mine.id), await wait_for(queue, abandoned.id)
+        await queue.stop()
+        return results
+
+    finished = asyncio.run(restarted())
+    assert [job.status for job in finished] == [SUCCEEDED, SUCCEEDED] and all(job.owner == 'a' for job in finished)
+    assert sorted(ran) == ['user-0', 'user-2']
+    assert (store.get(theirs.id).status, store.get(theirs.id).owner) == (RUNNING, 'b')
+
+
+def test_only_one_store_sharing_the_file_can_claim_a_job(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    first, second = SQLiteJobStore(path), SQLiteJobStore(path)
+    job = Job(user_id='user-1')
+    first.save(job)
+
+    assert [store.claim(job.id) is not None for store in (first, second, first)] == [True, False, False]
+    assert second.get(job.id).status == RUNNING
+    assert first.claim("missing") is None
+
+
+def test_finished_jobs_are_pruned_after_the_retention(tmp_path):
+    for store in (MemoryJobStore(), SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))):
+        jobs = {status: Job(user_id=f'user-{status}', status=status) for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        for job in jobs.values():
+            store.save(job)
+        recent = Job(user_id='user-recent', status=SUCCEEDED)
+
+        assert store.prune(time.time() + 1) == 2
+        store.save(recent)
+        assert store.prune(recent.updated_at - 60) == 0
+        assert [store.get(job.id) is not None for job in jobs.values()] == [True, True, False, False]
+        assert store.get(recent.id) is not None
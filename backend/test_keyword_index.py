@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-user BM25 index and hybrid (vector + keyword) search
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from keyword_index import BM25Index, reciprocal_rank_fusion, tokenize
+from rag_service import RAGService
+
+
+def test_tokenize_drops_stopwords_and_folds_plurals():
+    assert tokenize("What are my running goals?") == ["run", "goal"]
+    assert tokenize("Goal: read 10 pages") == ["goal", "read", "10", "page"]
+
+
+def test_bm25_ranks_multi_word_queries():
+    index = BM25Index()
+    index.sync({
+        'marathon': "Train for the city marathon in May",
+        'reading': "Read 10 pages every day",
+        'shoes': "Buy new running shoes for marathon training",
+    })
+
+    ranked = [key for key, _ in index.search("how is my marathon training going?")]
+    # The shorter document matching the rarer term scores higher; "reading" shares no terms
+    assert ranked == ['marathon', 'shoes']
+    assert index.search("completely unrelated words") == []
+
+
+def test_index_updates_incrementally():
+    index = BM25Index()
+    assert index.sync({'a': "drink water", 'b': "sleep early"}) == (2, 0)
+    # Unchanged rows are not re-tokenized, edited ones are, removed ones disappear
+    assert index.sync({'a': "drink water", 'b': "sleep before eleven", 'c': "stretch"}) == (2, 0)
+    assert index.sync({'a': "drink water"}) == (0, 2)
+
+    assert len(index) == 1
+    assert index.search("sleep") == []
+    assert [key for key, _ in index.search("water")] == ['a']
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['b', 'd']], k=60)
+    assert [key for key, _ in fused][:1] == ['b']
+    assert {key for key, _ in fused} == {'a', 'b', 'c', 'd'}
+    assert len(reciprocal_rank_fusion([['a', 'b'], ['c']], limit=2)) == 2
+
+
+class FakeRPC:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def execute(self):
+        return SimpleNamespace(data=self.rows)
+
+
+def make_service(matches=None, embeddings_fail=False):
+    async def create(model, input):
+        if embeddings_fail:
+            raise RuntimeError("embeddings unavailable")
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[0.1]) for i in range(len(input))])
+
+    supabase = SimpleNamespace(rpc=lambda name, params: FakeRPC(matches or []))
+    return RAGService(supabase, SimpleNamespace(embeddings=SimpleNamespace(create=create)))
+
+
+CANDIDATES = [
+    {'type': 'goal', 'id': 'g1', 'content': "Run a marathon (Due: 2025-05-01, Progress: 40%)", 'metadata': {}},
+    {'type': 'task', 'id': 't1', 'content': "Book physio appointment (Status: todo, High Impact: False)", 'metadata': {}},
+    {'type': 'journal', 'id': 'j1', 'content': "Knee hurt after the long run today", 'metadata': {}},
+]
+
+
+def test_keyword_search_works_without_embeddings():
+    service = make_service(embeddings_fail=True)
+    results = asyncio.run(service.search_relevant_data('user-1', "my knee after running", limit=2, candidates=CANDIDATES))
+
+    assert [item['id'] for item in results] == ['j1', 'g1']
+    assert service.search_stats['keyword'] == 1
+
+
+def test_hybrid_search_fuses_vector_and_keyword_rankings():
+    matches = [
+        {'content_type': 'task', 'content_id': 't1', 'content_text': 'Book physio appointment', 'similarity': 0.8},
+        {'content_type': 'journal', 'content_id': 'j1', 'content_text': 'Knee hurt', 'similarity': 0.7},
+        {'content_type': 'profile', 'content_id': 'p1', 'content_text': 'Finish a marathon healthy', 'similarity': 0.5},
+    ]
+    service = make_service(matches=matches)
+    results = asyncio.run(service.search_relevant_data('user-1', "knee pain after running", limit=4, candidates=CANDIDATES))
+
+    # j1 is ranked by both signals, so it wins; journals quote the matched chunk
+    assert [item['id'] for item in results] == ['j1', 't1', 'g1', 'p1']
+    assert results[0]['content'] == 'Knee hurt'
+    assert results[1]['content'] == CANDIDATES[1]['content']
+    assert results[0]['relevance_score'] > results[1]['relevance_score']
+    # The profile match has no candidate, so it is built from the match row
+    assert results[3]['content'] == 'Finish a marathon healthy'
+    assert service.search_stats['hybrid'] == 1
+
+
+def test_index_is_reused_without_candidates():
+    service = make_service(embeddings_fail=True)
+    asyncio.run(service.search_relevant_data('user-1', "marathon", candidates=CANDIDATES))
+
+    async def unexpected(user_id):
+        raise AssertionError("rows fetched although the index is warm")
+
+    service._fetch_candidates = unexpected
+    results = asyncio.run(service.search_relevant_data('user-1', "physio"))
+    assert [item['id'] for item in results] == ['t1']
+
+
+@pytest.mark.parametrize("candidates", [CANDIDATES, []])
+def test_no_matches_falls_back_to_candidates(candidates):
+    service = make_service(embeddings_fail=True)
+    results = asyncio.run(service.search_relevant_data('user-1', "zebra", limit=2, candidates=candidates))
+
+    assert results == candidates[:2]
+    assert service.search_stats['fallback'] == 1
+
+
+def test_keyword_only_journal_match_quotes_best_chunk():
+    entry = " ".join(f"Day {i} was ordinary and quiet at work." for i in range(40))
+    entry += " My knee hurt badly after the long run."
+    candidates = [{'type': 'journal', 'id': 'j9', 'content': entry, 'metadata': {}}]
+    service = make_service(embeddings_fail=True)
+    results = asyncio.run(service.search_relevant_data('user-1', "knee pain", candidates=candidates))
+
+    assert results[0]['id'] == 'j9'
+    assert "My knee hurt" in results[0]['content']
+    assert not results[0]['content'].startswith("Day 0 ")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tests for the Prometheus registry, stage spans and the Server-Timing middleware
+"""
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from metrics import MetricsMiddleware, Registry, server_timing, span
+
+
+def test_counter_and_histogram_render_in_exposition_format():
+    registry = Registry()
+    tokens = registry.counter("tokens_total", "Tokens used", ("kind",))
+    latency = registry.histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1.0))
+    tokens.inc(120, kind="prompt")
+    tokens.inc(kind="prompt")
+    for value in (0.05, 0.5, 3.0):
+        latency.observe(value, stage='say "hi"')
+
+    assert registry.render().splitlines() == [
+        "# HELP tokens_total Tokens used",
+        "# TYPE tokens_total counter",
+        'tokens_total{kind="prompt"} 121',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{stage="say \\"hi\\"",le="0.1"} 1',
+        'latency_seconds_bucket{stage="say \\"hi\\"",le="1"} 2',
+        'latency_seconds_bucket{stage="say \\"hi\\"",le="+Inf"} 3',
+        'latency_seconds_sum{stage="say \\"hi\\""} 3.55',
+        'latency_seconds_count{stage="say \\"hi\\""} 3',
+    ]
+
+
+def test_collected_metrics_are_read_at_scrape_time():
+    registry = Registry()
+    stats = {'hits': 1}
+    registry.collected("cache_hits_total", "Hits", ("cache",), lambda: {("context",): stats['hits']}, type="counter")
+    stats['hits'] = 5
+    assert 'cache_hits_total{cache="context"} 5' in registry.render()
+
+
+def test_wrong_labels_and_duplicate_names_are_rejected():
+    registry = Registry()
+    counter = registry.counter("a_total", "A", ("kind",))
+    for call in (lambda: counter.inc(), lambda: counter.inc(kind="x", extra="y"), lambda: registry.counter("a_total", "A")):
+        try:
+            call()
+        except ValueError:
+            continue
+        raise AssertionError("expected ValueError")
+
+
+def test_spans_feed_histogram_and_server_timing_header():
+    registry = Registry()
+    stages = registry.histogram("stage_seconds", "Stages", ("stage",))
+    requests = registry.histogram("request_seconds", "Requests", ("method", "route", "status"))
+
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, histogram=requests)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        with span("context", stages):
+            pass
+        with span("retrieval", stages):
+            pass
+        return {"id": item_id}
+
+    response = TestClient(app).get("/items/42")
+
+    assert response.status_code == 200
+    header = response.headers["server-timing"]
+    assert [part.split(";")[0] for part in header.split(", ")] == ["context", "retrieval"]
+    assert all(part.split(";")[1].startswith("dur=") for part in header.split(", "))
+    assert stages.values[("context",)][2] == 1
+    assert requests.values[("GET", "/items/{item_id}", "200")][2] == 1
+
+
+def test_spans_outside_a_request_only_record_the_histogram():
+    registry = Registry()
+    stages = registry.histogram("stage_seconds", "Stages", ("stage",))
+    with span("sync_embed", stages):
+        pass
+    assert stages.values[("sync_embed",)][2] == 1
+    assert server_timing([("auth", 0.0012), ("completion", 1.5)]) == "auth;dur=1.2, completion;dur=1500.0"
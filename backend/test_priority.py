@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for the vectorized priority scorer that picks the coach's retrieved items
+"""
+
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from priority import FEATURES, PriorityWeights, feature_matrix, parse_priority_weights, prioritize, select_diverse
+
+NOW = datetime(2025, 5, 1, 12, tzinfo=timezone.utc)
+
+
+def goal(id, due=None, progress=0, score=None):
+    item = {'type': 'goal', 'id': id, 'content': id, 'metadata': {'due_date': due, 'progress': progress}}
+    if score is not None:
+        item['relevance_score'] = score
+    return item
+
+
+def task(id, high_impact=False, completed=False):
+    return {'type': 'task', 'id': id, 'content': id, 'metadata': {'is_high_impact': high_impact, 'is_completed': completed}}
+
+
+def journal(id, created_at, mood=None):
+    return {'type': 'journal', 'id': id, 'content': id, 'metadata': {'created_at': created_at, 'mood': mood}}
+
+
+def column(matrix, name):
+    return matrix[:, FEATURES.index(name)]
+
+
+def test_features_are_bounded_and_read_from_metadata():
+    items = [
+        goal('overdue', due='2025-04-20', progress=30, score=0.02),
+        goal('later', due='2025-05-15T00:00:00+00:00', progress=100),
+        task('big', high_impact=True),
+        task('done', completed=True),
+        journal('today', '2025-05-01T08:00:00Z', mood='sad'),
+        journal('old', '2025-04-01T08:00:00Z', mood=4),
+        journal('odd', 'not a date', mood='???'),
+    ]
+    matrix = feature_matrix(items, NOW)
+
+    assert matrix.shape == (len(items), len(FEATURES))
+    assert np.all((matrix >= 0) & (matrix <= 1))
+    assert column(matrix, 'similarity').tolist() == [1, 0, 0, 0, 0, 0, 0]
+    assert column(matrix, 'due')[0] == 1.0 and 0 < column(matrix, 'due')[1] < 0.5
+    assert column(matrix, 'progress')[:2].tolist() == [0.7, 0.0]
+    assert column(matrix, 'completed').tolist() == [0, 1, 0, 1, 0, 0, 0]
+    assert column(matrix, 'high_impact').tolist() == [0, 0, 1, 0, 0, 0, 0]
+    recency = column(matrix, 'recency')
+    assert recency[4] > 0.9 > 0.01 > recency[5] and recency[6] == 0
+    assert column(matrix, 'mood')[4:].tolist() == [0.75, 0.25, 0.0]
+
+
+def test_one_type_cannot_crowd_out_the_others():
+    # Ten goals all outscore the task and journal on raw score
+    items = [goal(f'g{i}', due='2025-05-02', progress=10) for i in range(10)]
+    items += [task('t1', high_impact=True), journal('j1', '2025-04-30T20:00:00Z', mood='stressed')]
+
+    picked = [item['id'] for item in prioritize(items, 6, now=NOW)]
+    assert {'t1', 'j1'} <= set(picked)
+    assert [item['id'] for item in prioritize(items, 6, PriorityWeights(diversity=0), now=NOW)][:6] == [f'g{i}' for i in range(6)]
+
+
+def test_similarity_and_completion_shift_the_ranking():
+    items = [task('finished', completed=True), task('open'), {**task('asked-about'), 'relevance_score': 0.03}]
+    ranked = [item['id'] for item in prioritize(items, 3, PriorityWeights(diversity=0), now=NOW)]
+
+    assert ranked == ['asked-about', 'open', 'finished']
+    assert prioritize(items, 1, now=NOW)[0]['priority_score'] == 3.0
+
+
+def test_select_diverse_matches_greedy_selection():
+    rng = np.random.default_rng(7)
+    types = rng.choice(['goal', 'task', 'journal'], 50)
+    scores = rng.random(50) * 3
+
+    remaining, picked, used = set(range(50)), [], {}
+    for _ in range(10):
+        best = max(remaining, key=lambda i: (scores[i] - 0.5 * used.get(types[i], 0), -i))
+        picked.append(best)
+        remaining.remove(best)
+        used[types[best]] = used.get(types[best], 0) + 1
+
+    assert select_diverse(types, scores, 10, 0.5) == picked
+
+
+def test_weights_parse_from_env_spec():
+    weights = parse_priority_weights(" similarity=1.5, mood=0 ,diversity=2")
+    assert (weights.similarity, weights.mood, weights.diversity) == (1.5, 0.0, 2.0)
+    assert weights.due == PriorityWeights().due
+    assert parse_priority_weights("") == PriorityWeights()
+
+
+@pytest.mark.parametrize("spec", ["speed=1", "due", "due=fast"])
+def test_bad_weight_specs_are_rejected(spec):
+    with pytest.raises(ValueError):
+        parse_priority_weights(spec)
+
+
+def test_no_items():
+    assert prioritize([], 5) == []
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for token-budgeted coach prompt assembly
+"""
+
+import pytest
+
+from prompt_budget import PromptBudget, assemble_prompt, count_message_tokens, count_tokens, truncate_tokens
+
+INSTRUCTIONS = "You are Coach DIGM. " * 40
+USER_SECTION = "USER CONTEXT\n- Vision: run a marathon\n- Level: 3"
+
+
+def data_section(data_text):
+    return f"AVAILABLE USER DATA\n{data_text}"
+
+
+def assemble(retrieved, user_message, chat_history=None, budget=None, summary=None):
+    return assemble_prompt(INSTRUCTIONS, USER_SECTION, data_section, retrieved, user_message, chat_history, budget=budget, summary=summary)
+
+
+def history(turns, words=60):
+    return [
+        {'message': f"question {i} " + "about my goals " * words, 'response': f"answer {i} " + "keep going " * words}
+        for i in range(turns)
+    ]
+
+
+RETRIEVED = [f"- Journal: entry {i} " + "today I felt " * 50 for i in range(30)]
+
+
+@pytest.mark.parametrize("total", [400, 700, 1000, 2000, 4000])
+@pytest.mark.parametrize("turns", [0, 1, 5, 40])
+def test_budget_is_never_exceeded(total, turns):
+    budget = PromptBudget(total=total)
+    plan = assemble(RETRIEVED, "how do I " * 500, history(turns), budget=budget)
+
+    assert count_message_tokens(plan.messages) <= total
+    assert plan.tokens['total'] == count_message_tokens(plan.messages)
+    assert plan.messages[0] == {'role': 'system', 'content': INSTRUCTIONS}
+    assert plan.messages[-1]['role'] == 'user'
+
+
+def test_section_caps_are_respected():
+    budget = PromptBudget(total=8000, retrieved=200, history=500, message=50)
+    plan = assemble(RETRIEVED, "how do I " * 500, history(40), budget=budget)
+
+    assert plan.tokens['retrieved'] <= 200 + count_tokens(data_section(""))
+    assert plan.tokens['history'] <= 500
+    assert plan.tokens['message'] <= 50
+
+
+def test_recent_turns_verbatim_and_older_turns_compressed():
+    turns = history(10, words=5)
+    budget = PromptBudget(total=4000, recent_turns=2)
+    plan = assemble([], "next?", turns, budget=budget)
+
+    summary, *recent, data, current = plan.messages[2:]
+    assert summary['role'] == 'system'
+    assert summary['content'].index('question 0') < summary['content'].index('question 7')
+    assert [m['content'] for m in recent] == [
+        turns[8]['message'], turns[8]['response'], turns[9]['message'], turns[9]['response']
+    ]
+    assert data['content'].startswith('AVAILABLE USER DATA')
+    assert current == {'role': 'user', 'content': 'next?'}
+    assert plan.turns == {'verbatim': 2, 'compressed': 8, 'dropped': 0, 'summary': 0, 'retrieved_items': 0}
+
+
+def test_oldest_history_is_dropped_first():
+    plan = assemble([], "next?", history(40), budget=PromptBudget(total=1500, history=600))
+
+    assert plan.turns['dropped'] > 0
+    contents = "\n".join(m['content'] for m in plan.messages)
+    assert 'question 39' in contents
+    assert 'question 0 ' not in contents
+
+
+def test_retrieved_items_keep_relevance_order():
+    plan = assemble(RETRIEVED, "hi", budget=PromptBudget(retrieved=300, item_tokens=60))
+
+    kept = plan.turns['retrieved_items']
+    assert 0 < kept < len(RETRIEVED)
+    assert 'entry 0 ' in plan.messages[-2]['content']
+    assert f'entry {kept} ' not in plan.messages[-2]['content']
+
+
+def test_budget_smaller_than_instructions_is_rejected():
+    with pytest.raises(ValueError):
+        assemble([], "hi", budget=PromptBudget(total=50))
+
+
+def test_truncate_tokens_fits_and_marks_the_cut():
+    text = "word " * 200
+    cut = truncate_tokens(text, 20)
+    assert count_tokens(cut) <= 20
+    assert cut.endswith("…")
+    assert truncate_tokens("short", 20) == "short"
+
+
+def test_conversation_summary_leads_the_history_within_its_cap():
+    turns = history(4, words=5)
+    budget = PromptBudget(total=4000, recent_turns=2, summary=20)
+    plan = assemble([], "next?", turns, budget=budget, summary="Talked about marathon training. " * 30)
+    lead = plan.messages[2]['content']
+    assert lead.startswith("Summary of the conversation so far:\n")
+    assert "Summary of earlier conversation (oldest first):" in lead
+    assert count_tokens(lead.split("\n")[1]) <= 20
+    assert plan.turns['summary'] == 1 and plan.turns['verbatim'] == 2 and plan.turns['compressed'] == 2
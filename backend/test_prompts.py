@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for the versioned coach prompt templates
+"""
+
+from collections import Counter
+
+import pytest
+
+from prompt_budget import PromptBudget, assemble_prompt, count_tokens
+from prompts import COACH_V1, PROMPT_TEMPLATES, PromptTemplate, choose_template, parse_version_weights
+
+
+def plan_for(name, context_lines, retrieved, message):
+    template = COACH_V1
+    return assemble_prompt(
+        template.instructions,
+        template.user_section(name, context_lines, PromptBudget()),
+        template.data_section,
+        retrieved,
+        message,
+    )
+
+
+def test_prefix_is_identical_across_users_and_turns():
+    first = plan_for("Sam", ["- Vision: run a marathon"], ["- Goal: 5k in May"], "what next?")
+    second = plan_for("Alex", ["- Vision: write a book", "- Level: 4"], [], "I feel stuck")
+
+    assert first.messages[0] == second.messages[0]
+    assert first.messages[0]['content'] == COACH_V1.instructions
+    assert "Sam" not in COACH_V1.instructions
+    assert "Sam" in first.messages[1]['content']
+
+
+def test_instructions_are_compiled_without_template_indentation():
+    assert COACH_V1.instructions == COACH_V1.instructions.strip()
+    assert not any(line.startswith("    ") for line in COACH_V1.instructions.splitlines())
+
+
+def test_user_section_respects_context_budget():
+    lines = [f"- Onboarding answer {i}: " + "value " * 30 for i in range(50)]
+    section = COACH_V1.user_section("Sam", lines, PromptBudget(context=120))
+    header = "You are coaching Sam.\n\nUSER CONTEXT\n"
+
+    assert section.startswith(header)
+    assert count_tokens(section[len(header):]) <= 120
+
+
+def test_state_lines_follow_the_user_context_within_their_own_budget():
+    state = [f"- Overdue: goal {i} (3 days late, Progress: 10%)" for i in range(40)]
+    section = COACH_V1.user_section("Sam", ["- Vision: run a marathon"], PromptBudget(state=60), state_lines=state)
+    context, _, state_part = section.partition("\n\nCURRENT STATE\n")
+
+    assert context.endswith("- Vision: run a marathon")
+    assert state_part.startswith(state[0]) and count_tokens(state_part) <= 60
+    assert "CURRENT STATE" not in COACH_V1.user_section("Sam", ["- Vision: run a marathon"], PromptBudget())
+
+
+def test_version_assignment_is_deterministic_and_weighted(monkeypatch):
+    monkeypatch.setitem(PROMPT_TEMPLATES, "v2", PromptTemplate(version="v2", instructions="Be brief."))
+    weights = parse_version_weights("v1=75, v2=25")
+
+    assert weights == {"v1": 75, "v2": 25}
+    assert choose_template("user-1", weights) is choose_template("user-1", weights)
+    counts = Counter(choose_template(f"user-{i}", weights).version for i in range(2000))
+    assert 0.7 < counts["v1"] / 2000 < 0.8
+
+
+@pytest.mark.parametrize("spec", ["", "v9", "v1=0"])
+def test_bad_version_specs_are_rejected(spec):
+    with pytest.raises(ValueError):
+        parse_version_weights(spec)
+
+
+def test_bare_version_means_everyone():
+    assert parse_version_weights("v1") == {"v1": 100}
+    assert choose_template("anyone", {"v1": 100}) is COACH_V1
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for latency-aware coach model routing, including against the fake OpenAI server
+"""
+
+import asyncio
+import time
+
+import httpx
+import openai
+
+from bench.fakes import FakeOpenAI, FakeUpstreamConfig
+from routing import FAST, STRONG, ModelRouter, RoutingThresholds, classify, route_features
+
+TIERS = {'fast': "small-model", 'strong': "large-model"}
+ITEMS = [{'type': 'goal', 'content': "Run a marathon (Due: 2025-10-01, Progress: 40%)"}]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_classify_sends_lookups_fast_and_coaching_strong():
+    cases = {
+        "What are my goals?": (FAST, "lookup_intent"),
+        "List my tasks due this week": (FAST, "lookup_intent"),
+        "thanks!": (FAST, "short_message"),
+        "I feel stuck and keep putting off my run, what should I change?": (STRONG, "coaching_intent"),
+        "Tell me something about the progress of my marathon training compared to last month": (STRONG, "default"),
+    }
+    for message, expected in cases.items():
+        assert classify(route_features(message, None, ITEMS)) == expected, message
+
+    history = [{'role': 'user', 'content': "hi"}] * 6
+    assert classify(route_features("What are my goals?", history, ITEMS)) == (STRONG, "long_history")
+    big = [{'content': "x" * 4000}]
+    assert classify(route_features("What are my goals?", None, big)) == (STRONG, "large_context")
+    assert classify(route_features("What are my goals? " * 20, None, ITEMS)) == (STRONG, "long_message")
+    assert classify(route_features("what is due?", None, ITEMS), RoutingThresholds(message_tokens=1)) == (STRONG, "long_message")
+
+
+def test_single_tier_routes_everything_to_the_strong_model():
+    router = ModelRouter({'strong': "large-model"})
+    decision = router.route("What are my goals?", None, ITEMS)
+    assert (decision.tier, decision.model, decision.reason) == (STRONG, "large-model", "single_tier")
+    assert router.escalation(decision, failed=True) is None
+
+
+def test_escalation_of_weak_or_failed_fast_answers():
+    router = ModelRouter(TIERS)
+    fast = router.route("What are my goals?", None, ITEMS)
+    assert fast.model == "small-model"
+    assert router.escalation(fast, "You have one goal: run a marathon.", "stop") is None
+    assert router.escalation(fast, "I'm not sure which goals you mean.", "stop").reason == "escalated_low_confidence"
+    assert router.escalation(fast, "You have one goal", "length").reason == "escalated_truncated"
+    assert router.escalation(fast, "  ", "stop").reason == "escalated_empty"
+    assert router.escalation(fast, failed=True).model == "large-model"
+    assert router.escalations == {'low_confidence': 1, 'truncated': 1, 'empty': 1, 'error': 1}
+    assert router.stats()['decisions']['fast/small-model/lookup_intent'] == 1
+
+
+def test_latency_spike_moves_traffic_until_the_cooldown_ends():
+    clock = FakeClock()
+    router = ModelRouter(TIERS, latency_limit=5.0, cooldown=30.0, clock=clock)
+    router.record("large-model", 2.0, ok=True)
+    assert not router.degraded("large-model")
+    for _ in range(12):
+        router.record("large-model", 20.0, ok=True)
+    assert router.degraded("large-model")
+
+    decision = router.route("I feel stressed about my plan", None, ITEMS)
+    assert (decision.model, decision.reason) == ("small-model", "strong_degraded")
+    clock.now += 31
+    assert router.route("I feel stressed about my plan", None, ITEMS).model == "large-model"
+    assert router.stats()['models']['large-model']['degradations'] == 1
+
+
+def test_failing_fast_model_on_the_fake_server_escalates_then_is_avoided():
+    fake = FakeOpenAI(
+        FakeUpstreamConfig(latency_ms=0, jitter_ms=0, token_interval_ms=0, completion_tokens=3),
+        models={"small-model": FakeUpstreamConfig(latency_ms=0, jitter_ms=0, error_rate=1.0, error_status=500)},
+    )
+    router = ModelRouter(TIERS)
+
+    async def ask(client, message):
+        decision = router.route(message, None, ITEMS)
+        started = time.perf_counter()
+        try:
+            await client.chat.completions.create(model=decision.model, messages=[{'role': 'user', 'content': message}])
+        except openai.APIError:
+            router.record(decision.model, time.perf_counter() - started, ok=False)
+            decision = router.escalation(decision, failed=True)
+            await client.chat.completions.create(model=decision.model, messages=[{'role': 'user', 'content': message}])
+        router.record(decision.model, time.perf_counter() - started, ok=True)
+        return decision
+
+    async def run():
+        http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake.app))
+        client = openai.AsyncOpenAI(api_key="test", base_url="http://openai.test/v1", http_client=http_client, max_retries=0)
+        async with http_client:
+            return [await ask(client, "What are my goals?") for _ in range(6)]
+
+    decisions = asyncio.run(run())
+    assert [d.reason for d in decisions[:4]] == ["escalated_error"] * 4
+    assert [d.reason for d in decisions[4:]] == ["fast_degraded"] * 2
+    assert fake.model_calls == {"small-model": 4, "large-model": 6}
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Tests for single-flight deduplication of coach queries and context loads
+"""
+
+import asyncio
+
+from cache import TTLCache
+from singleflight import SingleFlight, message_key
+
+
+def test_concurrent_calls_share_one_execution():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def load():
+            calls.append(1)
+            await release.wait()
+            return {"goals": []}
+
+        waiters = [asyncio.create_task(flight.do("user-1", load)) for _ in range(5)]
+        other = asyncio.create_task(flight.do("user-2", load))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters, other)
+
+        assert len(calls) == 2
+        assert all(result is results[0] for result in results[:5])
+        assert flight.stats() == {'leader': 2, 'shared': 4, 'cached': 0, 'in_flight': 0}
+
+        # Nothing is cached without a cache: the next call runs again
+        await flight.do("user-1", load)
+        assert len(calls) == 3
+
+    asyncio.run(run())
+
+
+def test_results_are_cached_but_failures_and_rejected_results_are_not():
+    async def run():
+        flight = SingleFlight(cache=TTLCache(ttl=60), cacheable=lambda result: result != "fallback")
+        outcomes = iter([RuntimeError("upstream down"), "fallback", "answer"])
+        calls = []
+
+        async def answer():
+            calls.append(1)
+            outcome = next(outcomes)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        try:
+            await flight.do("k", answer)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("expected the failure to reach the caller")
+        assert await flight.do("k", answer) == "fallback"
+        assert await flight.do("k", answer) == "answer"
+        assert await flight.do("k", answer) == "answer"
+        assert len(calls) == 3 and flight.counters['cached'] == 1
+
+        flight.forget("k")
+        assert flight.cache.get("k") is None
+
+    asyncio.run(run())
+
+
+def test_a_cancelled_caller_does_not_cancel_shared_work_unless_it_was_the_last():
+    async def run():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        finished = []
+
+        async def work():
+            started.set()
+            await asyncio.sleep(0.01)
+            finished.append(1)
+            return "done"
+
+        first = asyncio.create_task(flight.do("k", work))
+        second = asyncio.create_task(flight.do("k", work))
+        await started.wait()
+        first.cancel()
+        assert await second == "done" and finished == [1]
+
+        lonely = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0)
+        lonely.cancel()
+        await asyncio.gather(lonely, return_exceptions=True)
+        await asyncio.sleep(0.02)
+        assert finished == [1] and flight.stats()['in_flight'] == 0
+
+    asyncio.run(run())
+
+
+def test_message_key_normalizes_text_and_digests_history():
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    assert message_key("u", "  What should I   do today? ", history) == message_key("u", "what should i do today?", list(history))
+    assert message_key("u", "What should I do today?", history) != message_key("u", "What should I do today?", history[:1])
+    assert message_key("u", "hi") == message_key("u", "hi", [])
+    assert message_key("u", "hi") != message_key("v", "hi")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for local Supabase token verification using locally minted tokens
+"""
+
+import asyncio
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from auth import AuthError, TokenVerifier
+
+SUPABASE_URL = "https://project.supabase.co"
+SECRET = "test-jwt-secret-with-at-least-32-bytes!"
+USER_ID = "11111111-2222-3333-4444-555555555555"
+
+
+def mint(key=SECRET, algorithm="HS256", headers=None, **overrides):
+    now = int(time.time())
+    claims = {
+        "sub": USER_ID,
+        "aud": "authenticated",
+        "iss": f"{SUPABASE_URL}/auth/v1",
+        "iat": now,
+        "exp": now + 3600,
+        "role": "authenticated",
+    }
+    claims.update(overrides)
+    return jwt.encode(claims, key, algorithm=algorithm, headers=headers)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_valid_hs256_token_returns_user_id():
+    verifier = TokenVerifier(SUPABASE_URL, jwt_secret=SECRET)
+    assert run(verifier.verify(mint())) == USER_ID
+
+
+@pytest.mark.parametrize("overrides", [
+    {"exp": int(time.time()) - 3600},
+    {"aud": "anon-service"},
+    {"iss": "https://other.supabase.co/auth/v1"},
+])
+def test_rejects_expired_or_foreign_tokens(overrides):
+    verifier = TokenVerifier(SUPABASE_URL, jwt_secret=SECRET)
+    with pytest.raises(AuthError):
+        run(verifier.verify(mint(**overrides)))
+
+
+def test_rejects_bad_signature():
+    verifier = TokenVerifier(SUPABASE_URL, jwt_secret=SECRET)
+    with pytest.raises(AuthError):
+        run(verifier.verify(mint(key="a-different-secret-of-at-least-32-bytes")))
+
+
+def test_rejects_hs256_without_secret():
+    verifier = TokenVerifier(SUPABASE_URL)
+    with pytest.raises(AuthError):
+        run(verifier.verify(mint()))
+
+
+def test_rejects_unsigned_token():
+    verifier = TokenVerifier(SUPABASE_URL, jwt_secret=SECRET)
+    token = mint(key=None, algorithm="none")
+    with pytest.raises(AuthError):
+        run(verifier.verify(token))
+
+
+def test_es256_token_verified_against_jwks():
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    jwk = json.loads(jwt.algorithms.ECAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({"kid": "key-1", "alg": "ES256", "use": "sig"})
+
+    verifier = TokenVerifier(SUPABASE_URL)
+    verifier.load_jwks({"keys": [jwk]})
+
+    token = mint(key=private_key, algorithm="ES256", headers={"kid": "key-1"})
+    assert run(verifier.verify(token)) == USER_ID
+
+    unknown_kid = mint(key=private_key, algorithm="ES256", headers={"kid": "key-2"})
+    with pytest.raises(AuthError):
+        run(verifier.verify(unknown_kid))
+
+
+def test_verified_tokens_are_cached():
+    verifier = TokenVerifier(SUPABASE_URL, jwt_secret=SECRET)
+    token = mint()
+    run(verifier.verify(token))
+    # Drop the secret: a cache hit must not need to verify again
+    verifier.jwt_secret = None
+    assert run(verifier.verify(token)) == USER_ID
+    assert verifier.cache.stats()["hits"] == 1
+
+
+def test_cache_is_bounded():
+    verifier = TokenVerifier(SUPABASE_URL, jwt_secret=SECRET, cache_size=2)
+    for i in range(5):
+        run(verifier.verify(mint(session_id=str(i))))
+    assert len(verifier.cache) == 2
+
+
+def test_remote_mode_delegates_and_caches():
+    calls = []
+
+    async def remote_verify(token):
+        calls.append(token)
+        return USER_ID
+
+    verifier = TokenVerifier(SUPABASE_URL, mode="remote", remote_verify=remote_verify)
+    token = mint()
+    assert run(verifier.verify(token)) == USER_ID
+    assert run(verifier.verify(token)) == USER_ID
+    assert calls == [token]
+
+
+def test_remote_mode_failure_is_auth_error():
+    async def remote_verify(token):
+        raise RuntimeError("invalid JWT")
+
+    verifier = TokenVerifier(SUPABASE_URL, mode="remote", remote_verify=remote_verify)
+    with pytest.raises(AuthError):
+        run(verifier.verify(mint()))
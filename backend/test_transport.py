@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests for the pooled upstream transport: retries, retry budget and circuit breaking
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from transport import CircuitBreaker, CircuitOpenError, ResilientTransport, RetryBudget, Upstream, UpstreamConfig
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_client(responses, config=UpstreamConfig(), clock=None):
+    """A client whose upstream answers with responses in order (a status code or an exception)"""
+    calls = []
+    sleeps = []
+
+    def handler(request):
+        calls.append(request.method)
+        outcome = responses[min(len(calls), len(responses)) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        status, headers = outcome if isinstance(outcome, tuple) else (outcome, {})
+        return httpx.Response(status, headers=headers, json={'ok': status < 400})
+
+    async def sleep(delay):
+        sleeps.append(delay)
+
+    transport = ResilientTransport(
+        'test', config, transport=httpx.MockTransport(handler), sleep=sleep, clock=clock or Clock()
+    )
+    client = httpx.AsyncClient(transport=transport, base_url='http://upstream')
+    return client, transport, calls, sleeps
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_retries_overload_statuses_then_succeeds():
+    client, transport, calls, sleeps = make_client([503, (429, {'Retry-After': '1'}), 200])
+
+    response = run(client.post('/rpc/match', json={}))
+    assert response.status_code == 200
+    assert calls == ['POST'] * 3
+    assert sleeps[1] >= 1.0
+    assert transport.stats()['retries'] == 2
+
+
+def test_post_is_not_replayed_after_it_may_have_been_processed():
+    client, _, calls, _ = make_client([502, 200])
+    assert run(client.post('/chat', json={})).status_code == 502
+    assert calls == ['POST']
+
+    client, _, calls, _ = make_client([httpx.ReadTimeout('slow'), 200])
+    with pytest.raises(httpx.ReadTimeout):
+        run(client.post('/chat', json={}))
+    assert len(calls) == 1
+
+    # A connection that never opened is safe to retry whatever the method
+    client, _, calls, _ = make_client([httpx.ConnectError('refused'), 200])
+    assert run(client.post('/chat', json={})).status_code == 200
+    assert len(calls) == 2
+
+
+def test_gives_up_after_max_retries_and_on_long_retry_after():
+    client, _, calls, _ = make_client([503], UpstreamConfig(max_retries=2))
+    assert run(client.get('/x')).status_code == 503
+    assert len(calls) == 3
+
+    client, _, calls, _ = make_client([(429, {'Retry-After': '120'}), 200])
+    assert run(client.get('/x')).status_code == 429
+    assert len(calls) == 1
+
+
+def test_retry_budget_limits_retries_under_sustained_failure():
+    budget = RetryBudget(ratio=0.5, reserve=2)
+    assert [budget.withdraw() for _ in range(3)] == [True, True, False]
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw() is True
+
+    config = UpstreamConfig(max_retries=5, retry_budget=0.0, failure_threshold=100)
+    client, transport, calls, _ = make_client([503], config)
+    transport.budget = RetryBudget(ratio=0.0, reserve=3)
+    for _ in range(3):
+        run(client.get('/x'))
+    # Three retries in reserve, shared by every request
+    assert len(calls) == 6
+    assert transport.stats()['budget_exhausted'] == 3
+
+
+def test_circuit_opens_fails_fast_and_recovers_after_a_trial():
+    clock = Clock()
+    config = UpstreamConfig(max_retries=0, failure_threshold=3, reset_timeout=10)
+    outcomes = [500, 500, 500, 200]
+    client, transport, calls, _ = make_client(outcomes, config, clock)
+
+    for _ in range(3):
+        run(client.get('/x'))
+    assert transport.breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        run(client.get('/x'))
+    assert len(calls) == 3
+    assert transport.stats()['rejected'] == 1
+
+    clock.now = 11
+    assert run(client.get('/x')).status_code == 200
+    assert transport.breaker.state == 'closed'
+
+
+def test_failed_trial_reopens_and_only_one_trial_runs():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    clock.now = 6
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and breaker.opened == 2
+
+    # A trial that never reports back does not wedge the circuit half open
+    clock.now = 12
+    assert breaker.allow()
+    clock.now = 18
+    assert breaker.allow()
+
+
+def test_config_reads_prefixed_environment(monkeypatch):
+    monkeypatch.setenv('OPENAI_READ_TIMEOUT', '12.5')
+    monkeypatch.setenv('OPENAI_MAX_CONNECTIONS', '7')
+    monkeypatch.setenv('OPENAI_HTTP2', 'false')
+    config = UpstreamConfig.from_env('OPENAI', read_timeout=30.0, max_retries=1)
+
+    assert (config.read_timeout, config.max_connections, config.http2, config.max_retries) == (12.5, 7, False, 1)
+    assert config.timeout.read == 12.5 and config.timeout.connect == UpstreamConfig().connect_timeout
+
+
+def test_extra_clients_share_the_upstream_transport_but_not_headers():
+    upstream = Upstream('test', UpstreamConfig())
+    other = upstream.new_client(headers={'apikey': 'service'})
+    upstream.client.headers['apikey'] = 'anon'
+
+    assert other._transport is upstream.transport
+    assert (other.headers['apikey'], upstream.client.headers['apikey']) == ('service', 'anon')
+    assert other.timeout == upstream.client.timeout
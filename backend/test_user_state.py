@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Tests for precomputed per-user coaching state and its chunked, checkpointed refresh
+"""
+
+import asyncio
+from dataclasses import asdict
+from datetime import date
+
+from user_state import FileCheckpoint, StateRefresher, compute_user_state, current_state, state_lines
+
+TODAY = date(2025, 6, 10)
+
+
+def snapshot(**overrides):
+    data = {
+        'goals': [
+            {'id': 'g1', 'title': "Run a marathon", 'due_date': "2025-06-01", 'progress': 40},
+            {'id': 'g2', 'title': "Read 12 books", 'due_date': "2025-06-14", 'progress': 70},
+            {'id': 'g3', 'title': "Launch MVP", 'due_date': None, 'progress': 100},
+        ],
+        'tasks': [
+            {'id': 't1', 'title': "Long run", 'status': 'todo', 'is_high_impact': True, 'is_completed': False},
+            {'id': 't2', 'title': "Stretch", 'status': 'todo', 'is_high_impact': False, 'is_completed': False},
+            {'id': 't3', 'title': "Tempo run", 'status': 'done', 'is_completed': True, 'completed_at': "2025-06-10T07:00:00+00:00"},
+            {'id': 't4', 'title': "Buy shoes", 'status': 'done', 'is_completed': True, 'completed_at': "2025-06-09T18:00:00+00:00"},
+            {'id': 't5', 'title': "Plan week", 'status': 'done', 'is_completed': True, 'completed_at': "2025-06-08T09:00:00+00:00"},
+            {'id': 't6', 'title': "Old task", 'status': 'done', 'is_completed': True, 'completed_at': "2025-06-01T09:00:00+00:00"},
+        ],
+        'journals': [
+            {'id': 'j1', 'content': "...", 'mood': "great", 'created_at': "2025-06-07T21:00:00+00:00"},
+            {'id': 'j2', 'content': "...", 'mood': "good", 'created_at': "2025-06-06T21:00:00+00:00"},
+            {'id': 'j3', 'content': "...", 'mood': "sad", 'created_at': "2025-06-03T21:00:00+00:00"},
+            {'id': 'j4', 'content': "...", 'mood': "stressed", 'created_at': "2025-06-02T21:00:00+00:00"},
+        ],
+    }
+    data.update(overrides)
+    return data
+
+
+def test_state_summarizes_goals_momentum_streak_and_mood():
+    state = compute_user_state(snapshot(data_version=7), TODAY)
+
+    assert (state.source_version, state.active_goals, state.completed_goals, state.average_progress) == (7, 2, 1, 55)
+    assert state.overdue_goals(TODAY) == [{'title': "Run a marathon", 'due_date': "2025-06-01", 'progress': 40, 'days_overdue': 9}]
+    assert [goal['title'] for goal in state.due_soon_goals(TODAY)] == ["Read 12 books"]
+    assert (state.open_tasks, state.high_impact_open_count, state.high_impact_open) == (2, 1, ["Long run"])
+    assert (state.completed_between(TODAY, 0, 6), state.completed_between(TODAY, 7, 13), state.momentum(TODAY)) == (3, 1, "rising")
+    assert state.streak_days(TODAY) == 5   # tasks on the 10th, 9th, 8th and journals on the 7th, 6th
+    assert (state.latest_mood, state.mood_trend) == ("great", "improving")
+    assert compute_user_state(snapshot(journals=snapshot()['journals'][:3]), TODAY).mood_trend == "unknown"
+    assert compute_user_state(snapshot(journals=snapshot()['journals'][::-1]), TODAY).latest_mood == "great"
+
+    lines = state_lines(state, TODAY)
+    assert "- Overdue: Run a marathon (9 days late, Progress: 40%)" in lines
+    assert "- Open tasks: 2 (1 high impact: Long run)" in lines
+    assert "- Streak: 5 days" in lines
+
+
+def test_day_dependent_values_are_worked_out_for_the_day_the_state_is_rendered():
+    state = compute_user_state(snapshot(), TODAY)
+
+    tomorrow = date(2025, 6, 11)
+    assert state.overdue_goals(tomorrow)[0]['days_overdue'] == 10
+    assert state.streak_days(tomorrow) == 5     # nothing done yet today, the streak is still alive
+    assert state.streak_days(date(2025, 6, 12)) == 0
+    assert "- Overdue: Run a marathon (10 days late, Progress: 40%)" in state_lines(state, tomorrow)
+
+    # A week on, the book goal is overdue too and last week's three tasks are the week before
+    later = date(2025, 6, 17)
+    assert [goal['title'] for goal in state.overdue_goals(later)] == ["Run a marathon", "Read 12 books"]
+    assert (state.completed_between(later, 0, 6), state.completed_between(later, 7, 13), state.momentum(later)) == (0, 3, "stalled")
+
+
+def test_stored_state_is_used_whenever_the_snapshot_returns_it():
+    stored = asdict(compute_user_state(snapshot(data_version=3), TODAY))
+    state, from_store = current_state(snapshot(data_version=3, state=stored), TODAY)
+    assert from_store and state == compute_user_state(snapshot(data_version=3), TODAY)
+
+    # get_user_snapshot leaves the state out once the data version moved past it, and a new day does not matter
+    assert not current_state(snapshot(data_version=4, state=None), TODAY)[1]
+    assert current_state(snapshot(data_version=3, state=stored), date(2025, 6, 11))[1]
+    assert not current_state(snapshot(state={**stored, 'version': 1}), TODAY)[1]
+
+
+class FakeStore:
+    def __init__(self, users):
+        self.users = sorted(users)
+        self.rows = {}
+        self.saves = []
+        self.fail_after = None
+
+    async def user_ids(self, after, limit):
+        if after is not None and after == self.fail_after:
+            raise ConnectionError("listing failed")
+        return [u for u in self.users if after is None or u > after][:limit]
+
+    async def versions(self, user_ids):
+        return {u: self.rows[u].source_version for u in user_ids if u in self.rows}
+
+    async def save(self, states):
+        self.saves.append(sorted(states))
+        self.rows.update(states)
+
+
+def test_refresh_runs_in_chunks_skips_unchanged_users_and_resumes_from_its_checkpoint(tmp_path):
+    users = [f"user-{i:02d}" for i in range(10)]
+    store = FakeStore(users)
+    data = {user: snapshot(data_version=1) for user in users}
+    broken = {"user-03"}
+
+    async def load(user_id):
+        if user_id in broken:
+            raise RuntimeError("snapshot failed")
+        return data[user_id]
+
+    checkpoint = FileCheckpoint(str(tmp_path / "checkpoint.json"))
+    refresher = StateRefresher(store, load, chunk_size=4, concurrency=2, checkpoint=checkpoint, today=lambda: TODAY)
+
+    report = asyncio.run(refresher.run())
+    assert (report.chunks, report.users, report.refreshed, report.failed) == (3, 10, 9, 1)
+    assert store.saves[0] == ["user-00", "user-01", "user-02"]
+    assert checkpoint.load() is None
+
+    # Second pass: only the user that failed and the one whose data changed are written
+    data["user-05"] = snapshot(goals=[], data_version=2)
+    broken.clear()
+    report = asyncio.run(refresher.run())
+    assert (report.refreshed, report.unchanged) == (2, 8)
+    assert store.saves[-2:] == [["user-03"], ["user-05"]]
+
+    # A run that dies mid-way picks up after the last finished chunk
+    for user in users:
+        data[user] = snapshot(tasks=[], data_version=3)
+    store.fail_after = "user-03"
+    try:
+        asyncio.run(refresher.run())
+    except ConnectionError:
+        pass
+    assert checkpoint.load()['cursor'] == "user-03"
+
+    store.fail_after = None
+    resumed = asyncio.run(refresher.run())
+    assert resumed.resumed and resumed.users == 10 and resumed.refreshed == 10
+    assert store.saves[-2:] == [["user-04", "user-05", "user-06", "user-07"], ["user-08", "user-09"]]
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-process, memory-mapped vector store
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from rag_service import RAGService
+from vector_store import FETCH_PAGE_SIZE, LocalVectorStore, PgVectorBackend, quantize, top_k
+
+
+class FakeEmbeddingTable:
+    def __init__(self, db):
+        self.db = db
+        self.page = None
+        self.ordering = None
+
+    def select(self, *args):
+        return self
+
+    def eq(self, column, value):
+        self.user_id = value
+        return self
+
+    def order(self, column):
+        self.ordering = column
+        return self
+
+    def range(self, start, end):
+        self.page = (start, end)
+        return self
+
+    async def execute(self):
+        self.db.requests.append(self.page)
+        self.db.orderings.append(self.ordering)
+        start, end = self.page
+        rows = self.db.rows.get(self.user_id, [])
+        if self.ordering:
+            rows = sorted(rows, key=lambda row: row[self.ordering])
+        data = [dict(row) for row in rows[start:end + 1]]
+        gate, self.db.gate = self.db.gate, None
+        if gate is not None:
+            await gate.wait()   # this one response is held in flight
+        return SimpleNamespace(data=data)
+
+
+class FakeSupabase:
+    def __init__(self, rows):
+        self.rows = rows
+        self.requests = []
+        self.orderings = []
+        self.gate = None
+
+    def table(self, name):
+        assert name == 'user_embeddings'
+        return FakeEmbeddingTable(self)
+
+
+class FakeRPC:
+    async def execute(self):
+        return SimpleNamespace(data=[])
+
+
+def embedding_rows(vectors, as_text=False):
+    return [{
+        'id': f'e{i:06d}',
+        'content_type': 'journal',
+        'content_id': f'j{i}',
+        'content_text': f'entry {i}',
+        'metadata': {},
+        # PostgREST returns pgvector columns as text
+        'embedding': str(list(map(float, vector))) if as_text else list(map(float, vector)),
+    } for i, vector in enumerate(vectors)]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.mark.parametrize("k", [1, 5, 50, 200])
+def test_top_k_matches_full_sort(k):
+    scores = np.random.default_rng(0).standard_normal((100, 3))
+    expected = np.argsort(-scores, axis=0, kind="stable")[:k]
+    assert np.array_equal(top_k(scores, k), expected)
+    assert np.array_equal(top_k(scores[:, 0], k), expected[:, 0])
+
+
+def test_search_ranks_by_cosine_and_applies_threshold(tmp_path):
+    vectors = [[1, 0, 0], [0.9, 0.1, 0], [0, 1, 0], [-1, 0, 0]]
+    store = LocalVectorStore(FakeSupabase({'u1': embedding_rows(vectors, as_text=True)}), str(tmp_path))
+
+    matches = run(store.search('u1', [2, 0, 0], match_threshold=0.5, match_count=3))
+
+    assert [m['content_id'] for m in matches] == ['j0', 'j1']
+    assert matches[0]['similarity'] == pytest.approx(1.0)
+    assert matches[0]['content_text'] == 'entry 0'
+
+
+def test_batched_queries_match_single_queries(tmp_path):
+    rng = np.random.default_rng(1)
+    store = LocalVectorStore(FakeSupabase({'u1': embedding_rows(rng.standard_normal((300, 16)))}), str(tmp_path))
+    queries = rng.standard_normal((8, 16))
+
+    batched = run(store.search_many('u1', queries, -1.0, 10))
+    single = [run(store.search('u1', q, -1.0, 10)) for q in queries]
+
+    assert [[m['content_id'] for m in r] for r in batched] == [[m['content_id'] for m in r] for r in single]
+
+
+def test_vectors_are_fetched_once_in_pages_and_reused_from_disk(tmp_path):
+    supabase = FakeSupabase({'u1': embedding_rows(np.eye(FETCH_PAGE_SIZE + 5, 8))})
+    store = LocalVectorStore(supabase, str(tmp_path))
+
+    run(store.search('u1', [1] + [0] * 7, 0.5, 3))
+    run(store.search('u1', [1] + [0] * 7, 0.5, 3))
+    assert supabase.requests == [(0, FETCH_PAGE_SIZE - 1), (FETCH_PAGE_SIZE, 2 * FETCH_PAGE_SIZE - 1)]
+    assert supabase.orderings == ['id', 'id']   # pages of a stable order neither overlap nor skip rows
+    assert store.stats()['vectors'] == FETCH_PAGE_SIZE + 5
+
+    # A new process maps the file instead of fetching again
+    reopened = LocalVectorStore(supabase, str(tmp_path))
+    assert len(run(reopened.search('u1', [0, 1] + [0] * 6, 0.5, 3))) == 1
+    assert reopened.stats()['disk_loads'] == 1
+    assert len(supabase.requests) == 2
+
+
+def test_least_recently_used_users_are_evicted(tmp_path):
+    rows = {f'u{i}': embedding_rows(np.eye(3)) for i in range(3)}
+    store = LocalVectorStore(FakeSupabase(rows), str(tmp_path), max_users=2)
+    for user_id in ('u0', 'u1', 'u0', 'u2'):
+        run(store.search(user_id, [1, 0, 0], 0.0, 1))
+
+    stats = store.stats()
+    assert (stats['users'], stats['evictions']) == (2, 1)
+    assert set(store._users) == {'u0', 'u2'}
+
+
+def test_invalidate_refetches_changed_vectors(tmp_path):
+    supabase = FakeSupabase({'u1': embedding_rows(np.eye(3))})
+    store = LocalVectorStore(supabase, str(tmp_path))
+    run(store.search('u1', [1, 0, 0], 0.0, 1))
+
+    supabase.rows['u1'] = embedding_rows([[0, 0, 1]])
+    run(store.invalidate('u1'))
+
+    assert [m['content_id'] for m in run(store.search('u1', [0, 0, 1], 0.0, 3))] == ['j0']
+    assert store.stats()['fetches'] == 2
+
+
+def test_a_load_overtaken_by_invalidate_is_not_kept(tmp_path):
+    supabase = FakeSupabase({'u1': embedding_rows(np.eye(3))})
+    store = LocalVectorStore(supabase, str(tmp_path))
+
+    async def scenario():
+        gate = supabase.gate = asyncio.Event()
+        before = asyncio.create_task(store.search('u1', [1, 0, 0], -1.0, 3))
+        await asyncio.sleep(0.05)   # the load is now waiting on the old rows
+
+        supabase.rows['u1'] = embedding_rows([[0, 0, 1]])
+        await store.invalidate('u1')
+        after = await store.search('u1', [0, 0, 1], 0.0, 3)
+        gate.set()
+        return await before, after
+
+    before, after = run(scenario())
+    assert len(before) == 3 and len(after) == 1
+    assert store.stats()['stale_loads'] == 1
+    assert len(run(store.search('u1', [0, 0, 1], 0.0, 3))) == 1
+    assert len(run(LocalVectorStore(supabase, str(tmp_path)).search('u1', [1, 0, 0], -1.0, 3))) == 1
+
+
+def test_vector_files_are_published_as_one_pair_and_checked_on_load(tmp_path):
+    supabase = FakeSupabase({'u1': embedding_rows(np.eye(3))})
+    store = LocalVectorStore(supabase, str(tmp_path))
+    run(store.search('u1', [1, 0, 0], 0.0, 1))
+    supabase.rows['u1'] = embedding_rows(np.eye(4))
+    run(store.invalidate('u1'))
+    run(store.search('u1', [1, 0, 0, 0], 0.0, 1))
+    # The rewrite replaced the matrix its .json names and removed the old one
+    (rows_file,) = tmp_path.glob("*.json")
+    (matrix_file,) = tmp_path.glob("*.npy")
+    assert json.loads(rows_file.read_text())['matrix'] == matrix_file.name
+
+    # A matrix that does not match its rows (or is missing) is refetched rather than searched
+    np.save(matrix_file, np.eye(2, 4, dtype=np.float32))
+    reopened = LocalVectorStore(supabase, str(tmp_path))
+    assert len(run(reopened.search('u1', [1, 0, 0, 0], -1.0, 10))) == 4
+    assert (reopened.stats()['disk_loads'], reopened.stats()['fetches']) == (0, 1)
+
+    for path in tmp_path.glob("*.npy"):
+        path.unlink()
+    reopened = LocalVectorStore(supabase, str(tmp_path))
+    assert len(run(reopened.search('u1', [1, 0, 0, 0], -1.0, 10))) == 4
+    assert reopened.stats()['fetches'] == 1
+
+
+def test_rag_service_searches_through_the_configured_backend(tmp_path):
+    store = LocalVectorStore(FakeSupabase({'u1': embedding_rows([[1.0, 0.0]])}), str(tmp_path))
+
+    async def create(model, input):
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[1.0, 0.0]) for i in range(len(input))])
+
+    service = RAGService(None, SimpleNamespace(embeddings=SimpleNamespace(create=create)), vector_backend=store)
+    results = run(service.search_relevant_data('u1', "anything", candidates=[]))
+
+    assert [item['id'] for item in results] == ['j0']
+    assert service.search_stats['vector'] == 1
+
+
+def clustered(n, dimensions, rng):
+    centres = rng.standard_normal((20, dimensions))
+    return centres[rng.integers(0, 20, n)] + 0.5 * rng.standard_normal((n, dimensions))
+
+
+def test_quantize_shrinks_the_matrix():
+    matrix = np.random.default_rng(2).standard_normal((10, 256)).astype(np.float32)
+    assert quantize(matrix, "float16").nbytes == matrix.nbytes // 2
+    assert quantize(matrix, "int8").nbytes == matrix.nbytes // 4 + 10 * 4
+    assert quantize(matrix, "binary").nbytes == matrix.nbytes // 32
+    with pytest.raises(ValueError):
+        quantize(matrix, "int4")
+
+
+@pytest.mark.parametrize("mode", ["float16", "int8", "binary"])
+def test_quantized_search_reranks_to_exact_results(tmp_path, mode):
+    rng = np.random.default_rng(3)
+    vectors = clustered(400, 64, rng)
+    queries = vectors[:10] + 0.05 * rng.standard_normal((10, 64))
+    supabase = FakeSupabase({'u1': embedding_rows(vectors)})
+    exact = LocalVectorStore(supabase, str(tmp_path / "exact"))
+    quantized = LocalVectorStore(supabase, str(tmp_path / mode), quantization=mode)
+
+    expected = run(exact.search_many('u1', queries, 0.0, 5))
+    found = run(quantized.search_many('u1', queries, 0.0, 5))
+
+    # Similarities come from the full-precision rescoring, not the quantized pass
+    for want, got in zip(expected, found):
+        assert [m['content_id'] for m in got] == [m['content_id'] for m in want]
+        assert [m['similarity'] for m in got] == pytest.approx([m['similarity'] for m in want])
+    assert quantized.stats()['bytes'] < exact.stats()['bytes']
+
+
+def test_pgvector_quantized_search_uses_the_rerank_function():
+    calls = []
+    supabase = SimpleNamespace(rpc=lambda name, params: calls.append((name, params)) or FakeRPC())
+    backend = PgVectorBackend(supabase, quantization="binary")
+
+    run(backend.search('u1', [0.1, 0.2], 0.3, 6))
+
+    assert calls[0][0] == 'match_documents_quantized'
+    assert (calls[0][1]['quantization'], calls[0][1]['rerank_factor']) == ('binary', 10)
+    with pytest.raises(ValueError):
+        PgVectorBackend(supabase, quantization="int8")
@@ -0,0 +1,279 @@
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, fields, replace
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth another attempt: rate limited, or the upstream (or its proxy) is overloaded
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+# Statuses that mean the upstream did not act on the request, so any method can be replayed
+NOT_PROCESSED_STATUSES = frozenset({429, 503})
+# Methods that are safe to replay even if the upstream may have acted on the first attempt
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+# Failures where the request never left this process
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised instead of sending a request while an upstream's circuit is open"""
+
+
+@dataclass(frozen=True)
+class UpstreamConfig:
+    """Pool, timeout, retry and circuit settings for one upstream"""
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = True
+    connect_timeout: float = 3.0
+    read_timeout: float = 30.0
+    write_timeout: float = 10.0
+    pool_timeout: float = 2.0       # waiting for a free connection counts as a failure too
+    max_retries: int = 2
+    backoff: float = 0.25           # attempt n waits about backoff * 2**n, jittered
+    max_backoff: float = 4.0        # a longer Retry-After is not waited for
+    retry_budget: float = 0.2       # retries allowed per request, averaged over time
+    failure_threshold: int = 5      # consecutive failures that open the circuit
+    reset_timeout: float = 15.0     # seconds the circuit stays open before a trial request
+
+    @classmethod
+    def from_env(cls, prefix: str, **defaults) -> "UpstreamConfig":
+        """defaults, overridden by PREFIX_<FIELD> environment variables (e.g. OPENAI_READ_TIMEOUT)"""
+        config = cls(**defaults)
+        overrides = {}
+        for field in fields(cls):
+            value = os.getenv(f"{prefix}_{field.name.upper()}")
+            if value:
+                kind = type(getattr(config, field.name))
+                overrides[field.name] = value.lower() in ("1", "true", "yes") if kind is bool else kind(value)
+        return replace(config, **overrides)
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half open (one trial) -> closed or open.
+
+    While open, calls are refused immediately instead of queueing behind a
+    struggling upstream; after ``reset_timeout`` a single trial request is let
+    through and its outcome decides whether the circuit closes again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 15.0, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened = 0
+        self._opened_at: Optional[float] = None
+        self._trial_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if self.retry_after() == 0 else "open"
+
+    def retry_after(self) -> float:
+        """Seconds until a trial request will be allowed (0 if one is allowed now)"""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - self.clock())
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        # One trial at a time; a trial that never reported back (e.g. was cancelled) expires
+        if state == "half_open" and (self._trial_at is None or self.clock() - self._trial_at > self.reset_timeout):
+            self._trial_at = self.clock()
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._trial_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_at is not None or (self._opened_at is None and self.failures >= self.failure_threshold):
+            self._opened_at = self.clock()
+            self.opened += 1
+        self._trial_at = None
+
+
+class RetryBudget:
+    """Token bucket capping retries at ``ratio`` of the request volume (plus a small reserve).
+
+    Without a budget every caller retries when an upstream degrades, multiplying
+    its load exactly when it can least take it.
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: int = 10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = float(reserve)
+
+    def deposit(self):
+        self.tokens = min(self.tokens + self.ratio, float(self.reserve))
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """The Retry-After header of a response in seconds (delta or HTTP date), if any"""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    """Pooled keep-alive transport with jittered retries, a retry budget and a circuit breaker.
+
+    Sits under an ``httpx.AsyncClient``, so the OpenAI and Supabase SDKs get
+    the behaviour without knowing about it. Only failures that are safe to
+    replay are retried: anything that never reached the upstream, 429/503
+    (not processed), and 502/504 or read errors for idempotent methods.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        config: UpstreamConfig = UpstreamConfig(),
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.config = config
+        self.transport = transport or httpx.AsyncHTTPTransport(http2=config.http2, limits=config.limits)
+        self.breaker = CircuitBreaker(config.failure_threshold, config.reset_timeout, clock)
+        self.budget = RetryBudget(config.retry_budget)
+        self.sleep = sleep
+        self.counters = {"requests": 0, "retries": 0, "failures": 0, "rejected": 0, "budget_exhausted": 0}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not self.breaker.allow():
+            self.counters["rejected"] += 1
+            raise CircuitOpenError(
+                f"{self.name} circuit is open, retry in {self.breaker.retry_after():.1f}s", request=request
+            )
+        self.counters["requests"] += 1
+        self.budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                self._record(failed=True)
+                if not self._may_retry(request, attempt, replayable=isinstance(e, NOT_SENT_ERRORS)):
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"⚠️ {self.name} {request.method} {request.url.path} failed ({e!r}), retrying in {delay:.2f}s")
+            else:
+                # 429 is the upstream working as intended, so it does not count against the circuit
+                self._record(failed=response.status_code >= 500)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                wait = retry_after_seconds(response)
+                if (wait is not None and wait > self.config.max_backoff) or not self._may_retry(
+                    request, attempt, replayable=response.status_code in NOT_PROCESSED_STATUSES
+                ):
+                    return response
+                delay = max(self._backoff(attempt), wait or 0.0)
+                await response.aclose()
+                logger.warning(f"⚠️ {self.name} {request.method} {request.url.path} returned {response.status_code}, retrying in {delay:.2f}s")
+            attempt += 1
+            self.counters["retries"] += 1
+            await self.sleep(delay)
+
+    def _record(self, failed: bool):
+        if failed:
+            self.counters["failures"] += 1
+            was_closed = self.breaker.state == "closed"
+            self.breaker.record_failure()
+            if was_closed and self.breaker.state != "closed":
+                logger.error(f"🔌 {self.name} circuit opened after {self.breaker.failures} consecutive failures")
+        else:
+            self.breaker.record_success()
+
+    def _may_retry(self, request: httpx.Request, attempt: int, replayable: bool) -> bool:
+        if attempt >= self.config.max_retries or self.breaker.state != "closed":
+            return False
+        if not replayable and request.method not in IDEMPOTENT_METHODS:
+            return False
+        if not self.budget.withdraw():
+            self.counters["budget_exhausted"] += 1
+            return False
+        return True
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.config.max_backoff, self.config.backoff * (2 ** attempt)))
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.opened,
+            "retry_tokens": round(self.budget.tokens, 2),
+        }
+
+
+class Upstream:
+    """One pooled keep-alive ``httpx.AsyncClient`` per upstream, sharing its retry and circuit state"""
+
+    def __init__(self, name: str, config: UpstreamConfig = UpstreamConfig(), **client_options):
+        self.name = name
+        self.config = config
+        self.transport = ResilientTransport(name, config)
+        self.client = httpx.AsyncClient(transport=self.transport, timeout=config.timeout, **client_options)
+
+    def new_client(self, **client_options) -> httpx.AsyncClient:
+        """Another client on this upstream's pool, retries and circuit, with headers of its own"""
+        return httpx.AsyncClient(transport=self.transport, timeout=self.config.timeout, **client_options)
+
+    def stats(self) -> Dict:
+        return self.transport.stats()
+
+    async def aclose(self):
+        await self.client.aclose()
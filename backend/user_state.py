@@ -0,0 +1,476 @@
+"""
+Precomputed per-user coaching state: overdue goals, momentum, streak and mood trend.
+
+A batch job (``python -m user_state``, or the in-process scheduler started by
+main.py when USER_STATE_REFRESH_INTERVAL is set) computes one compact summary
+per user from their goals, tasks and journals and stores it in the
+user_state_summaries table. get_user_snapshot returns it with the rest of the
+coach context, so a coach turn renders a few ready-made lines instead of
+rebuilding the picture from raw rows.
+
+Users are walked in id order, one chunk at a time, with the users of a chunk
+processed concurrently. After every chunk the cursor is written to a
+checkpoint file, so an interrupted run resumes where it stopped. A user's
+summary is only recomputed and written when their data version (bumped by
+database triggers on goals, tasks and journal entries) moved past the one it
+was built from. The summary holds no day-dependent values, so it does not go
+stale at midnight.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass, field, fields
+from datetime import date, datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from priority import mood_lowness, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Bump when the fields or their meaning change, so every stored summary is recomputed
+STATE_VERSION = 2
+DUE_SOON_DAYS = 7
+LISTED_ITEMS = 3        # overdue goals / high-impact tasks named in the summary
+MOMENTUM_DAYS = 14      # finished tasks are counted per day over this window (this week and the one before)
+MOOD_WINDOW = 3         # journals with a mood compared against the ones before them
+MOOD_TREND_DELTA = 0.15
+
+# user_id -> snapshot with goals, tasks, journals and data_version (see get_user_snapshot)
+SnapshotLoader = Callable[[str], Awaitable[Dict]]
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+@dataclass
+class UserState:
+    """Compact, structured picture of where a user stands.
+
+    Nothing stored depends on the day it was computed: overdue days, the
+    due-soon window, weekly momentum and the streak are derived from it for
+    the day it is rendered, so a summary stays valid until the data changes.
+    """
+    source_version: int = 0           # user_data_versions.version of the data it was built from
+    version: int = STATE_VERSION
+    computed_on: Optional[str] = None
+    active_goals: int = 0
+    completed_goals: int = 0
+    average_progress: Optional[int] = None
+    dated_goals: List[Dict] = field(default_factory=list)       # open goals with a due date {title, due_date, progress}, soonest first
+    open_tasks: int = 0
+    high_impact_open: List[str] = field(default_factory=list)
+    high_impact_open_count: int = 0
+    completions: Dict[str, int] = field(default_factory=dict)   # day -> tasks finished, over MOMENTUM_DAYS up to computed_on
+    last_active: Optional[str] = None  # latest day with a finished task or journal
+    run_days: int = 0                  # consecutive active days ending at last_active
+    latest_mood: Optional[str] = None
+    mood_trend: str = "unknown"       # improving | steady | declining | unknown
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "UserState":
+        known = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+    def overdue_goals(self, today: date) -> List[Dict]:
+        """{title, due_date, progress, days_overdue}, most overdue first"""
+        overdue = [{**goal, 'days_overdue': (today - date.fromisoformat(goal['due_date'])).days}
+                   for goal in self.dated_goals if date.fromisoformat(goal['due_date']) < today]
+        return overdue[:LISTED_ITEMS]
+
+    def due_soon_goals(self, today: date) -> List[Dict]:
+        """{title, due_date, progress} due within DUE_SOON_DAYS, soonest first"""
+        return [goal for goal in self.dated_goals
+                if 0 <= (date.fromisoformat(goal['due_date']) - today).days <= DUE_SOON_DAYS][:LISTED_ITEMS]
+
+    def completed_between(self, today: date, first_age: int, last_age: int) -> int:
+        """Tasks finished between first_age and last_age days ago (inclusive)"""
+        return sum(count for day, count in self.completions.items()
+                   if first_age <= (today - date.fromisoformat(day)).days <= last_age)
+
+    def momentum(self, today: date) -> str:
+        """rising | steady | slowing | stalled"""
+        return _momentum(self.completed_between(today, 0, 6), self.completed_between(today, 7, 13))
+
+    def streak_days(self, today: date) -> int:
+        """Consecutive active days up to today or yesterday; a streak is alive until a whole day passes without activity"""
+        if self.last_active is None:
+            return 0
+        return self.run_days if 0 <= (today - date.fromisoformat(self.last_active)).days <= 1 else 0
+
+
+def _day(value) -> Optional[date]:
+    moment = parse_timestamp(value)
+    return moment.date() if moment else None
+
+
+def _momentum(this_week: int, last_week: int) -> str:
+    if this_week == 0:
+        return "stalled"
+    if this_week - last_week >= 2 or last_week == 0:
+        return "rising"
+    if last_week - this_week >= 2:
+        return "slowing"
+    return "steady"
+
+
+def _activity_run(active_days: set, today: date) -> Tuple[Optional[date], int]:
+    """(latest active day up to today, consecutive active days ending there)"""
+    past = [day for day in active_days if day <= today]
+    if not past:
+        return None, 0
+    last = day = max(past)
+    run = 0
+    while day in active_days:
+        run += 1
+        day -= timedelta(days=1)
+    return last, run
+
+
+def _mood_trend(lowness: List[float]) -> str:
+    """lowness of mood-tagged journals, newest first"""
+    recent, earlier = lowness[:MOOD_WINDOW], lowness[MOOD_WINDOW:2 * MOOD_WINDOW]
+    if not recent or not earlier:
+        return "unknown"
+    change = sum(recent) / len(recent) - sum(earlier) / len(earlier)
+    if change <= -MOOD_TREND_DELTA:
+        return "improving"
+    if change >= MOOD_TREND_DELTA:
+        return "declining"
+    return "steady"
+
+
+def compute_user_state(snapshot: Dict, today: Optional[date] = None) -> UserState:
+    """Summarize a snapshot's goals, tasks and journals in one pass over each"""
+    today = today or _today()
+    state = UserState(source_version=snapshot.get('data_version') or 0, computed_on=today.isoformat())
+
+    progress_values = []
+    for goal in snapshot.get('goals') or []:
+        try:
+            progress = float(goal.get('progress') or 0)
+        except (TypeError, ValueError):
+            progress = 0.0
+        if progress >= 100:
+            state.completed_goals += 1
+            continue
+        state.active_goals += 1
+        progress_values.append(progress)
+        due = _day(goal.get('due_date'))
+        if due is not None:
+            state.dated_goals.append({'title': goal.get('title'), 'due_date': due.isoformat(), 'progress': int(progress)})
+    if progress_values:
+        state.average_progress = round(sum(progress_values) / len(progress_values))
+    state.dated_goals.sort(key=lambda goal: goal['due_date'])
+
+    active_days = set()
+    for task in snapshot.get('tasks') or []:
+        if task.get('is_completed') or task.get('status') == 'done':
+            done = _day(task.get('completed_at'))
+            if done is None:
+                continue
+            active_days.add(done)
+            # Only days a later render can still count: within MOMENTUM_DAYS of today or after it
+            if (today - done).days < MOMENTUM_DAYS:
+                state.completions[done.isoformat()] = state.completions.get(done.isoformat(), 0) + 1
+            continue
+        state.open_tasks += 1
+        if task.get('is_high_impact'):
+            state.high_impact_open_count += 1
+            if len(state.high_impact_open) < LISTED_ITEMS:
+                state.high_impact_open.append(task.get('title'))
+
+    journals = sorted(snapshot.get('journals') or [], key=lambda j: str(j.get('created_at') or ''), reverse=True)
+    lowness = []
+    for journal in journals:
+        written = _day(journal.get('created_at'))
+        if written is not None:
+            active_days.add(written)
+        value = mood_lowness(journal.get('mood'))
+        if not math.isnan(value):
+            if state.latest_mood is None:
+                state.latest_mood = str(journal.get('mood'))
+            lowness.append(value)
+    state.mood_trend = _mood_trend(lowness)
+    last_active, state.run_days = _activity_run(active_days, today)
+    state.last_active = last_active.isoformat() if last_active else None
+    return state
+
+
+def current_state(snapshot: Dict, today: Optional[date] = None) -> Tuple[UserState, bool]:
+    """(state, stored): the precomputed summary if get_user_snapshot returned one, else one computed now.
+
+    get_user_snapshot only returns the stored summary while its source_version
+    matches the user's data version, so checking it here costs nothing.
+    """
+    stored = snapshot.get('state')
+    if stored and stored.get('version') == STATE_VERSION:
+        return UserState.from_dict(stored), True
+    return compute_user_state(snapshot, today), False
+
+
+def state_lines(state: UserState, today: Optional[date] = None) -> List[str]:
+    """CURRENT STATE lines for the per-user prompt section, as of today"""
+    today = today or _today()
+    goals = f"- Goals: {state.active_goals} active, {state.completed_goals} completed"
+    if state.average_progress is not None:
+        goals += f", {state.average_progress}% average progress"
+    lines = [goals]
+    for goal in state.overdue_goals(today):
+        lines.append(f"- Overdue: {goal['title']} ({goal['days_overdue']} days late, Progress: {goal['progress']}%)")
+    for goal in state.due_soon_goals(today):
+        lines.append(f"- Due soon: {goal['title']} (Due: {goal['due_date']}, Progress: {goal['progress']}%)")
+    tasks = f"- Open tasks: {state.open_tasks} ({state.high_impact_open_count} high impact"
+    if state.high_impact_open:
+        tasks += ": " + ", ".join(str(title) for title in state.high_impact_open)
+    lines.append(tasks + ")")
+    this_week, last_week = state.completed_between(today, 0, 6), state.completed_between(today, 7, 13)
+    lines.append(
+        f"- Momentum: {state.momentum(today)} ({this_week} tasks done in the last 7 days, "
+        f"{last_week} the week before)"
+    )
+    streak = state.streak_days(today)
+    lines.append(f"- Streak: {streak} day{'' if streak == 1 else 's'}")
+    if state.latest_mood is not None:
+        lines.append(f"- Mood: {state.latest_mood} lately, trend {state.mood_trend}")
+    return lines
+
+
+class UserStateStore:
+    """user_state_summaries rows (one per user) and the user listing the batch walks"""
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    async def user_ids(self, after: Optional[str], limit: int) -> List[str]:
+        query = self.supabase.table('profiles').select('id')
+        if after is not None:
+            query = query.gt('id', after)
+        result = await query.order('id').limit(limit).execute()
+        return [row['id'] for row in result.data or []]
+
+    async def versions(self, user_ids: Sequence[str]) -> Dict[str, int]:
+        """Data version each user's stored summary was computed from (summaries of an older STATE_VERSION are left out)"""
+        result = await self.supabase.table('user_state_summaries') \
+            .select('user_id, source_version, version:state->version') \
+            .in_('user_id', list(user_ids)) \
+            .execute()
+        return {row['user_id']: row['source_version'] for row in result.data or [] if row.get('version') == STATE_VERSION}
+
+    async def save(self, states: Dict[str, UserState]):
+        """Upsert a chunk's new summaries in one request"""
+        now = datetime.now(timezone.utc).isoformat()
+        rows = [
+            {'user_id': user_id, 'state': asdict(state), 'source_version': state.source_version, 'computed_at': now}
+            for user_id, state in states.items()
+        ]
+        await self.supabase.table('user_state_summaries').upsert(rows, on_conflict='user_id').execute()
+
+
+class FileCheckpoint:
+    """Progress of the current batch run in a small JSON file, replaced atomically"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Optional[Dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, data: Dict):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+@dataclass
+class RefreshReport:
+    """Counts of one batch run; also the checkpoint contents while it is running"""
+    run_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    cursor: Optional[str] = None      # last user id of the last finished chunk
+    chunks: int = 0
+    users: int = 0
+    refreshed: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+    resumed: bool = False
+
+
+class StateRefresher:
+    """Refreshes every user's summary in chunks of ``chunk_size``, ``concurrency`` users at a time.
+
+    Users whose stored summary was built from their current data version are
+    counted as unchanged and not written. A user that fails is logged and skipped; the
+    next run tries again.
+    """
+
+    def __init__(self, store: UserStateStore, load_snapshot: SnapshotLoader, chunk_size: int = 100,
+                 concurrency: int = 8, checkpoint: Optional[FileCheckpoint] = None,
+                 today: Callable[[], date] = _today):
+        if chunk_size <= 0 or concurrency <= 0:
+            raise ValueError("chunk_size and concurrency must be positive")
+        self.store = store
+        self.load_snapshot = load_snapshot
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.checkpoint = checkpoint
+        self.today = today
+        self.last_report: Optional[RefreshReport] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self, user_ids: Optional[Sequence[str]] = None) -> RefreshReport:
+        """One pass over all users (or just ``user_ids``), resuming an interrupted pass if checkpointed"""
+        started = time.monotonic()
+        report = RefreshReport()
+        if user_ids is None and self.checkpoint is not None:
+            saved = self.checkpoint.load()
+            if saved:
+                report = RefreshReport(**{**saved, 'resumed': True})
+                logger.info(f"Resuming user state refresh {report.run_id} after user {report.cursor}")
+        today = self.today()
+        elapsed = report.seconds
+
+        pending = sorted(user_ids) if user_ids is not None else None
+        while True:
+            if pending is not None:
+                chunk, pending = pending[:self.chunk_size], pending[self.chunk_size:]
+            else:
+                chunk = await self.store.user_ids(report.cursor, self.chunk_size)
+            if not chunk:
+                break
+            await self._refresh_chunk(chunk, today, report)
+            report.cursor = chunk[-1]
+            report.chunks += 1
+            report.seconds = elapsed + time.monotonic() - started
+            if pending is None and self.checkpoint is not None:
+                self.checkpoint.save(asdict(report))
+
+        if pending is None and self.checkpoint is not None:
+            self.checkpoint.clear()
+        report.seconds = elapsed + time.monotonic() - started
+        self.last_report = report
+        logger.info(
+            f"User state refresh {report.run_id}: {report.users} users, {report.refreshed} refreshed, "
+            f"{report.unchanged} unchanged, {report.failed} failed in {report.seconds:.1f}s"
+        )
+        return report
+
+    async def _refresh_chunk(self, user_ids: List[str], today: date, report: RefreshReport):
+        stored = await self.store.versions(user_ids)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh(user_id: str) -> Optional[UserState]:
+            async with semaphore:
+                snapshot = await self.load_snapshot(user_id)
+            if user_id in stored and stored[user_id] == (snapshot.get('data_version') or 0):
+                return None
+            return compute_user_state(snapshot, today)
+
+        results = await asyncio.gather(*(refresh(user_id) for user_id in user_ids), return_exceptions=True)
+        states = {}
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error refreshing user state of {user_id}: {result}")
+                report.failed += 1
+            elif result is None:
+                report.unchanged += 1
+            else:
+                states[user_id] = result
+        if states:
+            try:
+                await self.store.save(states)
+                report.refreshed += len(states)
+            except Exception as e:
+                logger.error(f"Error saving {len(states)} user states: {e}")
+                report.failed += len(states)
+        report.users += len(user_ids)
+
+    async def start(self, interval: float):
+        """Refresh every ``interval`` seconds in the background, starting now"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self, interval: float):
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                logger.error(f"User state refresh failed: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict:
+        return asdict(self.last_report) if self.last_report else {}
+
+
+def rpc_snapshot_loader(supabase) -> SnapshotLoader:
+    """Load a user's goals, tasks and journals with the get_user_snapshot RPC"""
+    async def load(user_id: str) -> Dict:
+        result = await supabase.rpc('get_user_snapshot', {
+            'user_id_param': user_id,
+            'include_profile': False
+        }).execute()
+        return result.data or {}
+    return load
+
+
+async def _main(args):
+    from supabase import AsyncClient
+
+    url, key = os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        raise SystemExit("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY are required to read every user's data")
+    supabase = AsyncClient(url, key)
+    checkpoint = FileCheckpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.clear()
+    refresher = StateRefresher(
+        UserStateStore(supabase), rpc_snapshot_loader(supabase),
+        chunk_size=args.chunk_size, concurrency=args.concurrency, checkpoint=checkpoint
+    )
+    report = await refresher.run(args.user or None)
+    print(json.dumps(asdict(report), indent=2))
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("USER_STATE_CHUNK_SIZE", "100")))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("USER_STATE_CONCURRENCY", "8")),
+                        help="snapshot loads in flight within a chunk")
+    parser.add_argument("--checkpoint", default=os.getenv("USER_STATE_CHECKPOINT", "user_state_checkpoint.json"))
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an interrupted run")
+    parser.add_argument("--user", action="append", default=[], help="refresh only this user id, repeatable (no checkpoint)")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# PostgREST caps a response at 1000 rows by default, so embeddings are paged
+FETCH_PAGE_SIZE = 1000
+
+# Resident representations for the first search pass; "none" searches float32 directly
+QUANTIZATIONS = ("none", "float16", "int8", "binary")
+# pgvector equivalents, served by match_documents_quantized (supabase_setup.sql 6c)
+PGVECTOR_QUANTIZATIONS = ("none", "halfvec", "binary")
+# First-pass candidates per requested match that are rescored at full precision
+RERANK_FACTORS = {"float16": 2, "halfvec": 2, "int8": 4, "binary": 10}
+# Quantized rows are widened to float32 this many at a time while scoring (small enough to stay in cache)
+SCORE_CHUNK_ROWS = 128
+
+
+class VectorSearchBackend(ABC):
+    """Where query embeddings are matched against a user's stored embeddings.
+
+    ``search`` returns rows shaped like the ``match_documents`` SQL function
+    (content_type, content_id, content_text, metadata, similarity), best first.
+    """
+
+    @abstractmethod
+    async def search(self, user_id: str, query_embedding: Sequence[float], match_threshold: float, match_count: int) -> List[Dict]:
+        ...
+
+    async def search_many(self, user_id: str, query_embeddings: Sequence[Sequence[float]], match_threshold: float, match_count: int) -> List[List[Dict]]:
+        """One result list per query embedding"""
+        return list(await asyncio.gather(*(
+            self.search(user_id, embedding, match_threshold, match_count) for embedding in query_embeddings
+        )))
+
+    async def invalidate(self, user_id: str):
+        """Called after the user's embeddings changed"""
+
+    def stats(self) -> Dict:
+        return {}
+
+
+class PgVectorBackend(VectorSearchBackend):
+    """Search in Postgres through the match_documents RPC.
+
+    With ``quantization`` set to "halfvec" or "binary", match_documents_quantized
+    ranks on the compact index first and rescores the shortlist at full precision.
+    """
+
+    def __init__(self, supabase_client, quantization: str = "none", rerank_factor: Optional[int] = None):
+        if quantization not in PGVECTOR_QUANTIZATIONS:
+            raise ValueError(f"Unknown pgvector quantization {quantization!r}; expected one of {PGVECTOR_QUANTIZATIONS}")
+        self.supabase = supabase_client
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor or RERANK_FACTORS.get(quantization, 1)
+
+    async def search(self, user_id: str, query_embedding: Sequence[float], match_threshold: float, match_count: int) -> List[Dict]:
+        params = {
+            'query_embedding': list(query_embedding),
+            'match_threshold': match_threshold,
+            'match_count': match_count,
+            'user_id_filter': user_id
+        }
+        if self.quantization == "none":
+            result = await self.supabase.rpc('match_documents', params).execute()
+        else:
+            params.update(quantization=self.quantization, rerank_factor=self.rerank_factor)
+            result = await self.supabase.rpc('match_documents_quantized', params).execute()
+        return result.data or []
+
+    def stats(self) -> Dict:
+        return {'quantization': self.quantization}
+
+
+@dataclass
+class QuantizedMatrix:
+    """Compact copy of a normalized float32 matrix used for the first search pass"""
+    mode: str
+    data: np.ndarray
+    scale: Optional[np.ndarray] = None  # int8: per-row factor back to float
+    dimensions: int = 0
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes + (self.scale.nbytes if self.scale is not None else 0))
+
+
+def quantize(matrix: np.ndarray, mode: str) -> QuantizedMatrix:
+    """float16 halves the matrix, int8 (symmetric, per row) quarters it, binary keeps one sign bit per dimension"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if mode == "float16":
+        return QuantizedMatrix(mode, matrix.astype(np.float16), dimensions=matrix.shape[1])
+    if mode == "int8":
+        peak = np.abs(matrix).max(axis=1, keepdims=True)
+        scale = np.where(peak == 0, 1.0, peak / 127.0).astype(np.float32)
+        data = np.clip(np.rint(matrix / scale), -127, 127).astype(np.int8)
+        return QuantizedMatrix(mode, data, scale=scale[:, 0], dimensions=matrix.shape[1])
+    if mode == "binary":
+        return QuantizedMatrix(mode, np.packbits(matrix > 0, axis=1), dimensions=matrix.shape[1])
+    raise ValueError(f"Unknown quantization {mode!r}; expected one of {QUANTIZATIONS}")
+
+
+def approximate_scores(quantized: QuantizedMatrix, queries: np.ndarray) -> np.ndarray:
+    """First-pass scores, shape (rows, queries); higher is more similar"""
+    if quantized.mode == "binary":
+        # Agreeing sign bits minus disagreeing ones, from the Hamming distance
+        packed = np.packbits(queries > 0, axis=1)
+        hamming = np.stack([np.bitwise_count(quantized.data ^ q).sum(axis=1, dtype=np.int32) for q in packed], axis=1)
+        return (quantized.dimensions - 2 * hamming).astype(np.float32)
+    scores = np.empty((quantized.data.shape[0], queries.shape[0]), dtype=np.float32)
+    for start in range(0, quantized.data.shape[0], SCORE_CHUNK_ROWS):
+        chunk = quantized.data[start:start + SCORE_CHUNK_ROWS].astype(np.float32)
+        scores[start:start + SCORE_CHUNK_ROWS] = chunk @ queries.T
+    if quantized.scale is not None:
+        scores *= quantized.scale[:, None]
+    return scores
+
+
+@dataclass
+class UserVectors:
+    """One user's embeddings: a unit-normalized float32 matrix and the rows it holds"""
+    matrix: np.ndarray
+    rows: List[Dict]
+    loaded_at: float
+    quantized: Optional[QuantizedMatrix] = None
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes the first search pass keeps in memory"""
+        return self.quantized.nbytes if self.quantized is not None else int(self.matrix.nbytes)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _parse_vector(value) -> List[float]:
+    # PostgREST returns pgvector columns as their text form, "[0.1,0.2,...]"
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indexes of the k highest scores along axis 0, best first (works on 1-D and 2-D scores)"""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty((0,) + scores.shape[1:], dtype=np.intp)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=0)[:k]
+    else:
+        candidates = np.broadcast_to(
+            np.arange(n).reshape((n,) + (1,) * (scores.ndim - 1)), scores.shape
+        )
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=0), axis=0, kind="stable")
+    return np.take_along_axis(candidates, order, axis=0)
+
+
+class LocalVectorStore(VectorSearchBackend):
+    """In-process brute-force cosine search over per-user embedding matrices.
+
+    Each user's vectors are fetched from ``user_embeddings`` once, normalized
+    and written to ``<path>/<user hash>.<token>.npy``, named by the row
+    metadata in ``<user hash>.json``, then memory-mapped on demand. At most ``max_users`` matrices stay
+    open, evicted least-recently-used; a matrix older than ``max_age``
+    seconds is re-fetched so other instances' syncs show up. Scoring a few
+    thousand 1536-d vectors takes a few milliseconds, with no network hop.
+
+    With ``quantization`` set, a compact copy of each matrix is held in
+    memory for a first pass, and only the best ``match_count * rerank_factor``
+    candidates are rescored against the memory-mapped float32 rows.
+    """
+
+    def __init__(
+        self,
+        supabase_client,
+        path: str,
+        max_users: int = 256,
+        max_age: float = 600.0,
+        quantization: str = "none",
+        rerank_factor: Optional[int] = None,
+    ):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}; expected one of {QUANTIZATIONS}")
+        self.supabase = supabase_client
+        self.path = path
+        self.max_users = max_users
+        self.max_age = max_age
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor or RERANK_FACTORS.get(quantization, 1)
+        os.makedirs(path, exist_ok=True)
+        self._users: "OrderedDict[str, UserVectors]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, asyncio.Task] = {}
+        # Bumped by invalidate; a load that started under an older generation is not kept
+        self._generations: Dict[str, int] = {}
+        self.counters = {'hits': 0, 'disk_loads': 0, 'fetches': 0, 'evictions': 0, 'stale_loads': 0}
+
+    async def search(self, user_id: str, query_embedding: Sequence[float], match_threshold: float, match_count: int) -> List[Dict]:
+        return (await self.search_many(user_id, [query_embedding], match_threshold, match_count))[0]
+
+    async def search_many(self, user_id: str, query_embeddings: Sequence[Sequence[float]], match_threshold: float, match_count: int) -> List[List[Dict]]:
+        """Score every query against the user's matrix in one matrix product"""
+        vectors = await self._vectors(user_id)
+        queries = _normalize(np.asarray(query_embeddings, dtype=np.float32))
+        if not vectors.rows:
+            return [[] for _ in range(len(queries))]
+        results = []
+        for ids, similarities in self._rank(vectors, queries, match_count):
+            matches = []
+            for i, similarity in zip(ids, similarities):
+                if similarity <= match_threshold:
+                    break
+                matches.append({**vectors.rows[i], 'similarity': float(similarity)})
+            results.append(matches)
+        return results
+
+    def _rank(self, vectors: UserVectors, queries: np.ndarray, k: int):
+        """(row indexes, cosine similarities) of the k best rows for each query, best first"""
+        if vectors.quantized is None:
+            scores = vectors.matrix @ queries.T                  # (rows, queries)
+            best = top_k(scores, k)                              # (k, queries)
+            return [(best[:, q], scores[best[:, q], q]) for q in range(queries.shape[0])]
+        shortlist = top_k(approximate_scores(vectors.quantized, queries), k * self.rerank_factor)
+        ranked = []
+        for q in range(queries.shape[0]):
+            # Exact rescoring only reads the shortlisted rows of the mapped float32 file
+            candidates = np.sort(shortlist[:, q])
+            exact = vectors.matrix[candidates] @ queries[q]
+            best = top_k(exact, k)
+            ranked.append((candidates[best], exact[best]))
+        return ranked
+
+    async def invalidate(self, user_id: str):
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        # Searches from now on start a fresh load instead of joining one that may return old vectors
+        self._loading.pop(user_id, None)
+        await asyncio.to_thread(self._remove_files, user_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            resident = list(self._users.values())
+        return {
+            **self.counters,
+            'quantization': self.quantization,
+            'users': len(resident),
+            'vectors': sum(len(v.rows) for v in resident),
+            'bytes': sum(v.nbytes for v in resident),
+            'mapped_bytes': sum(int(v.matrix.nbytes) for v in resident),
+        }
+
+    async def _vectors(self, user_id: str) -> UserVectors:
+        with self._lock:
+            vectors = self._users.get(user_id)
+            if vectors is not None and time.time() - vectors.loaded_at < self.max_age:
+                self._users.move_to_end(user_id)
+                self.counters['hits'] += 1
+                return vectors
+        # Concurrent searches for a cold user share a single load
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(user_id))
+            self._loading[user_id] = task
+            task.add_done_callback(lambda done: self._loading.pop(user_id) if self._loading.get(user_id) is done else None)
+        return await task
+
+    async def _load(self, user_id: str) -> UserVectors:
+        generation = self._generations.get(user_id, 0)
+        vectors = await asyncio.to_thread(self._read_files, user_id)
+        if vectors is None:
+            rows, embeddings = await self._fetch(user_id)
+            vectors = await asyncio.to_thread(self._write_files, user_id, rows, embeddings)
+            self.counters['fetches'] += 1
+        else:
+            self.counters['disk_loads'] += 1
+        if self.quantization != "none" and vectors.rows:
+            vectors.quantized = await asyncio.to_thread(quantize, vectors.matrix, self.quantization)
+        with self._lock:
+            stale = self._generations.get(user_id, 0) != generation
+            if not stale:
+                self._users[user_id] = vectors
+                self._users.move_to_end(user_id)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+                    self.counters['evictions'] += 1
+        if stale:
+            # Invalidated while in flight: the searches already waiting get this result, but it may
+            # predate the change, so it is neither kept in memory nor left on disk
+            self.counters['stale_loads'] += 1
+            await asyncio.to_thread(self._remove_files, user_id)
+        return vectors
+
+    async def _fetch(self, user_id: str):
+        # Without a stable order Postgres may return overlapping pages, duplicating some rows and skipping others
+        rows, embeddings = [], []
+        start = 0
+        while True:
+            result = await self.supabase.table('user_embeddings') \
+                .select('content_type, content_id, content_text, metadata, embedding') \
+                .eq('user_id', user_id) \
+                .order('id') \
+                .range(start, start + FETCH_PAGE_SIZE - 1).execute()
+            page = result.data or []
+            for row in page:
+                embeddings.append(_parse_vector(row.pop('embedding')))
+                rows.append(row)
+            if len(page) < FETCH_PAGE_SIZE:
+                return rows, embeddings
+            start += FETCH_PAGE_SIZE
+
+    def _file(self, user_id: str, suffix: str) -> str:
+        return os.path.join(self.path, hashlib.sha256(user_id.encode()).hexdigest()[:32] + suffix)
+
+    def _read_files(self, user_id: str) -> Optional[UserVectors]:
+        rows_path = self._file(user_id, ".json")
+        try:
+            written_at = os.path.getmtime(rows_path)
+            if time.time() - written_at >= self.max_age:
+                return None
+            with open(rows_path) as f:
+                saved = json.load(f)
+            rows = saved['rows']
+            if not rows:
+                return UserVectors(matrix=np.empty((0, 0), dtype=np.float32), rows=rows, loaded_at=written_at)
+            matrix = np.load(os.path.join(self.path, os.path.basename(saved['matrix'])), mmap_mode="r")
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if matrix.shape[0] != len(rows):
+            logger.warning(f"Vector file for user {user_id} has {matrix.shape[0]} rows, expected {len(rows)}; refetching")
+            return None
+        return UserVectors(matrix=matrix, rows=rows, loaded_at=written_at)
+
+    def _write_files(self, user_id: str, rows: List[Dict], embeddings: List[List[float]]) -> UserVectors:
+        matrix = _normalize(np.asarray(embeddings, dtype=np.float32)) if rows else np.empty((0, 0), dtype=np.float32)
+        rows_path = self._file(user_id, ".json")
+        # Each write gets its own matrix file; replacing the .json that names it is the single step
+        # that publishes the pair, so a crash or a concurrent writer never leaves mismatched files
+        token = uuid.uuid4().hex
+        matrix_name = os.path.basename(self._file(user_id, f".{token}.npy")) if rows else None
+        if rows:
+            np.save(os.path.join(self.path, matrix_name), matrix)
+            matrix = np.load(os.path.join(self.path, matrix_name), mmap_mode="r")
+        previous = self._matrix_name(rows_path)
+        with open(f"{rows_path}.{token}.tmp", "w") as f:
+            json.dump({'matrix': matrix_name, 'rows': rows}, f)
+        os.replace(f"{rows_path}.{token}.tmp", rows_path)
+        if previous and previous != matrix_name:
+            self._remove(os.path.join(self.path, previous))
+        return UserVectors(matrix=matrix, rows=rows, loaded_at=time.time())
+
+    @staticmethod
+    def _matrix_name(rows_path: str) -> Optional[str]:
+        try:
+            with open(rows_path) as f:
+                return os.path.basename(json.load(f)['matrix'] or "") or None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _remove_files(self, user_id: str):
+        self._remove(self._file(user_id, ".json"))
+        for path in glob.glob(self._file(user_id, ".*.npy")):
+            self._remove(path)
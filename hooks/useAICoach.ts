@@ -4,6 +4,8 @@ import { supabase } from '@/lib/supabase';
 interface CoachQuery {
   message: string;
   chat_history?: Array<{message: string, response: string, timestamp: string}>;
+  // Server-side history: the backend loads and stores the turns of this coach_threads id
+  conversation_id?: string;
 }
 
 interface CoachResponse {
@@ -18,37 +20,107 @@ interface CoachResponse {
     profile: Record<string, any>;
     onboarding: Array<any>;
   };
+  conversation_id?: string | null;
+  // false when the backend did not store this turn (no conversation_id, or the insert failed)
+  stored?: boolean;
+  prompt_version?: string | null;
 }
 
+interface CoachStreamResult {
+  response: string;
+  relevant_data: CoachResponse['relevant_data'];
+  usage: {
+    prompt_tokens: number;
+    completion_tokens: number;
+    total_tokens: number;
+  } | null;
+  time_to_first_token_ms: number | null;
+  total_ms: number;
+  conversation_id?: string | null;
+  stored?: boolean;
+}
+
+// Parse one Server-Sent Events frame ("event: x\ndata: {...}")
+const parseSSEFrame = (frame: string): { event: string; data: any } => {
+  let event = 'message';
+  const dataLines: string[] = [];
+  for (const line of frame.split('\n')) {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trimStart());
+  }
+  return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : null };
+};
+
+const coachQuery = (
+  message: string,
+  chatHistory: CoachQuery['chat_history'],
+  conversationId?: string,
+): CoachQuery => (conversationId ? { message, conversation_id: conversationId } : { message, chat_history: chatHistory });
+
 interface EmbeddingRequest {
   user_id: string;
+  force?: boolean;
 }
 
-interface EmbeddingResponse {
-  message: string;
-  embeddings_generated: number;
+interface EmbeddingJob {
+  job_id: string;
+  status: 'queued' | 'running' | 'succeeded' | 'failed';
+  done: number;
+  total: number;
+  attempts: number;
+  error: string | null;
+  report: {
+    skipped: number;
+    embedded: number;
+    refreshed: number;
+    deleted: number;
+    elapsed_ms: number;
+  } | null;
 }
 
-export function useAICoach() {
-  const [loading, setLoading] = useState(false);
-  const [error, setError] = useState<string | null>(null);
-  
-  // Resolve backend URL from env; fall back to local during dev
-  const getBackendUrl = () => {
-    const envUrl =
-      process.env.EXPO_PUBLIC_COACH_API_BASE ||
-      process.env.EXPO_PUBLIC_RORK_API_BASE_URL ||
-      '';
+// Resolve backend URL from env; fall back to local during dev
+const getBackendUrl = () => {
+  const envUrl =
+    process.env.EXPO_PUBLIC_COACH_API_BASE ||
+    process.env.EXPO_PUBLIC_RORK_API_BASE_URL ||
+    '';
 
-    if (envUrl) return envUrl.replace(/\/$/, '');
+  if (envUrl) return envUrl.replace(/\/$/, '');
 
-    // Fallback for local development when env is not set
-    if (__DEV__) return 'http://192.168.1.239:8000';
+  // Fallback for local development when env is not set
+  if (__DEV__) return 'http://192.168.1.239:8000';
 
-    throw new Error('Coach API base URL is not configured');
-  };
+  throw new Error('Coach API base URL is not configured');
+};
+
+// Tell the coach backend to drop its cached profile/onboarding context.
+// Call after saving profile fields or onboarding answers; failures are non-fatal.
+export async function invalidateCoachContext(): Promise<void> {
+  try {
+    const { data: { session } } = await supabase.auth.getSession();
+    if (!session?.access_token) return;
 
-  const queryCoach = useCallback(async (message: string, chatHistory?: Array<{message: string, response: string, timestamp: string}>): Promise<CoachResponse | null> => {
+    await fetch(`${getBackendUrl()}/api/context/invalidate`, {
+      method: 'POST',
+      headers: {
+        'Authorization': `Bearer ${session.access_token}`,
+      },
+    });
+  } catch (err) {
+    console.warn('Coach context invalidation failed:', err);
+  }
+}
+
+export function useAICoach() {
+  const [loading, setLoading] = useState(false);
+  const [error, setError] = useState<string | null>(null);
+
+  // With a conversationId the backend keeps (and stores) the history, so chatHistory is not sent
+  const queryCoach = useCallback(async (
+    message: string,
+    chatHistory?: Array<{message: string, response: string, timestamp: string}>,
+    conversationId?: string,
+  ): Promise<CoachResponse | null> => {
     setLoading(true);
     setError(null);
     
@@ -70,10 +142,7 @@ export function useAICoach() {
           'Content-Type': 'application/json',
           'Authorization': `Bearer ${session.access_token}`,
         },
-        body: JSON.stringify({
-          message,
-          chat_history: chatHistory
-        } as CoachQuery),
+        body: JSON.stringify(coachQuery(message, chatHistory, conversationId)),
       });
 
       if (!response.ok) {
@@ -94,7 +163,93 @@ export function useAICoach() {
     }
   }, []);
 
-  const generateEmbeddings = useCallback(async (userId: string): Promise<EmbeddingResponse | null> => {
+  // Streams the coach answer from /api/coach/stream; onToken fires for every token as it arrives.
+  // Uses XMLHttpRequest because React Native's fetch does not expose a readable response stream.
+  const streamCoach = useCallback(async (
+    message: string,
+    chatHistory: Array<{message: string, response: string, timestamp: string}> | undefined,
+    onToken: (token: string, text: string) => void,
+    conversationId?: string,
+  ): Promise<CoachStreamResult | null> => {
+    setLoading(true);
+    setError(null);
+    
+    try {
+      // Get current session
+      const { data: { session } } = await supabase.auth.getSession();
+      
+      if (!session?.access_token) {
+        throw new Error('No active session found');
+      }
+
+      const backendUrl = getBackendUrl();
+      console.log('🔗 Coach stream URL:', `${backendUrl}/api/coach/stream`);
+
+      return await new Promise<CoachStreamResult>((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        let cursor = 0;
+        let text = '';
+        let settled = false;
+
+        const finish = (result: CoachStreamResult | Error) => {
+          if (settled) return;
+          settled = true;
+          if (result instanceof Error) reject(result);
+          else resolve(result);
+        };
+
+        // responseText grows as chunks arrive; only complete frames (ending in a blank line) are consumed
+        const consume = () => {
+          const body = xhr.responseText;
+          let boundary = body.indexOf('\n\n', cursor);
+          while (boundary !== -1) {
+            const { event, data } = parseSSEFrame(body.slice(cursor, boundary));
+            cursor = boundary + 2;
+            if (event === 'token' && data?.content) {
+              text += data.content;
+              onToken(data.content, text);
+            } else if (event === 'done') {
+              finish({ response: text, ...data });
+            } else if (event === 'error') {
+              finish(new Error(data?.detail || 'Coach stream failed'));
+            }
+            boundary = body.indexOf('\n\n', cursor);
+          }
+        };
+
+        xhr.open('POST', `${backendUrl}/api/coach/stream`);
+        xhr.setRequestHeader('Content-Type', 'application/json');
+        xhr.setRequestHeader('Accept', 'text/event-stream');
+        xhr.setRequestHeader('Authorization', `Bearer ${session.access_token}`);
+        xhr.onprogress = () => {
+          if (xhr.status >= 200 && xhr.status < 300) consume();
+        };
+        xhr.onload = () => {
+          if (xhr.status < 200 || xhr.status >= 300) {
+            let detail = '';
+            try { detail = JSON.parse(xhr.responseText).detail; } catch {}
+            finish(new Error(detail || `HTTP error! status: ${xhr.status}`));
+            return;
+          }
+          consume();
+          finish(new Error('Coach stream ended unexpectedly'));
+        };
+        xhr.onerror = () => finish(new Error('Network error while streaming coach response'));
+        xhr.send(JSON.stringify(coachQuery(message, chatHistory, conversationId)));
+      });
+      
+    } catch (err) {
+      const errorMessage = err instanceof Error ? err.message : 'Unknown error occurred';
+      setError(errorMessage);
+      console.error('AI Coach stream error:', err);
+      return null;
+    } finally {
+      setLoading(false);
+    }
+  }, []);
+
+  // Queues an embedding sync on the backend; poll getEmbeddingJob(job_id) for progress
+  const generateEmbeddings = useCallback(async (userId: string): Promise<EmbeddingJob | null> => {
     setLoading(true);
     setError(null);
     
@@ -124,7 +279,7 @@ export function useAICoach() {
         throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
       }
 
-      const data: EmbeddingResponse = await response.json();
+      const data: EmbeddingJob = await response.json();
       return data;
       
     } catch (err) {
@@ -137,13 +292,44 @@ export function useAICoach() {
     }
   }, []);
 
+  const getEmbeddingJob = useCallback(async (jobId: string): Promise<EmbeddingJob | null> => {
+    try {
+      const { data: { session } } = await supabase.auth.getSession();
+      
+      if (!session?.access_token) {
+        throw new Error('No active session found');
+      }
+
+      const backendUrl = getBackendUrl();
+      const response = await fetch(`${backendUrl}/api/embeddings/jobs/${jobId}`, {
+        headers: {
+          'Authorization': `Bearer ${session.access_token}`,
+        },
+      });
+
+      if (!response.ok) {
+        const errorData = await response.json().catch(() => ({}));
+        throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
+      }
+
+      const data: EmbeddingJob = await response.json();
+      return data;
+      
+    } catch (err) {
+      console.error('Embedding job status error:', err);
+      return null;
+    }
+  }, []);
+
   const clearError = useCallback(() => {
     setError(null);
   }, []);
 
   return {
     queryCoach,
+    streamCoach,
     generateEmbeddings,
+    getEmbeddingJob,
     loading,
     error,
     clearError,
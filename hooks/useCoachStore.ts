@@ -127,8 +127,25 @@ export const [CoachProvider, useCoachStore] = createContextHook(() => {
     }
   }, [storageKey]);
 
-  // Send a message
-  const sendMessage = useCallback(async (content: string, sender: "user" | "coach" = "user") => {
+  // Best-effort insert of one message into the user's thread
+  const persistMessage = useCallback(async (content: string, sender: "user" | "coach") => {
+    try {
+      const tid = await ensureThread();
+      if (tid && userId) {
+        await supabase.from("coach_messages").insert({
+          thread_id: tid,
+          user_id: userId,
+          role: sender === "user" ? "user" : "assistant",
+          content,
+        });
+      }
+    } catch (e) {
+      console.error("Failed to persist coach message:", e);
+    }
+  }, [ensureThread, userId]);
+
+  // Send a message; persist: false when the coach backend stores the turn itself (server-side conversation)
+  const sendMessage = useCallback(async (content: string, sender: "user" | "coach" = "user", { persist = true }: { persist?: boolean } = {}) => {
     if (!content.trim()) return;
 
     const newMessage: Message = {
@@ -151,21 +168,8 @@ export const [CoachProvider, useCoachStore] = createContextHook(() => {
       return updatedMessages;
     });
     
-    // best-effort persist to Supabase
-    try {
-      const tid = await ensureThread();
-      if (tid && userId) {
-        await supabase.from("coach_messages").insert({
-          thread_id: tid,
-          user_id: userId,
-          role: sender === "user" ? "user" : "assistant",
-          content,
-        });
-      }
-    } catch (e) {
-      console.error("Failed to persist coach message:", e);
-    }
-  }, [saveMessages, ensureThread, userId]);
+    if (persist) await persistMessage(content, sender);
+  }, [saveMessages, persistMessage]);
 
   // Get coach suggestions
   const getSuggestions = useCallback(() => {
@@ -193,7 +197,9 @@ export const [CoachProvider, useCoachStore] = createContextHook(() => {
     messages,
     isLoading,
     sendMessage,
+    persistMessage,
     getSuggestions,
     loadMessages,
+    ensureThread,
   };
 });
\ No newline at end of file
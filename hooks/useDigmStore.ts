@@ -6,6 +6,7 @@ import { getRandomQuote } from "@/constants/quotes";
 import { getLevelInfo } from "@/constants/colors";
 import { supabase } from "@/lib/supabase";
 import { ensureProfile } from "@/lib/supa-user";
+import { invalidateCoachContext } from "@/hooks/useAICoach";
 import { create } from "zustand";
 import { persist } from "zustand/middleware";
 
@@ -421,6 +422,7 @@ function useDigmStoreImpl() {
         .update({ xp: newXP, level: getLevelInfo(newXP).level })
         .eq("id", userId);
       if (error) console.error("Failed to persist XP:", error);
+      else invalidateCoachContext();
     },
     [userId, userProfile.xp]
   );
@@ -431,6 +433,7 @@ function useDigmStoreImpl() {
       if (!userId) return;
       const { error } = await supabase.from("profiles").update({ vision }).eq("id", userId);
       if (error) console.error("Failed to update vision:", error);
+      else invalidateCoachContext();
     },
     [userId]
   );
@@ -13,23 +13,38 @@ CREATE TABLE IF NOT EXISTS user_embeddings (
   content_text TEXT NOT NULL,
   embedding vector(1536), -- OpenAI text-embedding-3-small dimension
   metadata JSONB,
+  content_hash TEXT, -- sha256 of embedding model + content_text, used for incremental sync
+  source_updated_at TIMESTAMP WITH TIME ZONE, -- updated_at of the source row when embedded
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
   updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Incremental sync columns for tables created before they were added
+ALTER TABLE user_embeddings ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE user_embeddings ADD COLUMN IF NOT EXISTS source_updated_at TIMESTAMP WITH TIME ZONE;
+-- Long journal entries are stored as several overlapping chunks; everything else is chunk 0
+ALTER TABLE user_embeddings ADD COLUMN IF NOT EXISTS chunk_index INT NOT NULL DEFAULT 0;
+
 -- 3. Create index for faster vector similarity search
 CREATE INDEX IF NOT EXISTS idx_user_embeddings_user_id ON user_embeddings(user_id);
 CREATE INDEX IF NOT EXISTS idx_user_embeddings_content_type ON user_embeddings(content_type);
 CREATE INDEX IF NOT EXISTS idx_user_embeddings_embedding ON user_embeddings USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
+-- One row per source chunk, so embedding runs can bulk upsert on (user_id, content_type, content_id, chunk_index)
+DROP INDEX IF EXISTS idx_user_embeddings_content;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_user_embeddings_chunk ON user_embeddings(user_id, content_type, content_id, chunk_index);
 
 -- 4. Enable Row Level Security (RLS)
 ALTER TABLE user_embeddings ENABLE ROW LEVEL SECURITY;
 
 -- 5. Create RLS policy: users can only access their own embeddings
+-- The backend writes and searches them with the service role key (SUPABASE_SERVICE_ROLE_KEY), which
+-- bypasses RLS; it has no user JWT, so through the anon key this policy would hide every row
 CREATE POLICY "Users can only access their own embeddings" ON user_embeddings
   FOR ALL USING (auth.uid() = user_id);
 
 -- 6. Create function for vector similarity search with user isolation
+-- (dropped first because older versions did not return content_id)
+DROP FUNCTION IF EXISTS match_documents(vector, float, int, uuid);
 CREATE OR REPLACE FUNCTION match_documents(
   query_embedding vector(1536),
   match_threshold float DEFAULT 0.7,
@@ -39,6 +54,7 @@ CREATE OR REPLACE FUNCTION match_documents(
 RETURNS TABLE (
   id uuid,
   content_type text,
+  content_id uuid,
   content_text text,
   metadata jsonb,
   similarity float
@@ -55,6 +71,7 @@ BEGIN
   SELECT
     user_embeddings.id,
     user_embeddings.content_type,
+    user_embeddings.content_id,
     user_embeddings.content_text,
     user_embeddings.metadata,
     1 - (user_embeddings.embedding <=> query_embedding) AS similarity
@@ -67,13 +84,259 @@ BEGIN
 END;
 $$;
 
+-- 6b. Create function returning one user's complete coach context as a single JSON document
+-- Only the columns the coach prompt and API response use are projected. Columns that
+-- may not exist in every schema (display_name, mood, completed_at) are read via to_jsonb() so the
+-- function still compiles without them.
+CREATE INDEX IF NOT EXISTS idx_goals_user_id ON goals(user_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_user_id ON tasks(user_id);
+CREATE INDEX IF NOT EXISTS idx_journal_entries_user_id_created_at ON journal_entries(user_id, created_at DESC);
+
+-- Change marker for the data a coaching state summary is built from: triggers bump a user's
+-- version on every insert, update or delete of their goals, tasks and journal entries, so a
+-- stale summary is spotted by comparing two integers instead of re-reading the rows.
+-- No policies: only the service role (and the SECURITY DEFINER trigger) touches it.
+CREATE TABLE IF NOT EXISTS user_data_versions (
+  user_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+  version BIGINT NOT NULL DEFAULT 0
+);
+ALTER TABLE user_data_versions ENABLE ROW LEVEL SECURITY;
+
+CREATE OR REPLACE FUNCTION bump_user_data_version()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  owner uuid;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    owner := OLD.user_id;
+  ELSE
+    owner := NEW.user_id;
+  END IF;
+  INSERT INTO user_data_versions AS v (user_id, version) VALUES (owner, 1)
+  ON CONFLICT (user_id) DO UPDATE SET version = v.version + 1;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS bump_goals_data_version ON goals;
+CREATE TRIGGER bump_goals_data_version
+  AFTER INSERT OR UPDATE OR DELETE ON goals
+  FOR EACH ROW EXECUTE FUNCTION bump_user_data_version();
+DROP TRIGGER IF EXISTS bump_tasks_data_version ON tasks;
+CREATE TRIGGER bump_tasks_data_version
+  AFTER INSERT OR UPDATE OR DELETE ON tasks
+  FOR EACH ROW EXECUTE FUNCTION bump_user_data_version();
+DROP TRIGGER IF EXISTS bump_journal_entries_data_version ON journal_entries;
+CREATE TRIGGER bump_journal_entries_data_version
+  AFTER INSERT OR UPDATE OR DELETE ON journal_entries
+  FOR EACH ROW EXECUTE FUNCTION bump_user_data_version();
+
+-- Precomputed coaching state per user (goals by due date, recent completions, activity run, mood
+-- trend), written by the batch job in backend/user_state.py; source_version is the
+-- user_data_versions.version it was built from. Nothing in it depends on the day: overdue days,
+-- momentum and the streak are worked out when the coach renders it.
+-- The backend has no user JWT when it calls Supabase, so both the job and the coach read it through
+-- get_user_snapshot with the service role key (SUPABASE_SERVICE_ROLE_KEY), which bypasses RLS
+CREATE TABLE IF NOT EXISTS user_state_summaries (
+  user_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+  state JSONB NOT NULL,
+  source_version BIGINT NOT NULL DEFAULT -1,
+  computed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+-- Summaries from before source_version existed never match, so the next batch run rebuilds them
+ALTER TABLE user_state_summaries ADD COLUMN IF NOT EXISTS source_version BIGINT NOT NULL DEFAULT -1;
+ALTER TABLE user_state_summaries DROP COLUMN IF EXISTS source_hash;
+ALTER TABLE user_state_summaries ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Users can read their own state summary" ON user_state_summaries
+  FOR SELECT USING (auth.uid() = user_id);
+
+-- include_profile = false skips profile/onboarding when the caller has them cached
+DROP FUNCTION IF EXISTS get_user_snapshot(uuid, int);
+CREATE OR REPLACE FUNCTION get_user_snapshot(
+  user_id_param uuid,
+  journal_limit int DEFAULT 50,
+  include_profile boolean DEFAULT true
+)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT jsonb_build_object(
+    'profile', (
+      SELECT jsonb_build_object(
+        'id', p.id,
+        'display_name', to_jsonb(p) -> 'display_name',
+        'first_name', p.first_name,
+        'vision', p.vision,
+        'level', p.level,
+        'xp', p.xp
+      )
+      FROM profiles p
+      WHERE include_profile AND p.id = user_id_param
+    ),
+    'onboarding', COALESCE((
+      SELECT jsonb_agg(oa.data)
+      FROM onboarding_answers oa
+      WHERE include_profile AND oa.user_id = user_id_param
+    ), '[]'::jsonb),
+    'goals', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object(
+        'id', g.id,
+        'title', g.title,
+        'due_date', g.due_date,
+        'progress', g.progress,
+        'timeframe', g.timeframe
+      ) ORDER BY g.created_at)
+      FROM goals g
+      WHERE g.user_id = user_id_param
+    ), '[]'::jsonb),
+    'tasks', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object(
+        'id', t.id,
+        'title', t.title,
+        'status', t.status,
+        'is_high_impact', t.is_high_impact,
+        'is_completed', t.status = 'done',
+        'goal_id', t.goal_id,
+        'completed_at', to_jsonb(t) -> 'completed_at'
+      ) ORDER BY t.created_at)
+      FROM tasks t
+      WHERE t.user_id = user_id_param
+    ), '[]'::jsonb),
+    'journals', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object(
+        'id', j.id,
+        'content', j.content,
+        'mood', to_jsonb(j) -> 'mood',
+        'created_at', j.created_at
+      ) ORDER BY j.created_at DESC)
+      FROM (
+        SELECT *
+        FROM journal_entries
+        WHERE journal_entries.user_id = user_id_param
+        ORDER BY created_at DESC
+        LIMIT journal_limit
+      ) j
+    ), '[]'::jsonb),
+    -- The stored summary only while it was built from the current version of the data
+    'state', (
+      SELECT s.state
+      FROM user_state_summaries s
+      WHERE s.user_id = user_id_param
+        AND s.source_version = COALESCE((SELECT v.version FROM user_data_versions v WHERE v.user_id = user_id_param), 0)
+    ),
+    'data_version', COALESCE((SELECT v.version FROM user_data_versions v WHERE v.user_id = user_id_param), 0)
+  );
+$$;
+
+-- 6c. Optional: quantized first-pass vector search (pgvector >= 0.7.0)
+-- Rows keep their full-precision embedding. The function ranks
+-- match_count * rerank_factor rows on a compact form (half precision, or one
+-- bit per dimension), then rescores just those against the full vector. Enable
+-- it with VECTOR_QUANTIZATION=halfvec or VECTOR_QUANTIZATION=binary (see
+-- backend/README.md). Creating the function works on any pgvector version; it
+-- only fails when called on one without halfvec / binary_quantize.
+--
+-- Without an index the shortlist is an exact scan of the user's own rows,
+-- which is fast at per-user sizes. Compact HNSW indexes only pay off for large
+-- users, and every write to user_embeddings then maintains them. A global
+-- HNSW index queried with WHERE user_id = ... returns about hnsw.ef_search
+-- global neighbours before the filter (often none of them the user's), or the
+-- planner skips it, so it also needs SET hnsw.iterative_scan = relaxed_order
+-- (pgvector >= 0.8.0), or a partial / partitioned index per user group:
+--
+-- CREATE INDEX IF NOT EXISTS idx_user_embeddings_embedding_half ON user_embeddings
+--   USING hnsw ((embedding::halfvec(1536)) halfvec_cosine_ops);
+-- CREATE INDEX IF NOT EXISTS idx_user_embeddings_embedding_bit ON user_embeddings
+--   USING hnsw ((binary_quantize(embedding)::bit(1536)) bit_hamming_ops);
+
+CREATE OR REPLACE FUNCTION match_documents_quantized(
+  query_embedding vector(1536),
+  match_threshold float DEFAULT 0.7,
+  match_count int DEFAULT 10,
+  user_id_filter uuid DEFAULT NULL,
+  quantization text DEFAULT 'halfvec',
+  rerank_factor int DEFAULT 4
+)
+RETURNS TABLE (
+  id uuid,
+  content_type text,
+  content_id uuid,
+  content_text text,
+  metadata jsonb,
+  similarity float
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF user_id_filter IS NULL THEN
+    RAISE EXCEPTION 'user_id_filter is required for security';
+  END IF;
+
+  -- The shortlists below filter on user_id, so an HNSW index on the compact form
+  -- only helps with hnsw.iterative_scan enabled or a partial / partitioned index
+  -- (see above); otherwise they scan the user's rows through idx_user_embeddings_user_id
+  IF quantization = 'binary' THEN
+    RETURN QUERY
+    WITH shortlist AS (
+      SELECT e.id, e.content_type, e.content_id, e.content_text, e.metadata, e.embedding
+      FROM user_embeddings e
+      WHERE e.user_id = user_id_filter
+      ORDER BY binary_quantize(e.embedding)::bit(1536) <~> binary_quantize(query_embedding)
+      LIMIT match_count * rerank_factor
+    )
+    SELECT s.id, s.content_type, s.content_id, s.content_text, s.metadata,
+      1 - (s.embedding <=> query_embedding) AS similarity
+    FROM shortlist s
+    WHERE 1 - (s.embedding <=> query_embedding) > match_threshold
+    ORDER BY s.embedding <=> query_embedding
+    LIMIT match_count;
+  ELSIF quantization = 'halfvec' THEN
+    RETURN QUERY
+    WITH shortlist AS (
+      SELECT e.id, e.content_type, e.content_id, e.content_text, e.metadata, e.embedding
+      FROM user_embeddings e
+      WHERE e.user_id = user_id_filter
+      ORDER BY e.embedding::halfvec(1536) <=> query_embedding::halfvec(1536)
+      LIMIT match_count * rerank_factor
+    )
+    SELECT s.id, s.content_type, s.content_id, s.content_text, s.metadata,
+      1 - (s.embedding <=> query_embedding) AS similarity
+    FROM shortlist s
+    WHERE 1 - (s.embedding <=> query_embedding) > match_threshold
+    ORDER BY s.embedding <=> query_embedding
+    LIMIT match_count;
+  ELSE
+    RAISE EXCEPTION 'quantization must be halfvec or binary, got %', quantization;
+  END IF;
+END;
+$$;
+
+-- To also halve the table itself (about 6 KB -> 3 KB per row), store the
+-- column as halfvec. Reranking then happens at half precision, which in
+-- practice does not change the top results. Both match functions must then compare
+-- against query_embedding::halfvec(1536), and the ivfflat index is rebuilt
+-- as halfvec_cosine_ops:
+--
+-- DROP INDEX IF EXISTS idx_user_embeddings_embedding;
+-- DROP INDEX IF EXISTS idx_user_embeddings_embedding_half;
+-- ALTER TABLE user_embeddings ALTER COLUMN embedding TYPE halfvec(1536);
+-- CREATE INDEX idx_user_embeddings_embedding ON user_embeddings USING hnsw (embedding halfvec_cosine_ops);
+
 -- 7. Create function to clean up old embeddings when content is deleted
+-- The content_type ('goal', 'task', 'journal') is passed as the trigger argument because it
+-- differs from the table name. The backend's embedding sync also deletes rows whose source is
+-- gone, so these triggers are optional.
 CREATE OR REPLACE FUNCTION cleanup_embeddings()
 RETURNS TRIGGER AS $$
 BEGIN
   -- Delete embeddings when the original content is deleted
   DELETE FROM user_embeddings 
-  WHERE content_id = OLD.id AND content_type = TG_TABLE_NAME;
+  WHERE content_id = OLD.id AND content_type = TG_ARGV[0];
   
   RETURN OLD;
 END;
@@ -84,7 +347,13 @@ $$ LANGUAGE plpgsql;
 -- Example for goals table (adjust table names as needed):
 -- CREATE TRIGGER cleanup_goal_embeddings
 --   AFTER DELETE ON goals
---   FOR EACH ROW EXECUTE FUNCTION cleanup_embeddings();
+--   FOR EACH ROW EXECUTE FUNCTION cleanup_embeddings('goal');
+-- CREATE TRIGGER cleanup_task_embeddings
+--   AFTER DELETE ON tasks
+--   FOR EACH ROW EXECUTE FUNCTION cleanup_embeddings('task');
+-- CREATE TRIGGER cleanup_journal_embeddings
+--   AFTER DELETE ON journal_entries
+--   FOR EACH ROW EXECUTE FUNCTION cleanup_embeddings('journal');
 
 -- 9. Create function to update embeddings when content changes
 CREATE OR REPLACE FUNCTION update_embedding_timestamp()
@@ -126,6 +395,8 @@ LEFT JOIN tasks t ON ue.content_type = 'task' AND ue.content_id = t.id;
 GRANT USAGE ON SCHEMA public TO anon, authenticated;
 GRANT ALL ON user_embeddings TO anon, authenticated;
 GRANT EXECUTE ON FUNCTION match_documents TO anon, authenticated;
+GRANT EXECUTE ON FUNCTION match_documents_quantized TO anon, authenticated;
+GRANT EXECUTE ON FUNCTION get_user_snapshot TO anon, authenticated;
 
 -- 13. Create function to get embedding statistics for a user
 CREATE OR REPLACE FUNCTION get_user_embedding_stats(user_id_param uuid)
@@ -152,11 +423,36 @@ $$;
 -- 14. Grant execute permission on stats function
 GRANT EXECUTE ON FUNCTION get_user_embedding_stats TO anon, authenticated;
 
+-- 15. Coach conversations kept server-side (the app already creates threads and messages;
+-- these statements are idempotent). The backend folds older turns into coach_threads.summary
+-- and only loads messages newer than summarized_until, so each turn's history stays bounded.
+-- The backend reads and writes these tables with the service role key (past RLS), filtering
+-- every query on the user id of the verified token.
+CREATE TABLE IF NOT EXISTS coach_threads (
+  id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+  user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+CREATE TABLE IF NOT EXISTS coach_messages (
+  id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+  thread_id UUID REFERENCES coach_threads(id) ON DELETE CASCADE,
+  user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE,
+  role TEXT NOT NULL,
+  content TEXT NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+ALTER TABLE coach_threads ADD COLUMN IF NOT EXISTS summary TEXT;
+ALTER TABLE coach_threads ADD COLUMN IF NOT EXISTS summarized_until TIMESTAMP WITH TIME ZONE;
+ALTER TABLE coach_threads ADD COLUMN IF NOT EXISTS summarized_turns INT NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS idx_coach_threads_user_id ON coach_threads(user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_coach_messages_thread_created_at ON coach_messages(thread_id, created_at DESC);
+
 -- Verification queries (run these to check setup)
 -- SELECT * FROM pg_extension WHERE extname = 'vector';
 -- \dt user_embeddings
 -- SELECT * FROM user_embeddings LIMIT 5;
 -- SELECT * FROM get_user_embedding_stats('your-user-id-here');
+-- SELECT get_user_snapshot('your-user-id-here');
 
 -- Notes:
 -- 1. Run this script in your Supabase SQL Editor